@@ -1,12 +1,75 @@
 # Car.py
 
-import random
+import bisect
 import numpy as np
 import logging
+from acc import DEFAULT_ACC
 
 SEED = 42
-np.random.seed(SEED)
-random.seed(SEED)
+
+# Fallback stream for cars created without an explicit generator
+default_rng = np.random.default_rng(SEED)
+
+def draw_speed_offsets(rng, num_cars, prob_faster=0.20, prob_slower=0.10, prob_normal=0.70):
+    """
+    Draw the speed offsets of `num_cars` human drivers in two vectorized calls.
+
+    A driver is faster (offset +1 or +2), slower (-1 or -2) or normal (0) with the given
+    probabilities; the magnitude is drawn for every car and only used by the first two.
+
+    Parameters:
+        rng (np.random.Generator): Random stream of the road.
+        num_cars (int): Number of offsets to draw.
+        prob_faster (float, optional): Probability of a driver being faster.
+        prob_slower (float, optional): Probability of a driver being slower.
+        prob_normal (float, optional): Probability of a driver driving normally.
+
+    Returns:
+        ndarray: int32 offsets.
+
+    Raises:
+        ValueError: If the probabilities do not sum to 1.
+    """
+    if not np.isclose(prob_faster + prob_slower + prob_normal, 1.0):
+        raise ValueError("Probabilities must sum to 1.")
+    category = rng.choice(3, size=num_cars, p=[prob_faster, prob_slower, prob_normal])
+    magnitude = rng.integers(1, 3, size=num_cars)
+    return np.select([category == 0, category == 1], [magnitude, -magnitude], 0).astype(np.int32)
+
+
+class RoadParameters:
+    """
+    Parameters shared by all cars of one road. Each Car holds a reference to one of these
+    instead of its own copies.
+    """
+
+    __slots__ = ('road_length', 'cell_width', 'max_speed', 'p_fault', 'p_slow', 'rng', 'acc')
+
+    def __init__(self, road_length, cell_width, max_speed, p_fault, p_slow, rng=None, acc=None):
+        """
+        Parameters:
+            road_length (int): Length of the road.
+            cell_width (int): Width of each cell on the road.
+            max_speed (int): Maximum speed of the road.
+            p_fault (float): Probability of a random slowdown (fault).
+            p_slow (float): Probability of slow-to-start behavior.
+            rng (np.random.Generator, optional): Random stream of the road.
+            acc (ACCParameters, optional): Controller parameters of the road's ACC cars.
+                Defaults to acc.DEFAULT_ACC.
+        """
+        self.road_length = road_length
+        self.cell_width = cell_width
+        self.max_speed = max_speed
+        self.p_fault = p_fault
+        self.p_slow = p_slow
+        self.rng = rng if rng is not None else default_rng
+        self.acc = acc if acc is not None else DEFAULT_ACC
+
+
+def _road_parameter(name):
+    return property(lambda car: getattr(car.road, name),
+                    doc=f"The road's {name} (shared by all its cars).")
+
 
 class Car:
     # Define possible speed offsets
@@ -14,9 +77,25 @@ class Car:
     SPEED_SLOW = [-1, -2]
     SPEED_NORMAL = [0]
 
-    def __init__(self, road_length, cell_width, max_speed, p_fault, p_slow,
-                 prob_faster=0.20, prob_slower=0.10, prob_normal=0.70,
-                 position=None, velocity=None, adaptive_cruise_control=False):
+    # Per-car state only; everything shared lives in self.road. No instance __dict__.
+    __slots__ = ('road', 'position', 'velocity', 'adaptive_cruise_control', 'speed_offset',
+                 'slow_to_start', 'last_error', 'integral_error', 'total_distance', 'stops',
+                 'time_in_traffic')
+
+    road_length = _road_parameter('road_length')
+    cell_width = _road_parameter('cell_width')
+    max_speed = _road_parameter('max_speed')
+    # For ACC cars, target_speed = max_speed
+    target_speed = _road_parameter('max_speed')
+    p_fault = _road_parameter('p_fault')
+    p_slow = _road_parameter('p_slow')
+    rng = _road_parameter('rng')
+    acc = _road_parameter('acc')
+
+    def __init__(self, road_length=None, cell_width=1, max_speed=None, p_fault=None,
+                 p_slow=None, prob_faster=0.20, prob_slower=0.10, prob_normal=0.70,
+                 position=None, velocity=None, adaptive_cruise_control=False, rng=None,
+                 acc=None, road=None, speed_offset=None):
 
         """
         Initialize a Car instance.
@@ -33,35 +112,73 @@ class Car:
             position (int, optional): Initial position of the car. Random if None.
             velocity (int, optional): Initial velocity of the car.
             adaptive_cruise_control (bool, optional): Whether the car uses ACC.
+            rng (np.random.Generator, optional): Random stream of the car's road.
+            acc (ACCParameters, optional): Controller parameters, shared by the cars of a
+                road. Defaults to acc.DEFAULT_ACC.
+            road (RoadParameters, optional): Shared parameters of the car's road; replaces
+                road_length ... p_slow, rng and acc.
+            speed_offset (int, optional): Speed offset of a human driver; drawn with the
+                prob_* probabilities if None.
         """
-        self.road_length = road_length
-        self.cell_width = cell_width
-        self.max_speed = max_speed
-        self.p_fault = p_fault
-        self.p_slow = p_slow
-        self.position = position if position is not None else np.random.randint(0, road_length)
-        self.velocity = velocity if velocity is not None else np.random.randint(1, max_speed + 1)
-
+        if road is None:
+            road = RoadParameters(road_length, cell_width, max_speed, p_fault, p_slow, rng, acc)
+        self.road = road
+        self.position = position if position is not None else int(road.rng.integers(0, road.road_length))
+        self.velocity = velocity if velocity is not None else int(road.rng.integers(1, road.max_speed + 1))
         self.adaptive_cruise_control = adaptive_cruise_control
 
+        # Assign speed offset based on probabilities
+        if self.adaptive_cruise_control:
+            # For Adaptive Cruise Control (ACC) cars, no speed offset
+            self.speed_offset = 0
+        elif speed_offset is not None:
+            self.speed_offset = speed_offset
+        else:
+            self.assign_speed_offset(prob_faster, prob_slower, prob_normal)
+
+        self.slow_to_start = False
+        self.last_error = 0.0
+        self.integral_error = 0.0
         self.total_distance = 0
         self.stops = 0
         self.time_in_traffic = 0
-        self.slow_to_start = False
 
-        # For ACC cars, target_speed = max_speed
-        self.target_speed = self.max_speed
+    @classmethod
+    def fleet(cls, road, positions, velocities, adaptive_cruise_control, speed_offsets):
+        """
+        Create the cars of one road from per-car arrays, without per-car random draws.
 
-        # Assign speed offset based on probabilities
-        if not self.adaptive_cruise_control:
-            self.assign_speed_offset(prob_faster, prob_slower, prob_normal)
-        else:
-            # For Adaptive Cruise Control (ACC) cars, no speed offset
-            self.speed_offset = 0
+        Parameters:
+            road (RoadParameters): Shared parameters of the road.
+            positions, velocities, speed_offsets (array-like): Per-car integers.
+            adaptive_cruise_control (array-like): Per-car ACC flags. ACC cars get offset 0.
 
-            # PID controller variables for ACC
-            self.last_error = 0.0
-            self.integral_error = 0.0
+        Returns:
+            list: The cars, in array order.
+        """
+        adaptive_cruise_control = np.asarray(adaptive_cruise_control, dtype=bool)
+        speed_offsets = np.where(adaptive_cruise_control, 0, speed_offsets)
+        make = cls.__new__
+        roads = [road] * len(adaptive_cruise_control)
+
+        def build(road, position, velocity, acc_flag, speed_offset):
+            car = make(cls)
+            car.road = road
+            car.position = position
+            car.velocity = velocity
+            car.adaptive_cruise_control = acc_flag
+            car.speed_offset = speed_offset
+            car.slow_to_start = False
+            car.last_error = 0.0
+            car.integral_error = 0.0
+            car.total_distance = 0
+            car.stops = 0
+            car.time_in_traffic = 0
+            return car
+
+        return list(map(build, roads, np.asarray(positions).tolist(),
+                        np.asarray(velocities).tolist(), adaptive_cruise_control.tolist(),
+                        speed_offsets.tolist()))
 
     def assign_speed_offset(self, prob_faster, prob_slower, prob_normal):
         """
@@ -72,35 +189,27 @@ class Car:
             prob_slower (float): Probability of the car being slower.
             prob_normal (float): Probability of the car driving normally.
         """
-        categories = ['faster', 'slower', 'normal']
-        probabilities = [prob_faster, prob_slower, prob_normal]
-
-        # Validate probabilities
-        if not np.isclose(sum(probabilities), 1.0):
-            raise ValueError("Probabilities must sum to 1.")
-
-        # Choose a category based on the defined probabilities
-        category = np.random.choice(categories, p=probabilities)
-
-        # Assign speed offset based on the chosen category
-        if category == 'faster':
-            self.speed_offset = np.random.choice(self.SPEED_FAST)
-        elif category == 'slower':
-            self.speed_offset = np.random.choice(self.SPEED_SLOW)
-        else:
-            self.speed_offset = 0
+        self.speed_offset = int(draw_speed_offsets(self.road.rng, 1, prob_faster, prob_slower,
+                                                   prob_normal)[0])
 
-        # Log assigned category and speed_offset
-        logging.debug(f"Assigned Category: {category}, Speed Offset: {self.speed_offset}")
+        # Log assigned speed_offset
+        logging.debug("Assigned speed offset: %d", self.speed_offset)
 
-    def update_velocity(self, distance_to_next_car, velocity_of_next_car):
+    def update_velocity(self, distance_to_next_car, velocity_of_next_car, rand=None):
         """
         Update the car's velocity based on its current state and surroundings.
 
         Parameters:
             distance_to_next_car (int): Distance to the next car.
             velocity_of_next_car (int): Velocity of the next car.
+            rand (float, optional): Uniform [0, 1) draw for this step, usually taken from a
+                per-tick vector drawn for the whole road. Drawn from self.rng if None. It is
+                used for slow-to-start when stopped and for the random slowdown otherwise.
         """
+        road = self.road
+        if rand is None:
+            rand = road.rng.random()
+
         # Slow-to-Start Logic
         if self.velocity == 0:
             if distance_to_next_car > 1:
@@ -108,7 +217,7 @@ class Car:
                     self.velocity = 1
                     self.slow_to_start = False
                 else:
-                    if np.random.rand() < self.p_slow:
+                    if rand < road.p_slow:
                         self.slow_to_start = True
                         self.velocity = 0
                     else:
@@ -120,21 +229,15 @@ class Car:
             return  # Exit here if car was stopped
 
         if self.adaptive_cruise_control:
-            # Adaptive Cruise Control Parameters
-            safe_time_headway = 2.0  # Desired time gap in simulation steps
-            standstill_distance = 1.0  # Desired distance gap at standstill (1 cell)
-            w_speed = 0.5  # Weight for speed error in combined error calculation
-            kp = 0.5  # Proportional gain
-            ki = 0.0  # Integral gain
-            kd = 0.2  # Derivative gain
+            acc = road.acc
 
             # Compute desired gap based on current velocity
-            desired_gap = standstill_distance + self.velocity * safe_time_headway
+            desired_gap = acc.standstill_distance + self.velocity * acc.safe_time_headway
 
             # Error: positive error means we want a larger gap (too close), negative means too large a gap
             error_distance = desired_gap - distance_to_next_car
             error_speed = velocity_of_next_car - self.velocity
-            combined_error = error_distance + w_speed * error_speed
+            combined_error = error_distance + acc.w_speed * error_speed
 
             # PID Update
             self.integral_error += combined_error
@@ -142,26 +245,24 @@ class Car:
             self.last_error = combined_error
 
             # PID output for acceleration/deceleration
-            acceleration_change = kp * combined_error + ki * self.integral_error + kd * derivative_error
+            acceleration_change = (acc.kp * combined_error + acc.ki * self.integral_error
+                                   + acc.kd * derivative_error)
 
-            # Use a threshold to decide when to adjust speed
-            threshold = 0.5  # Threshold for deciding when to increment/decrement speed
-
-            if acceleration_change > threshold:
+            if acceleration_change > acc.threshold:
                 # Too close, slow down
                 self.velocity = max(self.velocity - 1, 0)
-            elif acceleration_change < -threshold and self.velocity < self.target_speed:
+            elif acceleration_change < -acc.threshold and self.velocity < road.max_speed:
                 # Too far, speed up
-                self.velocity = min(self.velocity + 1, self.target_speed)
+                self.velocity = min(self.velocity + 1, road.max_speed)
 
             # Reduce random slowdowns drastically for ACC
-            effective_p_fault = self.p_fault * 0.01  # 1% of original fault probability
-            if self.velocity > 0 and np.random.rand() < effective_p_fault:
+            effective_p_fault = road.p_fault * acc.fault_factor
+            if self.velocity > 0 and rand < effective_p_fault:
                 self.velocity = max(self.velocity - 1, 0)
 
         else:
             # Road 2 logic
-            effective_max_speed = self.max_speed + self.speed_offset
+            effective_max_speed = road.max_speed + self.speed_offset
 
             # Rule 2: Deceleration near next car
             if distance_to_next_car <= self.velocity:
@@ -183,15 +284,113 @@ class Car:
 
             # Rule 5: Randomization
             if self.velocity > 0:
-                if np.random.rand() < self.p_fault:
+                if rand < road.p_fault:
                     self.velocity = max(self.velocity - 1, 0)
 
     def move(self):
         """
         Move the car based on its current velocity.
         """
-        self.position = (self.position + self.velocity) % self.road_length
+        self.position = (self.position + self.velocity) % self.road.road_length
         self.total_distance += self.velocity
         if self.velocity == 0:
             self.stops += 1
         self.time_in_traffic += 1
+
+
+class CarRing:
+    """
+    The cars of one single-lane ring road, plus their cyclic (ring) order.
+
+    Reads like a list of the cars in creation order (len, iteration, indexing); `order`
+    holds the same cars sorted by position, starting at the car with the smallest
+    position. Cars cannot overtake on a single lane, so the cyclic order survives a tick
+    and only its origin shifts. move_all() finds the new origin while moving the cars, and
+    the order is only re-sorted if a collision broke it. append() and remove() are the only
+    ways to add and remove cars, so the order stays valid.
+    """
+
+    def __init__(self, cars=(), order=None):
+        """
+        Parameters:
+            cars (iterable, optional): The cars, in creation order.
+            order (array-like, optional): Indices of the cars sorted by position (e.g. a
+                stable np.argsort of their positions), to skip sorting the Car objects.
+        """
+        self.cars = list(cars)
+        if order is None:
+            self.rebuild()
+        else:
+            self.order = list(map(self.cars.__getitem__, np.asarray(order).tolist()))
+
+    @classmethod
+    def from_arrays(cls, road, positions, velocities, adaptive_cruise_control, speed_offsets):
+        """
+        Build a ring of Car objects from per-car arrays (see Car.fleet).
+        """
+        positions = np.asarray(positions)
+        cars = Car.fleet(road, positions, velocities, adaptive_cruise_control, speed_offsets)
+        if np.all(positions[1:] >= positions[:-1]):
+            # Already in ring order (see Simulation.initialize_cars): no sort, no gather
+            ring = cls()
+            ring.cars = cars
+            ring.order = list(cars)
+            return ring
+        return cls(cars, np.argsort(positions, kind='stable'))
+
+    def __len__(self):
+        return len(self.cars)
+
+    def __iter__(self):
+        return iter(self.cars)
+
+    def __getitem__(self, index):
+        return self.cars[index]
+
+    def rebuild(self):
+        # Stable sort: cars sharing a cell stay in list order, like in update_road before
+        self.order = sorted(self.cars, key=lambda car: car.position)
+
+    def append(self, car):
+        self.cars.append(car)
+        # After any cars already in the cell, matching the stable sort in rebuild()
+        index = bisect.bisect_right(self.order, car.position, key=lambda c: c.position)
+        self.order.insert(index, car)
+
+    def remove(self, car):
+        self.cars.remove(car)
+        self.order.remove(car)
+
+    def move_all(self):
+        """
+        Move every car (Car.move) and restore the ring order for the next tick.
+        """
+        order = self.order
+        num_cars = len(order)
+        if num_cars == 0:
+            return
+
+        descents = 0
+        origin = 0
+        tie = False
+        previous = None
+        for i, car in enumerate(order):
+            car.move()
+            position = car.position
+            if previous is not None and position <= previous:
+                tie |= position == previous
+                descents += 1
+                origin = i
+            previous = position
+
+        # Wrap-around pair: the last car to the first one
+        if num_cars > 1 and order[0].position <= previous:
+            tie |= order[0].position == previous
+            descents += 1
+            origin = 0
+
+        if tie or descents > 1:
+            # A collision broke the ring order; sort again (close to linear, nearly sorted)
+            self.rebuild()
+        elif origin:
+            self.order = order[origin:] + order[:origin]
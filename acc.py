@@ -0,0 +1,59 @@
+# acc.py
+
+from collections import namedtuple
+
+# Adaptive Cruise Control parameters and their defaults
+ACC_DEFAULTS = {
+    'safe_time_headway': 2.0,  # Desired time gap in simulation steps
+    'standstill_distance': 1.0,  # Desired distance gap at standstill (cells)
+    'w_speed': 0.5,  # Weight of the speed error in the combined error
+    'kp': 0.5,  # Proportional gain
+    'ki': 0.0,  # Integral gain
+    'kd': 0.2,  # Derivative gain
+    'threshold': 0.5,  # PID output beyond which the speed changes by one
+    'fault_factor': 0.01,  # Share of p_fault left for ACC cars (random slowdowns)
+}
+
+
+class ACCParameters(namedtuple('ACCParameters', ACC_DEFAULTS, defaults=ACC_DEFAULTS.values())):
+    """
+    Controller parameters of the ACC cars of one road, held once by the road (and shared by
+    its Car objects) instead of being set up on every velocity update.
+
+    A tuple, so the kernels take it unpacked (*acc) in field order.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, parameters=None):
+        """
+        Build parameters from None (defaults), a dict of overrides or an ACCParameters.
+
+        Raises:
+            ValueError: On unknown names or invalid values.
+        """
+        if parameters is None:
+            return cls()
+        if isinstance(parameters, cls):
+            return parameters
+        unknown = set(parameters) - set(ACC_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown ACC parameters: {sorted(unknown)}")
+        acc = cls(**{name: float(value) for name, value in parameters.items()})
+        if acc.safe_time_headway < 0 or acc.standstill_distance < 0 or acc.threshold < 0:
+            raise ValueError("safe_time_headway, standstill_distance and threshold must not "
+                             "be negative.")
+        if not 0.0 <= acc.fault_factor <= 1.0:
+            raise ValueError("fault_factor must be between 0 and 1.")
+        return acc
+
+    def overrides(self):
+        """
+        Return the parameters that differ from the defaults, as a dict.
+        """
+        return {name: value for name, value in self._asdict().items()
+                if value != ACC_DEFAULTS[name]}
+
+
+DEFAULT_ACC = ACCParameters()
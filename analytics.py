@@ -0,0 +1,327 @@
+# analytics.py
+
+import base64
+
+import numpy as np
+
+# Most columns of a space-time raster and segments of a fundamental diagram; longer roads
+# are binned, so analytics memory and /analytics payloads do not grow with the road
+MAX_COLUMNS = 1000
+
+
+def _ordered(values, index, filled):
+    """
+    Rows of a ring buffer from oldest to newest.
+    """
+    if filled < len(values):
+        return values[:filled]
+    return np.concatenate((values[index:], values[:index]))
+
+
+class SpaceTimeRaster:
+    """
+    Occupancy of the road over the last `window` steps (a space-time diagram).
+
+    The road is cut into at most `columns` columns of cells_per_column cells each. Each row
+    holds velocity + 1 of the slowest car in a column (the one a jam shows up in) and 0 for
+    empty columns. Updating overwrites the oldest row, so a step costs O(cars + columns).
+    """
+
+    def __init__(self, road_length, window=200, columns=MAX_COLUMNS):
+        self.cells_per_column = -(-road_length // columns)
+        width = -(-road_length // self.cells_per_column)
+        self.values = np.zeros((window, width), dtype=np.uint8)
+        self.index = 0
+        self.filled = 0
+
+    def update(self, positions, velocities):
+        row = self.values[self.index]
+        row[:] = 0
+        cells = np.clip(velocities, 0, 254).astype(np.uint8) + 1
+        if self.cells_per_column == 1:
+            row[positions] = cells
+        else:
+            columns = positions // self.cells_per_column
+            row[columns] = 255
+            np.minimum.at(row, columns, cells)
+        self.index = (self.index + 1) % len(self.values)
+        self.filled = min(self.filled + 1, len(self.values))
+
+    def rows(self):
+        return _ordered(self.values, self.index, self.filled)
+
+
+class LoopDetectors:
+    """
+    Virtual loop detectors: cars crossing given cells, counted per step over a window.
+
+    A car crosses a detector cell when the cell lies in (old position, new position] on the
+    ring; all lanes of the cell count. Needs positions in vehicle order, or the vehicle ids
+    on roads where cars come and go.
+    """
+
+    def __init__(self, road_length, cells, window=100):
+        self.road_length = road_length
+        self.cells = np.asarray(cells, dtype=np.int64) % road_length
+        self.counts = np.zeros((window, len(self.cells)), dtype=np.int32)
+        self.speeds = np.zeros((window, len(self.cells)))
+        self.totals = np.zeros(len(self.cells), dtype=np.int64)
+        self.index = 0
+        self.filled = 0
+        self.previous = None
+        self.previous_ids = None
+
+    def update(self, positions, velocities, ids=None):
+        previous, previous_ids = self.previous, self.previous_ids
+        self.previous, self.previous_ids = positions, ids
+        if previous is None:
+            return
+        if ids is not None:
+            # Only the cars on the road in both steps
+            _, current, before = np.intersect1d(ids, previous_ids, assume_unique=True,
+                                                return_indices=True)
+            positions, velocities = positions[current], velocities[current]
+            previous = previous[before]
+        elif len(previous) != len(positions):
+            return
+        travelled = (positions - previous) % self.road_length
+        # Only cars that moved can cross a detector
+        moving = np.flatnonzero(travelled)
+        offsets = (self.cells[None, :] - previous[moving, None]) % self.road_length
+        crossed = (offsets >= 1) & (offsets <= travelled[moving, None])
+        counts = np.count_nonzero(crossed, axis=0)
+        self.counts[self.index] = counts
+        self.speeds[self.index] = velocities[moving] @ crossed
+        self.totals += counts
+        self.index = (self.index + 1) % len(self.counts)
+        self.filled = min(self.filled + 1, len(self.counts))
+
+    def flow(self):
+        """
+        Cars per step crossing each detector over the window.
+        """
+        if not self.filled:
+            return np.zeros(len(self.cells))
+        return self.counts[:self.filled].sum(axis=0) / self.filled
+
+    def mean_speed(self):
+        """
+        Mean speed of the cars that crossed each detector over the window (time-mean).
+        """
+        counts = self.counts[:self.filled].sum(axis=0)
+        speeds = self.speeds[:self.filled].sum(axis=0)
+        return np.divide(speeds, counts, out=np.zeros(len(self.cells)), where=counts > 0)
+
+
+class FundamentalDiagram:
+    """
+    Density/flow pairs of road segments, for the fundamental diagram.
+
+    The road is cut into segments of `segment_length` cells (longer if that gives more than
+    MAX_COLUMNS segments); every step adds each segment's
+    density (cars per lane cell) and flow (cars x cells moved per lane cell) to running sums,
+    and every `interval` steps their means become one row of pairs in a window of rows.
+    """
+
+    def __init__(self, road_length, lanes=1, segment_length=10, interval=10, window=100):
+        segment_length = max(segment_length, -(-road_length // MAX_COLUMNS))
+        self.segment_length = segment_length
+        self.interval = interval
+        num_segments = -(-road_length // segment_length)
+        lengths = np.full(num_segments, segment_length)
+        lengths[-1] = road_length - segment_length * (num_segments - 1)
+        self.cells = lengths * lanes
+        self.density_sum = np.zeros(num_segments)
+        self.flow_sum = np.zeros(num_segments)
+        self.steps = 0
+        self.density = np.zeros((window, num_segments))
+        self.flow = np.zeros((window, num_segments))
+        self.index = 0
+        self.filled = 0
+
+    def update(self, positions, velocities):
+        segments = positions // self.segment_length
+        num_segments = len(self.cells)
+        self.density_sum += np.bincount(segments, minlength=num_segments) / self.cells
+        self.flow_sum += np.bincount(segments, weights=velocities, minlength=num_segments) / self.cells
+        self.steps += 1
+        if self.steps == self.interval:
+            self.density[self.index] = self.density_sum / self.steps
+            self.flow[self.index] = self.flow_sum / self.steps
+            self.density_sum[:] = 0.0
+            self.flow_sum[:] = 0.0
+            self.steps = 0
+            self.index = (self.index + 1) % len(self.density)
+            self.filled = min(self.filled + 1, len(self.density))
+
+    def pairs(self):
+        """
+        Return (density, flow) arrays of every segment and interval in the window.
+        """
+        return (_ordered(self.density, self.index, self.filled).ravel(),
+                _ordered(self.flow, self.index, self.filled).ravel())
+
+
+class JamDetector:
+    """
+    Jams (runs of at least `min_size` stopped cars, each at most `max_gap` cells behind the
+    next stopped one) and the speed of the jam waves.
+
+    Jams are matched to the previous step's jams by overlap; the displacement of a matched
+    jam's head (its downstream end) gives the wave speed, negative when the jam travels
+    upstream. Costs O(stopped cars) per step.
+    """
+
+    def __init__(self, road_length, min_size=3, max_gap=2, window=100, ring=True):
+        self.road_length = road_length
+        self.ring = ring
+        self.min_size = min_size
+        # Cars stopped behind a stopped leader keep one free cell (rule 2), hence 2
+        self.max_gap = max_gap
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.displacements = np.zeros(window)
+        self.matches = np.zeros(window, dtype=np.int64)
+        self.index = 0
+        self.filled = 0
+
+    def find_jams(self, positions, velocities):
+        """
+        Return the start cells, lengths (in cells) and sizes (in cars) of the jams, ordered
+        by their heads.
+        """
+        L = self.road_length
+        stopped = np.sort(positions[velocities <= 0]).astype(np.int64)
+        if len(stopped) == 0:
+            return stopped, stopped, stopped
+        breaks = np.flatnonzero(np.diff(stopped) > self.max_gap) + 1
+        bounds = np.concatenate(([0], breaks, [len(stopped)]))
+        starts = stopped[bounds[:-1]]
+        ends = stopped[bounds[1:] - 1]
+        sizes = np.diff(bounds)
+        if self.ring and len(starts) > 1 and starts[0] + L - ends[-1] <= self.max_gap:
+            # The run across the origin of the ring is one jam
+            starts[0] = starts[-1]
+            sizes[0] += sizes[-1]
+            starts, ends, sizes = starts[:-1], ends[:-1], sizes[:-1]
+        lengths = (ends - starts) % L + 1
+        keep = sizes >= self.min_size
+        return starts[keep], lengths[keep], sizes[keep]
+
+    def update(self, positions, velocities):
+        L = self.road_length
+        starts, lengths, sizes = self.find_jams(positions, velocities)
+        heads = (starts + lengths - 1) % L
+        previous_heads = (self.starts + self.lengths - 1) % L
+        displacement = 0
+        matches = 0
+        if len(heads) and len(previous_heads):
+            # Heads come out of find_jams in ascending order. The first previous head at or
+            # after a jam's start (cyclically) is the only previous jam that can overlap it.
+            match = np.searchsorted(previous_heads, starts) % len(previous_heads)
+            distance = (previous_heads[match] - starts) % L
+            overlap = distance - self.lengths[match] + 1 < lengths
+            moved = (heads - previous_heads[match] + L // 2) % L - L // 2
+            displacement = int(moved[overlap].sum())
+            matches = int(np.count_nonzero(overlap))
+        self.starts, self.lengths, self.sizes = starts, lengths, sizes
+        self.displacements[self.index] = displacement
+        self.matches[self.index] = matches
+        self.index = (self.index + 1) % len(self.matches)
+        self.filled = min(self.filled + 1, len(self.matches))
+
+    def wave_speed(self):
+        """
+        Mean head displacement (cells per step) of the jams tracked over the window.
+        """
+        matches = self.matches[:self.filled].sum()
+        if not matches:
+            return 0.0
+        return float(self.displacements[:self.filled].sum() / matches)
+
+
+class RoadAnalytics:
+    """
+    Incremental aggregators of one road, fed from the published snapshot every step.
+    """
+
+    def __init__(self, road_length, lanes=1, sensors=None, window=200, ring=True):
+        """
+        Initialize a RoadAnalytics instance.
+
+        Parameters:
+            road_length (int): Length of the road.
+            lanes (int, optional): Lanes of the road.
+            sensors (list, optional): Loop detector cells; four evenly spaced ones if None.
+            window (int, optional): Steps of history kept by the raster, detectors and jam
+                tracker. The fundamental diagram keeps window // 10 intervals of 10 steps.
+            ring (bool, optional): False for open roads, whose jams never wrap around.
+        """
+        if sensors is None:
+            sensors = [road_length * i // 4 for i in range(4)]
+        self.raster = SpaceTimeRaster(road_length, window)
+        self.detectors = LoopDetectors(road_length, sensors, window)
+        self.fundamental = FundamentalDiagram(road_length, lanes, window=max(1, window // 10))
+        self.jams = JamDetector(road_length, window=window, ring=ring)
+
+    def update(self, road):
+        """
+        Parameters:
+            road (dict): Snapshot arrays of the road ('positions', 'velocities', in vehicle
+                order, and 'ids' on open roads).
+        """
+        positions = road['positions']
+        velocities = road['velocities']
+        self.raster.update(positions, velocities)
+        self.detectors.update(positions, velocities, road.get('ids'))
+        self.fundamental.update(positions, velocities)
+        self.jams.update(positions, velocities)
+
+    def export(self):
+        """
+        Return the aggregates as a JSON-ready dict. The raster is base64 of its uint8 rows,
+        oldest first, with the number of road cells per column.
+        """
+        rows = self.raster.rows()
+        density, flow = self.fundamental.pairs()
+        return {
+            'raster': {
+                'rows': rows.shape[0],
+                'width': rows.shape[1],
+                'cells_per_column': self.raster.cells_per_column,
+                'data': base64.b64encode(np.ascontiguousarray(rows).tobytes()).decode('ascii'),
+            },
+            'detectors': {
+                'cells': self.detectors.cells.tolist(),
+                'flow': np.round(self.detectors.flow(), 4).tolist(),
+                'mean_speed': np.round(self.detectors.mean_speed(), 4).tolist(),
+                'totals': self.detectors.totals.tolist(),
+            },
+            'fundamental': {
+                'density': np.round(density, 4).tolist(),
+                'flow': np.round(flow, 4).tolist(),
+            },
+            'jams': {
+                'starts': self.jams.starts.tolist(),
+                'lengths': self.jams.lengths.tolist(),
+                'sizes': self.jams.sizes.tolist(),
+                'wave_speed': round(self.jams.wave_speed(), 4),
+            },
+        }
+
+
+def analytics_bytes(road_length, window, sensors=4):
+    """
+    Approximate memory of one road's RoadAnalytics with the given window, for admission
+    checks; the raster and fundamental diagram are bounded by MAX_COLUMNS.
+    """
+    if window <= 0:
+        return 0
+    columns = -(-road_length // -(-road_length // MAX_COLUMNS))
+    segments = -(-road_length // max(10, -(-road_length // MAX_COLUMNS)))
+    raster = window * columns
+    fundamental = 2 * 8 * max(1, window // 10) * segments
+    detectors = window * sensors * (4 + 8)
+    jams = window * 16
+    return raster + fundamental + detectors + jams
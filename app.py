@@ -2,47 +2,208 @@ import eventlet
 eventlet.monkey_patch()
 
 import logging
-from flask import Flask, render_template
+import math
+import os
+import threading
+from flask import Flask, Response, abort, jsonify, render_template, request
 from flask_socketio import SocketIO, emit
-from simulation import Simulation
+from sessions import SessionManager, DEFAULT_SESSION
+from replay import ReplayManager
+from instrumentation import profile, render_prometheus
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'  # Use environment variables for security
+app.config['MAX_SESSIONS'] = 200  # Concurrent simulations, the default one included
+app.config['SESSION_IDLE_TTL'] = 600  # Seconds a session without viewers is kept
+app.config['FRAMES_PER_SECOND'] = 20  # Broadcast rate, independent of each session's step rate
+app.config['PROFILING_ENABLED'] = False  # Serve cProfile samples on /profile
+app.config['CHECKPOINT_DIR'] = 'checkpoints'  # Pinned sessions survive restarts (None: off)
+app.config['CHECKPOINT_INTERVAL'] = 60  # Seconds between checkpoints
+app.config['MAX_FAST_FORWARD_STEPS'] = 1000000
+app.config['ANALYTICS_WINDOW'] = 200  # Steps of /analytics history per session (0: off)
+# Per client: frames in flight until it acknowledges them, and frames that may wait
+# beyond that (only the newest is kept), so slow clients get fewer frames, not a backlog
+app.config['CLIENT_FRAME_WINDOW'] = 2
+app.config['CLIENT_QUEUE_DEPTH'] = 2
+# Recorded runs (batch.py --record) clients can replay with ?replay=<name>
+app.config['REPLAY_DIR'] = 'recordings'
+app.config['REPLAY_STEPS_PER_SECOND'] = 6  # Playback rate at speed 1
+# Name of a simulation process (stepper.py) stepping the default session; the web workers
+# then only relay its frames. None: the default session steps in this process.
+app.config['SIMULATION_PROCESS'] = os.environ.get('SIMULATION_PROCESS')
 socketio = SocketIO(app, async_mode='eventlet')
 
-# Initialize the simulation
-simulation = Simulation(steps_per_second=6)  # Set to 6 steps/sec
+# Every session steps in its own green thread and paces its frames to each client
+sessions = SessionManager(socketio, max_sessions=app.config['MAX_SESSIONS'],
+                          idle_ttl=app.config['SESSION_IDLE_TTL'],
+                          frames_per_second=app.config['FRAMES_PER_SECOND'],
+                          checkpoint_dir=app.config['CHECKPOINT_DIR'],
+                          checkpoint_interval=app.config['CHECKPOINT_INTERVAL'],
+                          client_window=app.config['CLIENT_FRAME_WINDOW'],
+                          client_queue_depth=app.config['CLIENT_QUEUE_DEPTH'],
+                          analytics_window=app.config['ANALYTICS_WINDOW'])
+
+# Recordings play from disk; every viewer has its own position and speed
+replays = ReplayManager(socketio, app.config['REPLAY_DIR'],
+                        steps_per_second=app.config['REPLAY_STEPS_PER_SECOND'],
+                        frames_per_second=app.config['FRAMES_PER_SECOND'],
+                        client_window=app.config['CLIENT_FRAME_WINDOW'],
+                        client_queue_depth=app.config['CLIENT_QUEUE_DEPTH'])
+
+# cProfile allows one active profiler per process
+profile_lock = threading.Lock()
+
+# The shared simulation clients watch unless they create or join another session
+DEFAULT_PARAMETERS = {'steps_per_second': 6}  # Set to 6 steps/sec
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics():
+    # Step/emit timings (p50/p95/p99), achieved vs. target steps/sec, frame sizes and
+    # frames sent/dropped
+    sources = sessions.instrument_sources() + replays.instrument_sources()
+    return Response(render_prometheus(sources),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/analytics')
+def analytics():
+    # Space-time raster, loop detector flows, fundamental diagram pairs and jams of a session
+    session = sessions.get(request.args.get('session', DEFAULT_SESSION))
+    if session is None:
+        abort(404)
+    try:
+        with session.simulation.lock:
+            analytics = session.simulation.get_analytics()
+    except RuntimeError:
+        # The simulation process did not answer
+        abort(503)
+    if not analytics['roads']:
+        # Analytics are off for this session
+        abort(404)
+    return jsonify(analytics)
+
+@app.route('/replays')
+def list_replays():
+    # Recordings that can be replayed (names for ?replay=)
+    return jsonify(replays.recordings())
+
+@app.route('/profile')
+def profile_server():
+    if not app.config['PROFILING_ENABLED']:
+        abort(404)
+    seconds = request.args.get('seconds', 5.0, type=float)
+    if seconds is None or not math.isfinite(seconds) or seconds <= 0:
+        abort(400, description="seconds must be a positive number.")
+    if not profile_lock.acquire(blocking=False):
+        abort(409, description="A profile is already running.")
+    try:
+        report = profile(min(seconds, 60.0), sleep=socketio.sleep)
+    finally:
+        profile_lock.release()
+    return Response(report, mimetype='text/plain')
+
 @socketio.on('connect')
 def handle_connect():
     logging.info('Client connected')
-    # Send the initial state
-    emit('simulation_state', simulation.get_state())
-    # Start the simulation thread if not already running
-    if not simulation.running:
-        simulation.start()
-        # Start the background task to emit states
-        socketio.start_background_task(target=emit_states)
-        logging.info('Simulation thread and state emitter initiated.')
+    # Start the default simulation if not already running, then watch it
+    if sessions.get(DEFAULT_SESSION) is None:
+        if app.config['SIMULATION_PROCESS']:
+            try:
+                sessions.attach(DEFAULT_SESSION, app.config['SIMULATION_PROCESS'])
+            except RuntimeError as e:
+                logging.error(str(e))
+                emit('session_error', {'message': str(e)})
+                return
+        else:
+            sessions.create(DEFAULT_PARAMETERS, session_id=DEFAULT_SESSION, pinned=True)
+        logging.info('Default simulation initiated.')
+    sessions.join(DEFAULT_SESSION, request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     logging.info('Client disconnected')
+    sessions.leave(request.sid)
+    replays.leave(request.sid)
+
+@socketio.on('create_session')
+def handle_create_session(params):
+    try:
+        session = sessions.create(params)
+    except (ValueError, RuntimeError) as e:
+        emit('session_error', {'message': str(e)})
+        return
+    replays.leave(request.sid)
+    sessions.join(session.id, request.sid)
+
+@socketio.on('join_session')
+def handle_join_session(data):
+    session_id = (data or {}).get('session_id')
+    if sessions.join(session_id, request.sid) is None:
+        emit('session_error', {'message': f"Unknown session: {session_id}"})
+        return
+    replays.leave(request.sid)
+
+@socketio.on('fast_forward')
+def handle_fast_forward(data):
+    # Skip the warm-up transient: run the client's session ahead unthrottled
+    session = sessions.session_of(request.sid)
+    try:
+        steps = int((data or {}).get('steps'))
+    except (TypeError, ValueError):
+        steps = 0
+    if not 1 <= steps <= app.config['MAX_FAST_FORWARD_STEPS']:
+        emit('session_error', {'message': f"steps must be between 1 and "
+                                          f"{app.config['MAX_FAST_FORWARD_STEPS']}."})
+        return
+    if session is None or not sessions.fast_forward(session.id, steps):
+        emit('session_error', {'message': "No session to fast-forward, or already running."})
+
+@socketio.on('set_viewport')
+def handle_set_viewport(data):
+    # The client views cells [start, end) at `zoom` pixels per cell: send it only the cars
+    # in range, or density/speed histograms when zoomed out. None: back to full frames.
+    try:
+        session = sessions.set_viewport(request.sid, data)
+    except ValueError as e:
+        emit('session_error', {'message': str(e)})
+        return
+    if session is None:
+        emit('session_error', {'message': "Join a session before setting a viewport."})
+
+@socketio.on('request_keyframe')
+def handle_request_keyframe():
+    # The client missed a frame; its next frame is a keyframe
+    sessions.request_keyframe(request.sid)
+    replays.request_keyframe(request.sid)
+
+@socketio.on('join_replay')
+def handle_join_replay(data):
+    # Leave the live simulation and play a recording: {'name', 'speed', 'step'}
+    data = data or {}
+    try:
+        replays.join(request.sid, data.get('name'), speed=data.get('speed', 1.0),
+                     step=data.get('step'))
+    except ValueError as e:
+        emit('session_error', {'message': str(e)})
+        return
+    sessions.leave(request.sid)
 
-def emit_states():
-    """Background task to emit simulation states."""
-    while simulation.running:
-        socketio.sleep(simulation.sleep_interval)
-        state = simulation.get_state()
-        socketio.emit('simulation_state', state)
-        #logging.debug(f"Emitted state for step {state['step']}")
+@socketio.on('replay_control')
+def handle_replay_control(data):
+    # Change speed (0.1-100x), seek to a step or pause/resume: {'speed', 'step', 'paused'}
+    try:
+        viewer = replays.control(request.sid, data)
+    except ValueError as e:
+        emit('session_error', {'message': str(e)})
+        return
+    if viewer is None:
+        emit('session_error', {'message': "Join a replay before controlling it."})
 
 # The 'if __name__ == "__main__":' block remains commented out for deployment
 # It is only used for local development with Flask's built-in server
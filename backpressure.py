@@ -0,0 +1,135 @@
+# backpressure.py
+
+import time
+from collections import OrderedDict, deque, namedtuple
+
+from wire import encode_delta, encode_keyframe, needs_keyframe
+
+# An encoded frame waiting for a client. base: step `data` is a delta against (None: it is
+# self-contained); frame: the full frame it encodes (None for viewport frames)
+QueuedFrame = namedtuple('QueuedFrame', ['data', 'base', 'frame'])
+
+
+class ClientStream:
+    """
+    Frames on their way to one client, paced by the client's acknowledgements.
+
+    At most `window` frames are unacknowledged at a time. Every frame sent gets a sequence
+    number, which the client echoes when it acknowledges the frame once it has drawn it;
+    acknowledgements of frames already given up on are ignored. So each client gets frames as fast as its link and device take
+    them (about window / round trip per second, up to the session's frame rate). Frames
+    that arrive while the window is full wait in a queue of at most `depth`; when it
+    overflows, only the newest frame is kept and the others count as dropped. A stalled
+    client therefore holds at most window + depth frames in the server.
+
+    A delta whose base frame the client never got (it was dropped) is rebuilt against the
+    last full frame the client did get, or sent as a keyframe.
+    """
+
+    def __init__(self, window=2, depth=2, ack_timeout=5.0, clock=time.monotonic):
+        """
+        Initialize a ClientStream instance.
+
+        Parameters:
+            window (int, optional): Frames that may be unacknowledged at a time.
+            depth (int, optional): Frames that may wait for room in the window.
+            ack_timeout (float, optional): Seconds after which unacknowledged frames are
+                given up on (lost acknowledgements, or a client that sends none); the
+                client then restarts from a keyframe.
+            clock (callable, optional): Time source in seconds.
+        """
+        if window < 1 or depth < 1:
+            raise ValueError("window and depth must be at least 1.")
+        self.window = window
+        self.depth = depth
+        self.ack_timeout = ack_timeout
+        self.clock = clock
+        self.queue = deque()
+        self.sent_times = OrderedDict()  # Sequence -> send time of unacknowledged frames
+        self.next_sequence = 0
+        self.base = None  # Last full frame sent: the one the client applies deltas to
+
+    def offer(self, data, base=None, frame=None):
+        """
+        Queue a frame for the client; ready() hands it out when the window has room.
+
+        Parameters:
+            data (bytes): The encoded frame.
+            base (int, optional): Step `data` is a delta against; None if self-contained.
+            frame (dict, optional): The full frame `data` encodes (Simulation.get_frame),
+                so a delta can be rebuilt for this client; None for viewport frames.
+
+        Returns:
+            int: Number of frames dropped to make room.
+        """
+        self.queue.append(QueuedFrame(data, base, frame))
+        if len(self.queue) <= self.depth:
+            return 0
+        dropped = len(self.queue) - 1
+        latest = self.queue.pop()
+        self.queue.clear()
+        self.queue.append(latest)
+        return dropped
+
+    def clear(self):
+        """
+        Discard the waiting frames (e.g. the client switched between full and viewport
+        frames); they do not count as dropped.
+        """
+        self.queue.clear()
+
+    def resync(self):
+        """
+        Send the client's next full frame as a keyframe (it lost track of the deltas).
+        """
+        self.base = None
+
+    def ready(self):
+        """
+        Take the waiting frames the window has room for.
+
+        Returns:
+            list: (sequence, encoded frame) pairs to emit, in order; each frame counts
+                against the window until acknowledge() is called with its sequence.
+        """
+        now = self.clock()
+        if self.sent_times and now - next(iter(self.sent_times.values())) > self.ack_timeout:
+            self.sent_times.clear()
+            self.base = None
+        ready = []
+        while self.queue and len(self.sent_times) < self.window:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            ready.append((sequence, self._encode(self.queue.popleft())))
+            self.sent_times[sequence] = now
+        return ready
+
+    def _encode(self, queued):
+        data = queued.data
+        if queued.base is not None and (self.base is None or self.base['step'] != queued.base):
+            # The client does not hold the frame this delta is based on
+            if needs_keyframe(queued.frame, self.base):
+                data = encode_keyframe(queued.frame)
+            else:
+                data = encode_delta(queued.frame, self.base)
+        if queued.frame is not None:
+            self.base = queued.frame
+        return data
+
+    def acknowledge(self, sequence):
+        """
+        Record the client's acknowledgement of a frame.
+
+        Parameters:
+            sequence (int): Sequence number of the frame (see ready).
+
+        Returns:
+            float or None: Seconds since that frame was sent, or None if it was not
+                waiting for an acknowledgement (e.g. it timed out).
+        """
+        if not isinstance(sequence, int):
+            return None  # Not one of ours (clients echo what they were sent)
+        sent = self.sent_times.pop(sequence, None)
+        if sent is None:
+            return None
+        return self.clock() - sent
@@ -0,0 +1,395 @@
+# batch.py
+
+import argparse
+import csv
+import itertools
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from acc import ACC_DEFAULTS, ACCParameters
+from ensemble import METRICS, Ensemble
+from recorder import Recorder
+from simulation import Simulation
+
+# Sweepable Simulation parameters and the value used when a grid leaves them out
+GRID_DEFAULTS = {
+    'L': 100,
+    'N': 24,
+    'vmax': 3,
+    'p_fault': 0.1,
+    'p_slow': 0.5,
+    'acc_share': 1.0,
+    'acc_share_road2': 0.0,
+    'lanes': 1,
+    'placement': 'random',
+}
+
+SUMMARY_FIELDS = list(GRID_DEFAULTS) + [
+    'run', 'density', 'steps',
+    'road1_speed', 'road1_speed_std', 'road1_flow', 'road1_stopped', 'road1_stops_per_car',
+    'road2_speed', 'road2_speed_std', 'road2_flow', 'road2_stopped', 'road2_stops_per_car',
+]
+
+# Road 1 controller parameters, as reported in every summary
+ACC_FIELDS = [f'acc_{name}' for name in ACC_DEFAULTS]
+
+# Ensemble summaries: per road and metric the mean over replicas and its confidence interval
+ENSEMBLE_FIELDS = list(GRID_DEFAULTS) + ['run', 'replicas', 'density', 'steps'] + [
+    f'{road}_{name}{suffix}' for road in ('road1', 'road2') for name in METRICS
+    for suffix in ('', '_ci_low', '_ci_high')
+]
+
+
+def run_headless(steps=1000, warmup=0, seed=None, engine='vector', record=None, **params):
+    """
+    Run one Simulation as fast as possible and summarize it.
+
+    Parameters:
+        steps (int): Number of measured steps.
+        warmup (int): Steps run (and discarded) before measuring, to skip the transient.
+        seed (int or np.random.SeedSequence, optional): Seed of the run.
+        engine (str, optional): Road engine passed to Simulation.
+        record (str, optional): Directory to record the measured steps to (see recorder.py).
+        **params: Simulation parameters (L, N, vmax, p_fault, p_slow, acc_share, lanes, ...).
+
+    Returns:
+        dict: Per road, the time-averaged speed, the standard deviation of the speeds over
+            cars and steps, the flow (cars per lane cell per step), the number of stopped
+            cars and the stop events (moving -> stopped) per car, plus road 1's ACC
+            controller parameters.
+
+    Raises:
+        ValueError: On invalid parameters, or for open roads, whose car count (which
+            density, stop events and the per-car figures rest on) changes every step.
+    """
+    if params.get('boundary', 'ring') != 'ring':
+        raise ValueError("run_headless only measures ring roads (boundary='ring').")
+    simulation = Simulation(engine=engine, seed=seed, **params)
+
+    simulation.fast_forward(warmup)
+
+    speed = {'road1': 0.0, 'road2': 0.0}
+    speed_squares = {'road1': 0, 'road2': 0}
+    stopped = {'road1': 0, 'road2': 0}
+    stop_events = {'road1': 0, 'road2': 0}
+    # Snapshot velocities are in vehicle order, so they compare car by car across steps
+    previous = [road['velocities'] for road in simulation.snapshot.roads]
+    recorder = Recorder(record, simulation) if record else None
+    for _ in range(steps):
+        simulation.run_step()
+        if recorder:
+            recorder.record(simulation)
+        for index, road in enumerate(speed):
+            speed[road] += simulation.metrics[road]['average_speed']
+            stopped[road] += simulation.metrics[road]['stopped_vehicles']
+            velocities = simulation.snapshot.roads[index]['velocities']
+            speed_squares[road] += int(np.dot(velocities, velocities))
+            stop_events[road] += int(np.count_nonzero((previous[index] > 0) & (velocities == 0)))
+            previous[index] = velocities
+    if recorder:
+        recorder.close(simulation)
+
+    density = simulation.N / (simulation.L * simulation.lanes)
+    summary = {name: getattr(simulation, name) for name in GRID_DEFAULTS}
+    summary.update({'density': density, 'steps': steps})
+    summary.update(zip(ACC_FIELDS, simulation.acc))
+    for road in speed:
+        mean_speed = speed[road] / steps if steps else 0.0
+        mean_square = speed_squares[road] / (steps * simulation.N) if steps else 0.0
+        summary[f'{road}_speed'] = mean_speed
+        summary[f'{road}_speed_std'] = max(mean_square - mean_speed ** 2, 0.0) ** 0.5
+        summary[f'{road}_flow'] = density * mean_speed
+        summary[f'{road}_stopped'] = stopped[road] / steps if steps else 0.0
+        summary[f'{road}_stops_per_car'] = stop_events[road] / simulation.N
+    return summary
+
+
+def expand_grid(grid):
+    """
+    Turn {parameter: [values]} into one config dict per combination.
+
+    Parameters missing from the grid take their value from GRID_DEFAULTS. Combinations
+    with more cars than cells (L * lanes) are skipped.
+    """
+    unknown = set(grid) - set(GRID_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown grid parameters: {sorted(unknown)}")
+
+    axes = {name: list(grid.get(name, [default])) for name, default in GRID_DEFAULTS.items()}
+    configs = [dict(zip(axes, values)) for values in itertools.product(*axes.values())]
+    return [config for config in configs if config['N'] <= config['L'] * config['lanes']]
+
+
+def _init_worker():
+    # Simulation configures DEBUG logging and Car logs every speed offset
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _run_config(args):
+    index, config, steps, warmup, seed, engine, record = args
+    if record:
+        record = os.path.join(record, f'run_{index:05d}')
+    summary = run_headless(steps=steps, warmup=warmup, seed=seed, engine=engine,
+                           record=record, **config)
+    summary['run'] = index
+    return summary
+
+
+def sweep(grid, steps=1000, warmup=0, replicas=1, seed=None, engine='vector', max_workers=None,
+          record=None):
+    """
+    Run every configuration of a parameter grid in parallel and collect the summaries.
+
+    Parameters:
+        grid (dict): Parameter name -> list of values (see GRID_DEFAULTS).
+        steps (int): Measured steps per run.
+        warmup (int): Discarded steps per run.
+        replicas (int): Independent runs per configuration.
+        seed (int, optional): Root seed; every run gets its own spawned stream.
+        engine (str, optional): Road engine passed to Simulation.
+        max_workers (int, optional): Worker processes (all cores if None).
+        record (str, optional): Directory to record every run to, one run_<index>
+            subdirectory per run.
+
+    Returns:
+        list: One summary dict per run, in grid order.
+    """
+    return _run_configs(expand_grid(grid), steps, warmup, replicas, seed, engine, max_workers,
+                        record)
+
+
+def _run_configs(configs, steps, warmup, replicas, seed, engine, max_workers, record):
+    configs = [config for config in configs for _ in range(replicas)]
+    seeds = np.random.SeedSequence(seed).spawn(len(configs))
+    jobs = [(index, config, steps, warmup, run_seed, engine, record)
+            for index, (config, run_seed) in enumerate(zip(configs, seeds))]
+
+    # Many small runs per task keep the inter-process overhead low
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        return list(executor.map(_run_config, jobs, chunksize=chunksize))
+
+
+def _run_ensemble(args):
+    index, config, steps, warmup, replicas, seed, level = args
+    summary = dict(config, run=index)
+    # Both roads of every replica, from the same replica seeds as a Simulation would use
+    for road, (acc_share, acc) in enumerate(((config['acc_share'], config.get('acc')),
+                                              (config['acc_share_road2'], None))):
+        ensemble = Ensemble(replicas, L=config['L'], N=config['N'], vmax=config['vmax'],
+                            p_fault=config['p_fault'], p_slow=config['p_slow'],
+                            acc_share=acc_share, acc=acc, placement=config['placement'],
+                            seed=seed, road=road)
+        result = ensemble.run(steps, warmup, level)
+        for name in METRICS:
+            interval = result[name]
+            summary[f'road{road + 1}_{name}'] = interval['mean']
+            summary[f'road{road + 1}_{name}_ci_low'] = interval['ci_low']
+            summary[f'road{road + 1}_{name}_ci_high'] = interval['ci_high']
+    summary.update(replicas=replicas, density=ensemble.density, steps=steps)
+    return summary
+
+
+def ensemble_sweep(grid, steps=1000, warmup=0, replicas=100, seed=None, max_workers=None,
+                   level=0.95):
+    """
+    Run the replicas of every configuration of a grid as one Ensemble per road, the
+    configurations in parallel.
+
+    Much cheaper than sweep(..., replicas=R) for many replicas: one process steps all R
+    replicas of a configuration as 2-D arrays. Single-lane roads only.
+
+    Parameters:
+        grid (dict): Parameter name -> list of values (see GRID_DEFAULTS).
+        steps, warmup, seed, max_workers: As for sweep.
+        replicas (int): Replicas per configuration.
+        level (float, optional): Confidence level of the intervals.
+
+    Returns:
+        list: One summary dict per configuration (see ENSEMBLE_FIELDS), in grid order.
+
+    Raises:
+        ValueError: If the grid has more than one lane.
+    """
+    configs = expand_grid(grid)
+    if any(config['lanes'] != 1 for config in configs):
+        raise ValueError("Ensembles only run single-lane roads.")
+    seeds = np.random.SeedSequence(seed).spawn(len(configs))
+    jobs = [(index, config, steps, warmup, replicas, config_seed, level)
+            for index, (config, config_seed) in enumerate(zip(configs, seeds))]
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        return list(executor.map(_run_ensemble, jobs))
+
+
+def penetration_sweep(shares=11, grid=None, **kwargs):
+    """
+    Sweep the ACC penetration rate of road 1 in parallel, road 2 staying the reference.
+
+    Parameters:
+        shares (int or list): Penetration rates between 0 and 1, or how many evenly spaced
+            ones from 0% to 100%.
+        grid (dict, optional): Other grid axes (see GRID_DEFAULTS) to cross with the rates.
+        **kwargs: Passed on to sweep (steps, warmup, replicas, seed, engine, max_workers,
+            record).
+
+    Returns:
+        list: One summary dict per run, ordered by the grid and then by penetration.
+    """
+    if isinstance(shares, int):
+        shares = np.linspace(0.0, 1.0, shares).round(6).tolist()
+    grid = dict(grid or {})
+    grid['acc_share'] = list(shares)
+    return sweep(grid, **kwargs)
+
+
+def gain_score(row, stability_weight=1.0):
+    """
+    Score road 1's controller in a summary row: throughput minus string instability.
+
+    Throughput is the mean speed as a share of vmax (flow relative to free flow at that
+    density). Instability is the spread of the speeds over cars and steps, also relative to
+    vmax: stop-and-go waves that grow along the string of cars show up as a large spread,
+    a string-stable controller keeps every car near the common speed.
+    """
+    vmax = row['vmax']
+    return row['road1_speed'] / vmax - stability_weight * row['road1_speed_std'] / vmax
+
+
+def gain_sweep(gains, grid=None, stability_weight=1.0, steps=1000, warmup=0, replicas=1,
+               seed=None, engine='vector', max_workers=None, record=None):
+    """
+    Grid-search the ACC controller parameters of road 1 in parallel.
+
+    Parameters:
+        gains (dict): Controller parameter name (see acc.ACC_DEFAULTS) -> list of values.
+            Parameters left out keep their defaults.
+        grid (dict, optional): Simulation grid axes (see GRID_DEFAULTS) to cross with the
+            gains; road 1 is all ACC unless the grid sets acc_share.
+        stability_weight (float, optional): Weight of instability in the score (gain_score).
+        steps, warmup, replicas, seed, engine, max_workers, record: As for sweep.
+
+    Returns:
+        list: One summary dict per run with its 'score', best first.
+    """
+    names = list(gains)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*gains.values())]
+    for parameters in combinations:
+        ACCParameters.create(parameters)  # Fail before starting any worker
+
+    configs = [dict(config, acc=parameters)
+               for config in expand_grid(grid or {}) for parameters in combinations]
+    rows = _run_configs(configs, steps, warmup, replicas, seed, engine, max_workers, record)
+    for row in rows:
+        row['score'] = gain_score(row, stability_weight)
+    return sorted(rows, key=lambda row: row['score'], reverse=True)
+
+
+def write_table(rows, file, fields=None):
+    """
+    Write summary rows as CSV to a path or an open file.
+    """
+    fields = fields or SUMMARY_FIELDS
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'w', newline='') as f:
+            return write_table(rows, f, fields)
+    writer = csv.DictWriter(file, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless parameter sweeps of the traffic simulation.")
+    parser.add_argument('--L', type=int, nargs='+', default=[GRID_DEFAULTS['L']])
+    parser.add_argument('--N', type=int, nargs='+', default=[GRID_DEFAULTS['N']])
+    parser.add_argument('--vmax', type=int, nargs='+', default=[GRID_DEFAULTS['vmax']])
+    parser.add_argument('--p-fault', type=float, nargs='+', default=[GRID_DEFAULTS['p_fault']])
+    parser.add_argument('--p-slow', type=float, nargs='+', default=[GRID_DEFAULTS['p_slow']])
+    parser.add_argument('--acc-share', type=float, nargs='+', default=[GRID_DEFAULTS['acc_share']])
+    parser.add_argument('--acc-share-road2', type=float, nargs='+',
+                        default=[GRID_DEFAULTS['acc_share_road2']])
+    parser.add_argument('--lanes', type=int, nargs='+', default=[GRID_DEFAULTS['lanes']])
+    parser.add_argument('--placement', nargs='+', choices=['random', 'uniform', 'jam'],
+                        default=[GRID_DEFAULTS['placement']],
+                        help="Initial placement of the cars (see placement.py)")
+    parser.add_argument('--gain', nargs='+', action='append', default=[],
+                        metavar=('NAME', 'VALUE'),
+                        help="Grid-search ACC parameter NAME (kp, ki, kd, ...) of road 1 over "
+                             "the given values; repeat for more parameters")
+    parser.add_argument('--stability-weight', type=float, default=1.0,
+                        help="Weight of string instability against throughput in --gain scores")
+    parser.add_argument('--penetration', type=int, default=None, metavar='COUNT',
+                        help="Sweep road 1 ACC penetration over COUNT evenly spaced rates "
+                             "from 0 to 100%% (replaces --acc-share)")
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=0)
+    parser.add_argument('--replicas', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--engine', choices=['car', 'vector'], default='vector')
+    parser.add_argument('--ensemble', action='store_true',
+                        help="Step the replicas of each configuration together as one "
+                             "ensemble and report means with 95%% confidence intervals "
+                             "(single-lane; ignores --engine and --record)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help="CSV file (stdout if omitted)")
+    parser.add_argument('--record', default=None, metavar='DIR',
+                        help="Record the measured steps of every run under DIR/run_<index>")
+    args = parser.parse_args(argv)
+
+    grid = {
+        'L': args.L,
+        'N': args.N,
+        'vmax': args.vmax,
+        'p_fault': args.p_fault,
+        'p_slow': args.p_slow,
+        'acc_share': args.acc_share,
+        'acc_share_road2': args.acc_share_road2,
+        'lanes': args.lanes,
+        'placement': args.placement,
+    }
+    _init_worker()
+    options = dict(steps=args.steps, warmup=args.warmup, replicas=args.replicas,
+                   seed=args.seed, engine=args.engine, max_workers=args.workers,
+                   record=args.record)
+    fields = None
+    if args.gain:
+        gains = {}
+        for name, *values in args.gain:
+            if not values:
+                parser.error(f"--gain {name} needs at least one value")
+            gains[name] = values
+        try:
+            gains = {name: [float(value) for value in values] for name, values in gains.items()}
+            for values in itertools.product(*gains.values()):
+                ACCParameters.create(dict(zip(gains, values)))
+        except ValueError as e:
+            parser.error(str(e))
+        rows = gain_sweep(gains, grid, args.stability_weight, **options)
+        fields = SUMMARY_FIELDS + ACC_FIELDS + ['score']
+    elif args.ensemble:
+        if args.replicas < 2:
+            parser.error("--ensemble needs --replicas of at least 2 for confidence intervals")
+        if args.penetration:
+            grid['acc_share'] = np.linspace(0.0, 1.0, args.penetration).round(6).tolist()
+        try:
+            rows = ensemble_sweep(grid, steps=args.steps, warmup=args.warmup,
+                                  replicas=args.replicas, seed=args.seed,
+                                  max_workers=args.workers)
+        except ValueError as e:
+            parser.error(str(e))
+        fields = ENSEMBLE_FIELDS
+    elif args.penetration:
+        del grid['acc_share']
+        rows = penetration_sweep(args.penetration, grid, **options)
+    else:
+        rows = sweep(grid, **options)
+    write_table(rows, args.output or sys.stdout, fields)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# benchmark.py
+
+import argparse
+import itertools
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import kernels
+from simulation import Simulation
+from wire import encode_keyframe
+
+# Default matrix: road lengths x densities (cars per cell) x engines x road types
+SIZES = [100, 1000, 10000]
+DENSITIES = [0.1, 0.3, 0.5]
+ENGINES = ['car', 'vector']
+ROADS = ['acc', 'human']
+
+# Share of ACC cars on the benchmarked road (road 1)
+ROAD_ACC_SHARE = {'acc': 1.0, 'human': 0.0}
+
+
+def _best_time(function, repeat, number):
+    """
+    Best (least disturbed) time per call over `repeat` rounds of `number` calls.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def _peak_memory(L, N, engine, acc_share, seed, steps=10):
+    # Separate pass, since tracemalloc slows down everything it traces
+    tracemalloc.start()
+    try:
+        simulation = Simulation(L=L, N=N, engine=engine, acc_share=acc_share, seed=seed)
+        for _ in range(steps):
+            simulation.run_step()
+        simulation.get_state()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_case(L, density, engine, road, steps=100, warmup=20, repeat=3, seed=0):
+    """
+    Benchmark one configuration.
+
+    Parameters:
+        L (int): Road length.
+        density (float): Cars per cell; N = density * L on each road.
+        engine (str): 'car' or 'vector'.
+        road (str): 'acc' (road 1 all ACC) or 'human' (road 1 all human drivers).
+        steps (int): Steps per timing round.
+        warmup (int): Steps run before timing.
+        repeat (int): Timing rounds; the best one counts.
+        seed (int): Simulation seed.
+
+    Returns:
+        dict: Configuration, per-operation seconds, rates and peak memory in bytes.
+    """
+    N = max(1, int(density * L))
+    acc_share = ROAD_ACC_SHARE[road]
+
+    start = time.perf_counter()
+    simulation = Simulation(L=L, N=N, engine=engine, acc_share=acc_share, seed=seed)
+    init_seconds = time.perf_counter() - start
+
+    for _ in range(warmup):
+        simulation.run_step()
+
+    run_step = _best_time(simulation.run_step, repeat, steps)
+    update_road = _best_time(
+        lambda: simulation.update_road(simulation.cars_road1, simulation.rng_road1),
+        repeat, steps)
+
+    # Serialization of a fresh snapshot each time, so the per-step cache does not count
+    samples = max(1, steps // 10)
+    get_state = json_encode = frame_encode = float('inf')
+    for _ in range(repeat):
+        get_state_total = json_total = frame_total = 0.0
+        for _ in range(samples):
+            simulation.publish_snapshot()
+            start = time.perf_counter()
+            state = simulation.get_state()
+            get_state_total += time.perf_counter() - start
+
+            start = time.perf_counter()
+            json.dumps(state)
+            json_total += time.perf_counter() - start
+
+            start = time.perf_counter()
+            encode_keyframe(simulation.get_frame())
+            frame_total += time.perf_counter() - start
+        get_state = min(get_state, get_state_total / samples)
+        json_encode = min(json_encode, json_total / samples)
+        frame_encode = min(frame_encode, frame_total / samples)
+
+    steps_per_second = 1.0 / run_step
+    return {
+        'L': L,
+        'N': N,
+        'density': density,
+        'engine': engine,
+        'road': road,
+        'init_seconds': init_seconds,
+        'run_step_seconds': run_step,
+        'update_road_seconds': update_road,
+        'get_state_seconds': get_state,
+        'json_seconds': json_encode,
+        'frame_seconds': frame_encode,
+        'steps_per_second': steps_per_second,
+        # Both roads are stepped
+        'car_steps_per_second': 2 * N * steps_per_second,
+        'peak_memory_bytes': _peak_memory(L, N, engine, acc_share, seed),
+    }
+
+
+def case_key(result):
+    return (result['L'], result['N'], result['engine'], result['road'])
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        # The vector engine runs the compiled kernel when Numba is installed
+        'numba': kernels.numba.__version__ if kernels.AVAILABLE else None,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+    }
+
+
+def run_benchmarks(sizes=SIZES, densities=DENSITIES, engines=ENGINES, roads=ROADS,
+                   steps=100, warmup=20, repeat=3, seed=0, report=None):
+    """
+    Benchmark the whole matrix.
+
+    Returns:
+        dict: {'environment': ..., 'results': [bench_case result, ...]}
+    """
+    results = []
+    for L, density, engine, road in itertools.product(sizes, densities, engines, roads):
+        result = bench_case(L, density, engine, road, steps=steps, warmup=warmup,
+                            repeat=repeat, seed=seed)
+        results.append(result)
+        if report is not None:
+            report(result)
+    return {'environment': environment(), 'results': results}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare steps/sec against a baseline run.
+
+    Returns:
+        list: (result, baseline result, speedup) for every case present in both, and
+            whether any case got slower by more than `tolerance`.
+    """
+    baseline_cases = {case_key(result): result for result in baseline['results']}
+    rows = []
+    regressed = False
+    for result in results['results']:
+        base = baseline_cases.get(case_key(result))
+        if base is None:
+            continue
+        speedup = result['steps_per_second'] / base['steps_per_second']
+        regressed |= speedup < 1.0 - tolerance
+        rows.append((result, base, speedup))
+    return rows, regressed
+
+
+def format_result(result):
+    return (f"L={result['L']:>7} N={result['N']:>7} {result['engine']:>6} {result['road']:>5} | "
+            f"{result['steps_per_second']:>10.1f} steps/s "
+            f"{result['car_steps_per_second']:>12.3g} car-steps/s | "
+            f"update_road {result['update_road_seconds'] * 1e3:8.3f} ms "
+            f"get_state {result['get_state_seconds'] * 1e3:8.3f} ms "
+            f"json {result['json_seconds'] * 1e3:8.3f} ms "
+            f"frame {result['frame_seconds'] * 1e3:8.3f} ms | "
+            f"peak {result['peak_memory_bytes'] / 2**20:8.2f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation step loop.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--densities', type=float, nargs='+', default=DENSITIES)
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES)
+    parser.add_argument('--roads', nargs='+', choices=ROADS, default=ROADS)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Save results as JSON")
+    parser.add_argument('--compare', default=None, help="Baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed steps/sec slowdown before a case counts as a regression")
+    args = parser.parse_args(argv)
+
+    # Car logs every speed offset at DEBUG
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run_benchmarks(args.sizes, args.densities, args.engines, args.roads,
+                             steps=args.steps, warmup=args.warmup, repeat=args.repeat,
+                             seed=args.seed, report=lambda result: print(format_result(result)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressed = compare(results, baseline, args.tolerance)
+        for result, base, speedup in rows:
+            marker = '  REGRESSION' if speedup < 1.0 - args.tolerance else ''
+            print(f"L={result['L']:>7} N={result['N']:>7} {result['engine']:>6} "
+                  f"{result['road']:>5} | {base['steps_per_second']:>10.1f} -> "
+                  f"{result['steps_per_second']:>10.1f} steps/s ({speedup:.2f}x){marker}")
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
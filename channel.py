@@ -0,0 +1,257 @@
+# channel.py
+
+import json
+import logging
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from snapshot import Snapshot
+
+# Shared memory layout of a channel:
+#
+#   header   magic u32 | closed u32 | slot_size u64 | version u64 | requests u64
+#   slot 0   sequence u64 | length u64 | payload[slot_size]
+#   slot 1   ...
+#
+# One process writes, any number read. Version v is written to slot v % 2, so readers
+# copy a complete value while the writer fills the other slot. The slot's sequence is odd
+# while it is being written; a reader that sees it odd or changed retries (a seqlock).
+MAGIC = 0x54524643
+HEADER = struct.Struct('<IIQQQ')
+SLOT_HEADER = struct.Struct('<QQ')
+VERSION_OFFSET = 16
+REQUESTS_OFFSET = 24
+# Attempts of a read before giving up on a slot that stays mid-write (the writer died
+# while publishing)
+READ_ATTEMPTS = 100
+
+# Snapshot payload: meta length u32 | meta JSON | arrays, in the order the meta lists them
+META_LENGTH = struct.Struct('<I')
+# Room for the JSON meta (step, metrics and array descriptors) of a snapshot
+META_CAPACITY = 1 << 16
+
+
+class SharedChannel:
+    """
+    Latest-value channel over multiprocessing.shared_memory: one writer publishes byte
+    strings, readers on the same host pick up the newest one without locks or copies on
+    the writer's side, however many there are.
+
+    Readers also signal the writer through a request counter (e.g. "publish analytics").
+    """
+
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        magic, _, self.slot_size, _, _ = HEADER.unpack_from(memory.buf)
+        if magic != MAGIC:
+            raise ValueError(f"{memory.name} is not a channel.")
+        self.last_requests = 0
+        self.stalled = False  # A read found the newest value stuck mid-write
+
+    @classmethod
+    def create(cls, name, capacity):
+        """
+        Create a channel for payloads of up to `capacity` bytes, replacing a stale one of
+        the same name (left behind by a writer that did not shut down).
+        """
+        size = HEADER.size + 2 * (SLOT_HEADER.size + capacity)
+        try:
+            memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            memory = shared_memory.SharedMemory(name, create=True, size=size)
+        HEADER.pack_into(memory.buf, 0, MAGIC, 0, capacity, 0, 0)
+        for slot in range(2):
+            SLOT_HEADER.pack_into(memory.buf, cls._slot_offset(slot, capacity), 0, 0)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Open an existing channel for reading.
+
+        Raises:
+            FileNotFoundError: If no writer has created the channel.
+        """
+        memory = shared_memory.SharedMemory(name)
+        # Before Python 3.13 every process that opens a segment registers it, and its
+        # resource tracker unlinks it at exit; only the writer may do that
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return cls(memory, owner=False)
+
+    @staticmethod
+    def _slot_offset(slot, slot_size):
+        return HEADER.size + slot * (SLOT_HEADER.size + slot_size)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def version(self):
+        """
+        Number of values published so far.
+        """
+        return struct.unpack_from('<Q', self.memory.buf, VERSION_OFFSET)[0]
+
+    @property
+    def closed(self):
+        """
+        Whether the writer has shut down (a restarted writer creates a new segment).
+        """
+        return HEADER.unpack_from(self.memory.buf)[1] != 0
+
+    def publish(self, parts):
+        """
+        Publish the concatenation of `parts` (bytes-like objects) as the next value.
+
+        Raises:
+            ValueError: If the value does not fit the channel's capacity.
+        """
+        length = sum(memoryview(part).nbytes for part in parts)
+        if length > self.slot_size:
+            raise ValueError(f"{length} bytes do not fit channel {self.name} "
+                             f"({self.slot_size} bytes).")
+        buf = self.memory.buf
+        version = self.version + 1
+        offset = self._slot_offset(version % 2, self.slot_size)
+        sequence = SLOT_HEADER.unpack_from(buf, offset)[0] + 1
+        SLOT_HEADER.pack_into(buf, offset, sequence, length)
+        position = offset + SLOT_HEADER.size
+        for part in parts:
+            part = memoryview(part).cast('B')
+            buf[position:position + part.nbytes] = part
+            position += part.nbytes
+        SLOT_HEADER.pack_into(buf, offset, sequence + 1, length)
+        struct.pack_into('<Q', buf, VERSION_OFFSET, version)
+
+    def read(self, since=None):
+        """
+        Copy out the newest value.
+
+        Parameters:
+            since (int, optional): Version the caller already has.
+
+        Returns:
+            tuple or None: (version, bytes), or None if nothing newer than `since` (or
+                nothing at all) was published, or if the newest value stayed mid-write
+                for READ_ATTEMPTS attempts; the channel is then marked stalled.
+        """
+        buf = self.memory.buf
+        for _ in range(READ_ATTEMPTS):
+            version = self.version
+            if version == 0 or version == since:
+                return None
+            offset = self._slot_offset(version % 2, self.slot_size)
+            sequence, length = SLOT_HEADER.unpack_from(buf, offset)
+            if sequence % 2 == 0:
+                start = offset + SLOT_HEADER.size
+                data = bytes(buf[start:start + length])
+                if SLOT_HEADER.unpack_from(buf, offset)[0] == sequence:
+                    self.stalled = False
+                    return version, data
+            # Let the writer (or, under eventlet, other green threads) run
+            time.sleep(0)
+        if not self.stalled:
+            logging.warning(f"Channel {self.name} is stuck mid-write; its writer may have died.")
+        self.stalled = True
+        return None
+
+    def request(self):
+        """
+        Signal the writer (see requested).
+
+        Returns:
+            int: Number of requests so far, this one included; the writer can echo it
+                (see last_requests) so the reader recognizes the answer.
+        """
+        requests = struct.unpack_from('<Q', self.memory.buf, REQUESTS_OFFSET)[0] + 1
+        struct.pack_into('<Q', self.memory.buf, REQUESTS_OFFSET, requests)
+        return requests
+
+    def requested(self):
+        """
+        Writer side: whether readers have called request() since the last call.
+        """
+        requests = struct.unpack_from('<Q', self.memory.buf, REQUESTS_OFFSET)[0]
+        if requests == self.last_requests:
+            return False
+        self.last_requests = requests
+        return True
+
+    def close(self):
+        """
+        Detach; the writer also marks the channel closed and removes the segment.
+        """
+        if self.owner:
+            struct.pack_into('<I', self.memory.buf, 4, 1)
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def snapshot_capacity(simulation):
+    """
+    Bytes a snapshot of `simulation` can take in a SnapshotChannel: the fixed car count
+    of ring roads, or as many cars as there are cells on open roads.
+    """
+    cars = simulation.L * simulation.lanes if simulation.boundary == 'open' else simulation.N
+    bytes_per_car = sum(array.dtype.itemsize for array in simulation.snapshot.roads[0].values())
+    return META_CAPACITY + len(simulation.snapshot.roads) * cars * bytes_per_car
+
+
+class SnapshotChannel(SharedChannel):
+    """
+    SharedChannel carrying Snapshots: a JSON meta (step, metrics and the name, dtype and
+    length of every array) followed by the raw arrays.
+    """
+
+    def __init__(self, memory, owner):
+        super().__init__(memory, owner)
+        self.last_version = None
+        self.snapshot = None
+
+    def publish_snapshot(self, snapshot):
+        arrays = []
+        roads = []
+        for road in snapshot.roads:
+            roads.append([[name, array.dtype.str, len(array)] for name, array in road.items()])
+            arrays.extend(np.ascontiguousarray(array) for array in road.values())
+        meta = json.dumps({'step': snapshot.step, 'metrics': snapshot.metrics,
+                           'roads': roads}).encode()
+        self.publish([META_LENGTH.pack(len(meta)), meta, *arrays])
+
+    def latest(self):
+        """
+        Return the newest Snapshot (decoded once per published version), or None if
+        nothing was published yet.
+        """
+        value = self.read(self.last_version)
+        if value is not None:
+            self.last_version, data = value
+            self.snapshot = decode_snapshot(data)
+        return self.snapshot
+
+
+def decode_snapshot(data):
+    """
+    Rebuild a Snapshot from a SnapshotChannel payload; the arrays are read-only views of
+    `data`.
+    """
+    meta_length = META_LENGTH.unpack_from(data)[0]
+    offset = META_LENGTH.size + meta_length
+    meta = json.loads(data[META_LENGTH.size:offset])
+    roads = []
+    for descriptors in meta['roads']:
+        road = {}
+        for name, dtype, count in descriptors:
+            road[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += road[name].nbytes
+        roads.append(road)
+    return Snapshot(meta['step'], roads, meta['metrics'])
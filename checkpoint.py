@@ -0,0 +1,176 @@
+# checkpoint.py
+
+import json
+import os
+
+import numpy as np
+
+from road_engine import ArrayRoad, MultiLaneRoad, OpenRoad
+from simulation import Simulation
+
+CHECKPOINT_VERSION = 1
+
+ROADS = ('road1', 'road2')
+
+# Checkpoint array name -> Car attribute, for roads of Car objects
+CAR_FIELDS = {
+    'positions': 'position',
+    'velocities': 'velocity',
+    'adaptive_cruise_control': 'adaptive_cruise_control',
+    'speed_offset': 'speed_offset',
+    'slow_to_start': 'slow_to_start',
+    'last_error': 'last_error',
+    'integral_error': 'integral_error',
+    'total_distance': 'total_distance',
+    'stops': 'stops',
+    'time_in_traffic': 'time_in_traffic',
+}
+CAR_DTYPES = {
+    'adaptive_cruise_control': bool,
+    'slow_to_start': bool,
+    'last_error': float,
+    'integral_error': float,
+}
+
+
+def road_state(cars):
+    """
+    Return (arrays, scalars) holding the full state of one road.
+    """
+    if isinstance(cars, ArrayRoad):
+        arrays = {name: getattr(cars, name).copy() for name in cars.STATE_ARRAYS}
+        scalars = {'ticks': cars.ticks} if isinstance(cars, MultiLaneRoad) else {}
+        if isinstance(cars, OpenRoad):
+            scalars = cars.counters()
+        return arrays, scalars
+
+    # Cars in list (vehicle) order
+    arrays = {
+        name: np.array([getattr(car, attribute) for car in cars],
+                       dtype=CAR_DTYPES.get(name, np.int64))
+        for name, attribute in CAR_FIELDS.items()
+    }
+    index = {id(car): i for i, car in enumerate(cars)}
+    arrays['order'] = np.array([index[id(car)] for car in cars.order], dtype=np.int64)
+    return arrays, {}
+
+
+def load_road_state(cars, arrays, scalars):
+    """
+    Overwrite a freshly built road with a state taken by road_state.
+    """
+    if isinstance(cars, OpenRoad):
+        # Cars come and go, so the count need not match the freshly built road
+        cars.store(arrays)
+        for name in cars.COUNTERS:
+            setattr(cars, name, scalars[name])
+        return
+
+    if len(arrays['positions']) != len(cars):
+        raise ValueError("The checkpoint holds a different number of cars.")
+
+    if isinstance(cars, ArrayRoad):
+        for name in cars.STATE_ARRAYS:
+            setattr(cars, name, arrays[name].copy())
+        if isinstance(cars, MultiLaneRoad):
+            cars.ticks = scalars['ticks']
+        return
+
+    values = {name: arrays[name].tolist() for name in CAR_FIELDS}
+    for i, car in enumerate(cars):
+        for name, attribute in CAR_FIELDS.items():
+            setattr(car, attribute, values[name][i])
+    cars.order = [cars[i] for i in arrays['order'].tolist()]
+
+
+def save_checkpoint(simulation, path):
+    """
+    Write the full state of a simulation to `path` (a .npz file).
+
+    Saved are the parameters, the step counter, every car's state (positions, velocities,
+    ACC flags, speed offsets, slow-to-start flags, PID errors and the distance/stop/time
+    accumulators) and the state of both random streams, so a restored simulation continues
+    exactly as this one would have. Analytics and instrumentation are not saved. Call with
+    the lock held while the simulation is running.
+
+    Parameters:
+        simulation (Simulation): Simulation to save.
+        path (str): Output file; written to a temporary file first and then renamed, so an
+            existing checkpoint is never left half-written.
+    """
+    parameters = simulation.parameters()
+    if parameters['sensors'] is not None:
+        parameters['sensors'] = [int(cell) for cell in parameters['sensors']]
+    meta = {
+        'version': CHECKPOINT_VERSION,
+        'parameters': parameters,
+        'seed': {
+            'entropy': simulation.seed_sequence.entropy,
+            'spawn_key': list(simulation.seed_sequence.spawn_key),
+        },
+        'step': simulation.step,
+        'rng': {road: rng.bit_generator.state
+                for road, rng in zip(ROADS, (simulation.rng_road1, simulation.rng_road2))},
+        'roads': {},
+    }
+    arrays = {}
+    for road, cars in zip(ROADS, (simulation.cars_road1, simulation.cars_road2)):
+        road_arrays, scalars = road_state(cars)
+        meta['roads'][road] = scalars
+        arrays.update({f'{road}.{name}': values for name, values in road_arrays.items()})
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(path, **overrides):
+    """
+    Rebuild a Simulation from a checkpoint written by save_checkpoint.
+
+    Parameters:
+        path (str): Checkpoint file.
+        **overrides: Parameters that do not change the dynamics (e.g. steps_per_second)
+            to use instead of the saved ones.
+
+    Returns:
+        Simulation: The restored simulation, not running.
+
+    Raises:
+        ValueError: If the file is not a checkpoint of a supported version.
+    """
+    with np.load(path) as data:
+        if 'meta' not in data.files:
+            raise ValueError(f"{path} is not a checkpoint.")
+        meta = json.loads(data['meta'].item())
+        arrays = {name: data[name] for name in data.files if name != 'meta'}
+    if meta.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {meta.get('version')}")
+
+    parameters = dict(meta['parameters'], **overrides)
+    seed = np.random.SeedSequence(meta['seed']['entropy'],
+                                  spawn_key=tuple(meta['seed']['spawn_key']))
+    # Every car is overwritten below, so build with the cheapest placement; the source file
+    # of placement='checkpoint' need not exist any more
+    simulation = Simulation(seed=seed, **dict(parameters, placement='uniform',
+                                              placement_source=None))
+    simulation.placement = parameters.get('placement', 'random')
+    simulation.placement_source = parameters.get('placement_source')
+
+    for road, cars, rng in zip(ROADS, (simulation.cars_road1, simulation.cars_road2),
+                               (simulation.rng_road1, simulation.rng_road2)):
+        prefix = f'{road}.'
+        road_arrays = {name[len(prefix):]: values for name, values in arrays.items()
+                       if name.startswith(prefix)}
+        load_road_state(cars, road_arrays, meta['roads'][road])
+        # Cars and roads hold this same generator, so they all continue the saved stream
+        rng.bit_generator.state = meta['rng'][road]
+
+    simulation.step = meta['step']
+    simulation.compute_metrics()
+    simulation.publish_snapshot()
+    simulation.reset_analytics()
+    return simulation
@@ -0,0 +1,361 @@
+# ensemble.py
+
+import argparse
+import math
+import statistics
+import sys
+
+import numpy as np
+
+import kernels
+from acc import ACCParameters
+from Car import SEED
+from placement import place_cars
+from road_engine import VectorRoad, apply_rules
+from simulation import acc_flags
+
+# Per-replica metrics of Ensemble.replica_metrics, named like batch.run_headless' columns
+METRICS = ('speed', 'speed_std', 'flow', 'stopped', 'stops_per_car')
+
+
+def t_quantile(p, df):
+    """
+    Quantile of Student's t distribution: exact for 1 and 2 degrees of freedom, a
+    Cornish-Fisher expansion around the normal quantile otherwise (within 0.003 of the
+    exact value for p = 0.975 and 0.05 for p = 0.995, the worst case being 3 degrees of
+    freedom).
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) * math.sqrt(2 / (4 * p * (1 - p)))
+    z = statistics.NormalDist().inv_cdf(p)
+    return (z
+            + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+            + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z)
+            / (92160 * df ** 4))
+
+
+def confidence_interval(values, level=0.95):
+    """
+    Mean of independent replica values and its t confidence interval.
+
+    Returns:
+        dict: 'mean', 'std' (sample standard deviation over replicas), 'ci_low' and
+            'ci_high'. With fewer than 2 replicas nothing is known about the spread, so
+            'std' and the interval are NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    mean = float(values.mean()) if len(values) else 0.0
+    if len(values) < 2:
+        return {'mean': mean, 'std': math.nan, 'ci_low': math.nan, 'ci_high': math.nan}
+    std = float(values.std(ddof=1))
+    half_width = t_quantile(0.5 + level / 2, len(values) - 1) * std / math.sqrt(len(values))
+    return {'mean': mean, 'std': std, 'ci_low': mean - half_width,
+            'ci_high': mean + half_width}
+
+
+class Ensemble:
+    """
+    R independent replicas of one single-lane ring road, N cars each, held as (R, N) arrays
+    and advanced together.
+
+    Replica r is the road that Simulation(seed=seeds[r], engine='vector') builds as road
+    `road` (0 or 1), where seeds = np.random.SeedSequence(seed).spawn(R), the seeds
+    batch.sweep gives R replicas of a single configuration. The replicas evolve exactly like those
+    roads: same initial state, same random streams, VectorRoad's update semantics. Each row
+    is kept in ring order; one run_step updates every replica with one set of array
+    operations (or one call of kernels.update_rings when Numba is installed).
+    """
+
+    # Per-car (R, N) arrays, every row in ring order
+    STATE_ARRAYS = VectorRoad.STATE_ARRAYS
+
+    def __init__(self, replicas, L=100, N=24, vmax=3, p_fault=0.1, p_slow=0.5,
+                 prob_faster=0.50, prob_slower=0.10, prob_normal=0.40, acc_share=1.0, acc=None,
+                 placement='random', seed=SEED, road=0, use_kernel=None):
+        """
+        Initialize an Ensemble instance.
+
+        Parameters:
+            replicas (int): Number of replicas R.
+            L, N, vmax, p_fault, p_slow, prob_faster, prob_slower, prob_normal: As for
+                Simulation.
+            acc_share (float, optional): Share of ACC cars in every replica.
+            acc (ACCParameters or dict, optional): Controller parameters of the ACC cars.
+            placement (str, optional): 'random', 'uniform' or 'jam' (see placement.py).
+            seed (int or np.random.SeedSequence, optional): Root seed of the replicas.
+            road (int, optional): Which of a Simulation's two road streams every replica
+                uses (0: road 1, 1: road 2).
+            use_kernel (bool, optional): Step with kernels.update_rings; defaults to
+                whether Numba is installed.
+
+        Raises:
+            ValueError: On invalid parameters.
+        """
+        if replicas < 1:
+            raise ValueError("replicas must be at least 1.")
+        if N < 1 or N > L:
+            raise ValueError("N must be between 1 and L.")
+        if not 0.0 <= acc_share <= 1.0:
+            raise ValueError("acc_share must be between 0 and 1.")
+        if placement == 'checkpoint':
+            raise ValueError("An ensemble cannot start from a checkpoint.")
+        if road not in (0, 1):
+            raise ValueError("road must be 0 or 1.")
+
+        self.replicas = replicas
+        self.L = L
+        self.N = N
+        self.vmax = vmax
+        self.p_fault = p_fault
+        self.p_slow = p_slow
+        self.acc_share = acc_share
+        self.acc = ACCParameters.create(acc)
+        self.density = N / L
+        if use_kernel is None:
+            use_kernel = kernels.AVAILABLE
+        self.kernel = kernels.update_rings if use_kernel else None
+
+        # The same streams and initial draws as Simulation.initialize_cars (vector engine)
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        # The first R children of the seed, as a fresh seed.spawn(R) gives them, without
+        # spawning from the caller's sequence (so it can seed the other road's ensemble)
+        replica_seeds = [np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,),
+                                                pool_size=seed.pool_size)
+                         for i in range(replicas)]
+        self.rngs = [np.random.default_rng(replica_seed.spawn(2)[road])
+                     for replica_seed in replica_seeds]
+        rows = []
+        for rng in self.rngs:
+            flags = acc_flags(N, acc_share, rng)
+            positions, _, velocities = place_cars(placement, N, L, 1, rng)
+            if velocities is None:
+                velocities = rng.integers(1, vmax + 1, size=N)
+            rows.append(VectorRoad(L, vmax, p_fault, p_slow, positions, velocities, flags,
+                                   prob_faster, prob_slower, prob_normal, rng=rng,
+                                   use_kernel=False, acc=self.acc))
+        for name in self.STATE_ARRAYS:
+            setattr(self, name, np.stack([getattr(row, name) for row in rows]))
+
+        self.rand = np.empty((replicas, N))
+        self._replica_index = np.arange(replicas)
+        self._ring_index = np.arange(N)
+        self.step = 0
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        """
+        Start measuring afresh (e.g. after the warm-up).
+        """
+        R = self.replicas
+        self.measured_steps = 0
+        self.speed_sum = np.zeros(R)
+        self.speed_square_sum = np.zeros(R)
+        self.stopped_sum = np.zeros(R)
+        self.stop_events = np.zeros(R, dtype=np.int64)
+
+    def ring_origins(self):
+        """
+        Per replica, the index of the car with the smallest position. Rows whose ring order
+        a collision broke are sorted again first (see VectorRoad.ring_origin).
+        """
+        positions = self.positions
+        next_positions = np.roll(positions, -1, axis=1)
+        descents = (next_positions < positions) | (
+            (next_positions == positions) & (np.roll(self.ids, -1, axis=1) < self.ids))
+        counts = np.count_nonzero(descents, axis=1)
+        origins = np.where(counts == 1, (np.argmax(descents, axis=1) + 1) % self.N, 0)
+        for r in np.flatnonzero(counts > 1):
+            key = positions[r].astype(np.int64) * self.N + self.ids[r]
+            start = int(np.argmin(key))
+            order = (np.argsort(np.roll(key, -start), kind='stable') + start) % self.N
+            for name in self.STATE_ARRAYS:
+                array = getattr(self, name)
+                array[r] = array[r][order]
+            origins[r] = 0
+        return origins
+
+    def update(self, origins=None):
+        """
+        Advance every replica by one tick, without measuring.
+
+        Parameters:
+            origins (ndarray, optional): ring_origins() of the current state, if known.
+        """
+        if origins is None:
+            origins = self.ring_origins()
+        # One draw per car from every replica's own stream, indexed by position order
+        for rng, row in zip(self.rngs, self.rand):
+            rng.random(out=row)
+
+        if self.kernel is not None:
+            self.kernel(self.positions, self.velocities, self.adaptive_cruise_control,
+                        self.speed_offset, self.slow_to_start, self.last_error,
+                        self.integral_error, self.total_distance, self.stops,
+                        self.time_in_traffic, self.rand, origins, self.L, self.vmax,
+                        self.p_fault, self.p_slow, *self.acc)
+            self.step += 1
+            return
+
+        R, N = self.positions.shape
+        rows = self._replica_index
+        positions = self.positions
+        velocities = self.velocities
+
+        next_velocities = np.roll(velocities, -1, axis=1)
+        distances = np.roll(positions, -1, axis=1) - positions - 1
+        np.add(distances, self.L, out=distances, where=distances < 0)
+        # Entry k of a replica's draw belongs to its k-th car from the origin
+        rand = self.rand[rows[:, None], (self._ring_index - origins[:, None]) % N]
+
+        # The rules are elementwise, so all replicas go through them as one flat road
+        state = (self.adaptive_cruise_control, self.speed_offset, self.slow_to_start,
+                 self.last_error, self.integral_error)
+        new_state = apply_rules(velocities.ravel(), distances.ravel(), next_velocities.ravel(),
+                                *(array.ravel() for array in state), rand.ravel(), self.vmax,
+                                self.p_fault, self.p_slow, self.acc)
+        new_state = [array.reshape(R, N) for array in new_state]
+
+        if N > 1:
+            # In every replica the car with the largest position sees its leader's updated
+            # velocity
+            last = (origins - 1) % N
+            fixed = apply_rules(velocities[rows, last], distances[rows, last],
+                                new_state[0][rows, origins],
+                                *(array[rows, last] for array in state), rand[rows, last],
+                                self.vmax, self.p_fault, self.p_slow, self.acc)
+            for array, value in zip(new_state, fixed):
+                array[rows, last] = value
+
+        self.velocities, self.slow_to_start, self.last_error, self.integral_error = new_state
+
+        # Move
+        self.positions = positions + self.velocities
+        np.subtract(self.positions, self.L, out=self.positions, where=self.positions >= self.L)
+        np.add(self.positions, self.L, out=self.positions, where=self.positions < 0)
+        self.total_distance += self.velocities
+        self.stops += self.velocities == 0
+        self.time_in_traffic += 1
+        self.step += 1
+
+    def run_step(self):
+        """
+        Advance every replica by one tick and add it to the measured metrics.
+        """
+        # Slots keep their car within a tick (a re-sort only happens at its start)
+        origins = self.ring_origins()
+        moving = self.velocities > 0
+        self.update(origins)
+        velocities = self.velocities
+        stopped = velocities == 0
+        self.speed_sum += velocities.mean(axis=1)
+        self.speed_square_sum += np.einsum('ij,ij->i', velocities, velocities)
+        self.stopped_sum += np.count_nonzero(stopped, axis=1)
+        self.stop_events += np.count_nonzero(moving & stopped, axis=1)
+        self.measured_steps += 1
+
+    def fast_forward(self, steps):
+        """
+        Run steps without measuring, e.g. to get past the warm-up transient.
+        """
+        for _ in range(steps):
+            self.update()
+
+    def run(self, steps, warmup=0, level=0.95):
+        """
+        Skip `warmup` steps, then measure `steps` steps (from fresh metrics).
+
+        Returns:
+            dict: summary(level) of the measured steps.
+        """
+        self.fast_forward(warmup)
+        self.reset_metrics()
+        for _ in range(steps):
+            self.run_step()
+        return self.summary(level)
+
+    def replica_metrics(self):
+        """
+        Per-replica metrics over the measured steps, as batch.run_headless reports them for
+        one road: time-averaged mean speed, standard deviation of the speeds over cars and
+        steps, flow (density x mean speed), time-averaged number of stopped cars and stop
+        events (moving -> stopped) per car.
+
+        Returns:
+            dict: Metric name (see METRICS) -> array of R values.
+        """
+        steps = self.measured_steps
+        if not steps:
+            return {name: np.zeros(self.replicas) for name in METRICS}
+        speed = self.speed_sum / steps
+        mean_square = self.speed_square_sum / (steps * self.N)
+        return {
+            'speed': speed,
+            'speed_std': np.sqrt(np.maximum(mean_square - speed ** 2, 0.0)),
+            'flow': self.density * speed,
+            'stopped': self.stopped_sum / steps,
+            'stops_per_car': self.stop_events / self.N,
+        }
+
+    def summary(self, level=0.95):
+        """
+        Aggregate of the replica metrics: per metric, the mean over replicas with its
+        t confidence interval at `level` (see confidence_interval).
+
+        Returns:
+            dict: 'replicas', 'steps', 'density' and metric name -> interval dict.
+        """
+        summary = {'replicas': self.replicas, 'steps': self.measured_steps,
+                   'density': self.density}
+        for name, values in self.replica_metrics().items():
+            summary[name] = confidence_interval(values, level)
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run replicas of one road configuration as an ensemble and report the "
+                    "metrics with confidence intervals.")
+    parser.add_argument('--replicas', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=0)
+    parser.add_argument('--L', type=int, default=100)
+    parser.add_argument('--N', type=int, default=24)
+    parser.add_argument('--vmax', type=int, default=3)
+    parser.add_argument('--p-fault', type=float, default=0.1)
+    parser.add_argument('--p-slow', type=float, default=0.5)
+    parser.add_argument('--acc-share', type=float, default=1.0)
+    parser.add_argument('--placement', choices=['random', 'uniform', 'jam'], default='random')
+    parser.add_argument('--level', type=float, default=0.95, help="Confidence level")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--python', action='store_true',
+                        help="Step with NumPy even if the Numba kernel is available")
+    args = parser.parse_args(argv)
+    if not 0.0 < args.level < 1.0:
+        parser.error("--level must be between 0 and 1")
+    if args.replicas < 2:
+        parser.error("--replicas must be at least 2 for confidence intervals")
+
+    try:
+        ensemble = Ensemble(args.replicas, L=args.L, N=args.N, vmax=args.vmax,
+                            p_fault=args.p_fault, p_slow=args.p_slow, acc_share=args.acc_share,
+                            placement=args.placement, seed=args.seed,
+                            use_kernel=False if args.python else None)
+    except ValueError as e:
+        parser.error(str(e))
+    summary = ensemble.run(args.steps, args.warmup, level=args.level)
+    print(f"{summary['replicas']} replicas x {summary['steps']} steps, "
+          f"density {summary['density']:.3f}, {args.level:.0%} confidence intervals:")
+    for name in METRICS:
+        interval = summary[name]
+        print(f"{name:>14}: {interval['mean']:.4f}  [{interval['ci_low']:.4f}, "
+              f"{interval['ci_high']:.4f}]  (std {interval['std']:.4f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# inflow.py
+
+import math
+
+import numpy as np
+
+
+class Inflow:
+    """
+    Demand at the entrance of an open road: how many vehicles arrive on every step.
+
+    The demand is a rate (vehicles per step) or a timed profile of (step, rate) pairs, each
+    rate holding from its step until the next one, optionally repeating every `period`
+    steps. Arrivals are Poisson at the current rate, or with poisson=False spread evenly
+    (one whenever the cumulative demand passes a whole vehicle).
+
+    An Inflow holds no state between steps, so both roads of a simulation share one and
+    nothing of it needs checkpointing; random arrivals come from the road's own stream.
+    """
+
+    __slots__ = ('starts', 'rates', 'poisson', 'period', 'cumulative')
+
+    def __init__(self, profile, poisson=True, period=None):
+        """
+        Initialize an Inflow instance.
+
+        Parameters:
+            profile (float or list): A constant rate, or (step, rate) pairs with
+                increasing steps, the first at step 0.
+            poisson (bool, optional): Poisson arrivals (True) or evenly timed ones.
+            period (int, optional): Repeat the profile every this many steps (after its
+                last step).
+
+        Raises:
+            ValueError: On negative rates, a profile that does not start at step 0 or has
+                steps out of order, or a period that does not cover the profile.
+        """
+        if isinstance(profile, (int, float)):
+            profile = [(0, profile)]
+        try:
+            starts = np.array([int(step) for step, _ in profile], dtype=np.int64)
+            rates = np.array([float(rate) for _, rate in profile])
+        except (TypeError, ValueError):
+            raise ValueError("An inflow profile is a list of (step, rate) pairs.") from None
+        if len(starts) == 0 or starts[0] != 0 or np.any(np.diff(starts) <= 0):
+            raise ValueError("Inflow profile steps must increase from step 0.")
+        if not np.all(np.isfinite(rates) & (rates >= 0)):
+            raise ValueError("Inflow rates must not be negative.")
+        if period is not None and not int(period) > starts[-1]:
+            raise ValueError("The inflow period must be longer than the profile.")
+
+        self.starts = starts
+        self.rates = rates
+        self.poisson = bool(poisson)
+        self.period = int(period) if period is not None else None
+        # Vehicles demanded before each profile step
+        self.cumulative = np.concatenate(([0.0], np.cumsum(rates[:-1] * np.diff(starts))))
+
+    @classmethod
+    def create(cls, spec=None):
+        """
+        Build an inflow from None (no inflow), a rate, a dict of {'rate' or 'profile',
+        'poisson', 'period'} or an Inflow.
+
+        Raises:
+            ValueError: On unknown keys or invalid values.
+        """
+        if spec is None or isinstance(spec, cls):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls(spec)
+        unknown = set(spec) - {'rate', 'profile', 'poisson', 'period'}
+        if unknown:
+            raise ValueError(f"Unknown inflow settings: {sorted(unknown)}")
+        if ('rate' in spec) == ('profile' in spec):
+            raise ValueError("An inflow needs either a rate or a profile.")
+        profile = spec['profile'] if 'profile' in spec else float(spec['rate'])
+        return cls(profile, spec.get('poisson', True), spec.get('period'))
+
+    def spec(self):
+        """
+        Return the settings as a JSON-ready dict that create() accepts.
+        """
+        profile = [[int(step), float(rate)] for step, rate in zip(self.starts, self.rates)]
+        spec = {'profile': profile, 'poisson': self.poisson}
+        if self.period is not None:
+            spec['period'] = self.period
+        return spec
+
+    def rate(self, step):
+        """
+        Vehicles per step demanded at `step`.
+        """
+        if self.period is not None:
+            step %= self.period
+        return float(self.rates[np.searchsorted(self.starts, step, side='right') - 1])
+
+    def demand(self, step):
+        """
+        Vehicles demanded over steps [0, step).
+        """
+        if self.period is None:
+            return self._profile_demand(step)
+        periods, step = divmod(step, self.period)
+        return periods * self._profile_demand(self.period) + self._profile_demand(step)
+
+    def _profile_demand(self, step):
+        # One pass through the profile, the last rate holding on
+        index = np.searchsorted(self.starts, step, side='right') - 1
+        return float(self.cumulative[index] + self.rates[index] * (step - self.starts[index]))
+
+    def arrivals(self, step, rng):
+        """
+        Number of vehicles arriving at `step`.
+
+        Parameters:
+            step (int): Step of the road.
+            rng (np.random.Generator): Random stream of the road (Poisson arrivals only).
+        """
+        if self.poisson:
+            return int(rng.poisson(self.rate(step)))
+        # Tolerance keeps e.g. 5 x 0.2 vehicles from summing to just under one
+        return (math.floor(self.demand(step + 1) + 1e-9)
+                - math.floor(self.demand(step) + 1e-9))
@@ -0,0 +1,227 @@
+# instrumentation.py
+
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """
+    Last `window` observations in a ring buffer, plus running count and sum.
+
+    Observing is O(1); quantiles are only computed when read.
+    """
+
+    def __init__(self, window=1024):
+        self.values = np.zeros(window)
+        self.filled = 0
+        self.index = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.filled = min(self.filled + 1, len(self.values))
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self, quantiles=QUANTILES):
+        if not self.filled:
+            return {q: float('nan') for q in quantiles}
+        values = np.quantile(self.values[:self.filled], quantiles)
+        return dict(zip(quantiles, values.tolist()))
+
+    def to_dict(self):
+        return {'window': len(self.values), 'values': self.values[:self.filled].tolist(),
+                'index': self.index, 'count': self.count, 'sum': self.sum}
+
+    @classmethod
+    def from_dict(cls, state):
+        histogram = cls(state['window'])
+        histogram.filled = len(state['values'])
+        histogram.values[:histogram.filled] = state['values']
+        histogram.index = state['index']
+        histogram.count = state['count']
+        histogram.sum = state['sum']
+        return histogram
+
+
+class RateMeter:
+    """
+    Events per second over the last `window` events.
+    """
+
+    def __init__(self, window=256, clock=time.monotonic):
+        self.clock = clock
+        self.times = np.zeros(window)
+        self.filled = 0
+        self.index = 0
+
+    def tick(self):
+        self.times[self.index] = self.clock()
+        self.index = (self.index + 1) % len(self.times)
+        self.filled = min(self.filled + 1, len(self.times))
+
+    def rate(self):
+        if self.filled < 2:
+            return 0.0
+        oldest = self.times[self.index if self.filled == len(self.times) else 0]
+        elapsed = self.clock() - oldest
+        return (self.filled - 1) / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        # Monotonic clock readings, comparable between processes on the same host
+        return {'window': len(self.times), 'times': self.times[:self.filled].tolist(),
+                'index': self.index}
+
+    @classmethod
+    def from_dict(cls, state, clock=time.monotonic):
+        meter = cls(state['window'], clock)
+        meter.filled = len(state['times'])
+        meter.times[:meter.filled] = state['times']
+        meter.index = state['index']
+        return meter
+
+
+class Instruments:
+    """
+    Hot-path timers, size histograms and event counters of one simulation.
+
+    Durations are in seconds, sizes in bytes. Names become Prometheus metric names
+    (traffic_<name>_seconds / traffic_<name>_bytes / traffic_<name>_total).
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.timers = {}
+        self.sizes = {}
+        self.counters = {}
+        self.steps = RateMeter()
+
+    def _histogram(self, histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = RollingHistogram(self.window)
+        return histogram
+
+    def observe_time(self, name, seconds):
+        self._histogram(self.timers, name).observe(seconds)
+
+    def observe_size(self, name, size):
+        self._histogram(self.sizes, name).observe(size)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        """
+        Return the instruments as plain JSON-serializable data (see from_dict).
+        """
+        return {
+            'window': self.window,
+            'timers': {name: histogram.to_dict() for name, histogram in self.timers.items()},
+            'sizes': {name: histogram.to_dict() for name, histogram in self.sizes.items()},
+            'counters': dict(self.counters),
+            'steps': self.steps.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        Rebuild instruments exported with to_dict (e.g. by another process).
+        """
+        instruments = cls(state['window'])
+        for histograms, states in ((instruments.timers, state['timers']),
+                                   (instruments.sizes, state['sizes'])):
+            for name, histogram in states.items():
+                histograms[name] = RollingHistogram.from_dict(histogram)
+        instruments.counters.update(state['counters'])
+        instruments.steps = RateMeter.from_dict(state['steps'])
+        return instruments
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_time(name, time.perf_counter() - start)
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _summary(lines, metric, labels, histogram):
+    for q, value in histogram.quantiles().items():
+        lines.append(f'{metric}{_labels(labels, quantile=q)} {value:.9g}')
+    lines.append(f'{metric}_sum{_labels(labels)} {histogram.sum:.9g}')
+    lines.append(f'{metric}_count{_labels(labels)} {histogram.count}')
+
+
+def render_prometheus(sources):
+    """
+    Render instruments in the Prometheus text exposition format.
+
+    Parameters:
+        sources (list): (labels dict, Instruments, target steps per second) per simulation;
+            a target of None leaves out the step rate gauges (e.g. for replays).
+
+    Returns:
+        str: The exposition text.
+    """
+    families = {}
+    for labels, instruments, target in sources:
+        for name, histogram in instruments.timers.items():
+            metric = f'traffic_{name}_seconds'
+            _summary(families.setdefault((metric, 'summary'), []), metric, labels, histogram)
+        for name, histogram in instruments.sizes.items():
+            metric = f'traffic_{name}_bytes'
+            _summary(families.setdefault((metric, 'summary'), []), metric, labels, histogram)
+        for name, value in instruments.counters.items():
+            metric = f'traffic_{name}_total'
+            families.setdefault((metric, 'counter'), []).append(
+                f'{metric}{_labels(labels)} {value}')
+        if target is None:
+            continue
+        families.setdefault(('traffic_steps_per_second', 'gauge'), []).append(
+            f'traffic_steps_per_second{_labels(labels)} {instruments.steps.rate():.9g}')
+        families.setdefault(('traffic_target_steps_per_second', 'gauge'), []).append(
+            f'traffic_target_steps_per_second{_labels(labels)} {target:.9g}')
+
+    lines = []
+    for (metric, kind), samples in families.items():
+        lines.append(f'# TYPE {metric} {kind}')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def profile(duration, sleep=time.sleep, limit=40):
+    """
+    Profile everything the current OS thread runs for `duration` seconds.
+
+    Under eventlet every green thread (simulation loops included) shares the OS thread,
+    so passing socketio.sleep as `sleep` samples the whole server.
+
+    Returns:
+        str: pstats report sorted by cumulative time.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        sleep(duration)
+    finally:
+        profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,193 @@
+# kernels.py
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Optional; VectorRoad falls back to the NumPy rules (apply_rules)
+    numba = None
+
+# Whether update_ring is compiled; without Numba it is plain (slow) Python
+AVAILABLE = numba is not None
+
+
+def _jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@_jit
+def update_ring(positions, velocities, adaptive_cruise_control, speed_offset, slow_to_start,
+                last_error, integral_error, total_distance, stops, time_in_traffic, rand,
+                origin, road_length, max_speed, p_fault, p_slow, safe_time_headway,
+                standstill_distance, w_speed, kp, ki, kd, threshold, fault_factor):
+    """
+    Advance a single-lane ring road by one tick, in place, in one pass over flat arrays.
+
+    The same rules as Car.update_velocity and apply_rules, with VectorRoad.update's
+    sequential semantics: cars update in position order starting at `origin`, so only the
+    last one sees its leader's new velocity. Compiled with Numba when it is installed.
+
+    Parameters:
+        positions ... time_in_traffic (ndarray): VectorRoad arrays, in ring order.
+        rand (ndarray): One uniform [0, 1) draw per car, indexed by position order (entry 0
+            belongs to the car at `origin`).
+        origin (int): Index of the car with the smallest position.
+        road_length (int): Length of the road.
+        max_speed (int): Maximum speed of the road.
+        p_fault (float): Probability of a random slowdown (fault).
+        p_slow (float): Probability of slow-to-start behavior.
+        safe_time_headway ... fault_factor (float): ACC controller parameters, in
+            ACCParameters field order (pass *acc).
+    """
+    num_cars = len(positions)
+    acc_p_fault = p_fault * fault_factor
+    leader = origin
+    for k in range(num_cars):
+        # Walk the ring without a modulo per car
+        i = leader
+        leader = i + 1
+        if leader == num_cars:
+            leader = 0
+        v = velocities[i]
+        vn = velocities[leader]
+        d = positions[leader] - positions[i] - 1
+        if d < 0:
+            d += road_length
+        r = rand[k]
+
+        if v == 0:
+            # Slow-to-Start Logic
+            if d > 1:
+                if slow_to_start[i]:
+                    velocities[i] = 1
+                    slow_to_start[i] = False
+                elif r < p_slow:
+                    slow_to_start[i] = True
+                else:
+                    velocities[i] = 1
+            else:
+                slow_to_start[i] = False
+            continue
+
+        if adaptive_cruise_control[i]:
+            # PID on the combined distance/speed error
+            desired_gap = standstill_distance + v * safe_time_headway
+            error_distance = desired_gap - d
+            error_speed = vn - v
+            combined_error = error_distance + w_speed * error_speed
+            integral_error[i] += combined_error
+            derivative_error = combined_error - last_error[i]
+            last_error[i] = combined_error
+            acceleration_change = (kp * combined_error + ki * integral_error[i]
+                                   + kd * derivative_error)
+            if acceleration_change > threshold:
+                v = max(v - 1, 0)
+            elif acceleration_change < -threshold and v < max_speed:
+                v = min(v + 1, max_speed)
+            if v > 0 and r < acc_p_fault:
+                v -= 1
+        else:
+            # Rule 2: Deceleration near next car
+            if d <= v:
+                if v < vn or v <= 2:
+                    v = d - 1
+                else:
+                    v = min(d - 1, v - 2)
+            # Rule 3: Deceleration if within 2v but not too close
+            elif d <= 2 * v:
+                if v >= vn + 4:
+                    v = max(v - 2, 0)
+                elif vn + 2 <= v <= vn + 3:
+                    v = max(v - 1, 0)
+            # Rule 4: Acceleration
+            if v < max_speed + speed_offset[i] and d > v + 1:
+                v += 1
+            # Rule 5: Randomization
+            if v > 0 and r < p_fault:
+                v -= 1
+        velocities[i] = v
+
+    # Move
+    for i in range(num_cars):
+        v = velocities[i]
+        position = positions[i] + v
+        if position >= road_length:
+            position -= road_length
+        elif position < 0:
+            position += road_length
+        positions[i] = position
+        total_distance[i] += v
+        if v == 0:
+            stops[i] += 1
+        time_in_traffic[i] += 1
+
+
+@_jit
+def update_rings(positions, velocities, adaptive_cruise_control, speed_offset, slow_to_start,
+                 last_error, integral_error, total_distance, stops, time_in_traffic, rand,
+                 origins, road_length, max_speed, p_fault, p_slow, safe_time_headway,
+                 standstill_distance, w_speed, kp, ki, kd, threshold, fault_factor):
+    """
+    update_ring for every row of 2-D arrays (one independent ring per row, e.g. the
+    replicas of an Ensemble) in a single call.
+
+    Parameters:
+        positions ... rand (ndarray): As for update_ring, with one row per ring.
+        origins (ndarray): Per row, the index of the car with the smallest position.
+        road_length ... fault_factor: As for update_ring, shared by all rings.
+    """
+    for r in range(positions.shape[0]):
+        update_ring(positions[r], velocities[r], adaptive_cruise_control[r], speed_offset[r],
+                    slow_to_start[r], last_error[r], integral_error[r], total_distance[r],
+                    stops[r], time_in_traffic[r], rand[r], origins[r], road_length, max_speed,
+                    p_fault, p_slow, safe_time_headway, standstill_distance, w_speed, kp, ki,
+                    kd, threshold, fault_factor)
+
+
+def verify(steps=500, seeds=(0, 1, 2), sizes=((100, 24), (100, 70), (1000, 300)),
+           acc_shares=(0.0, 0.5, 1.0), kernel=None, acc=None):
+    """
+    Check update_ring bit-for-bit against VectorRoad's NumPy path under the same streams.
+
+    Every case builds two identical roads from one seed, steps one with the NumPy rules
+    and one with the kernel, and compares all per-car arrays after every step.
+
+    Parameters:
+        kernel (callable, optional): Kernel to check; update_ring if None. Pass
+            update_ring.py_func to check the uncompiled Python version.
+        acc (ACCParameters or dict, optional): Controller parameters of the roads.
+
+    Returns:
+        list: (seed, L, N, acc_share, first differing step or None) per case.
+    """
+    from road_engine import VectorRoad
+
+    kernel = kernel or update_ring
+    results = []
+    for seed in seeds:
+        for (L, N), acc_share in ((size, share) for size in sizes for share in acc_shares):
+            roads = []
+            for use_kernel in (False, True):
+                rng = np.random.default_rng(seed)
+                flags = np.zeros(N, dtype=bool)
+                flags[:int(round(acc_share * N))] = True
+                road = VectorRoad(L, 3, 0.1, 0.5, rng.choice(L, N, replace=False),
+                                  rng.integers(1, 4, size=N), rng.permutation(flags), rng=rng,
+                                  use_kernel=False, acc=acc)
+                if use_kernel:
+                    road.kernel = kernel
+                roads.append(road)
+            reference, compiled = roads
+            mismatch = None
+            for step in range(steps):
+                reference.update()
+                compiled.update()
+                if not all(np.array_equal(getattr(reference, name), getattr(compiled, name))
+                           for name in VectorRoad.STATE_ARRAYS):
+                    mismatch = step
+                    break
+            results.append((seed, L, N, acc_share, mismatch))
+    return results
+
@@ -0,0 +1,115 @@
+# placement.py
+
+import numpy as np
+
+# Initial placement modes of Simulation
+PLACEMENTS = ('random', 'uniform', 'jam', 'checkpoint')
+
+
+def random_cells(num_cars, road_length, lanes, rng):
+    """
+    Distinct cells drawn uniformly in one vectorized call (no rejection sampling).
+
+    Returns:
+        tuple: (positions, lanes) ndarrays, in draw order.
+    """
+    cells = rng.choice(road_length * lanes, num_cars, replace=False)
+    return cells % road_length, cells // road_length
+
+
+def uniform_cells(num_cars, road_length, lanes):
+    """
+    Cells spread as evenly as possible over the road, the lanes of a position filled in
+    turn (car k takes cell floor(k * L * lanes / N) in position-major order).
+
+    Returns:
+        tuple: (positions, lanes) ndarrays, in position order.
+    """
+    cells = np.arange(num_cars, dtype=np.int64) * (road_length * lanes) // num_cars
+    return cells // lanes, cells % lanes
+
+
+def jam_cells(num_cars, road_length, lanes, start=0):
+    """
+    One compact queue, every lane of a position occupied, from cell `start` downstream.
+
+    Returns:
+        tuple: (positions, lanes) ndarrays, in position order.
+    """
+    cars = np.arange(num_cars, dtype=np.int64)
+    return (start + cars // lanes) % road_length, cars % lanes
+
+
+def checkpoint_cells(path, road, num_cars, road_length, lanes):
+    """
+    Positions, lanes and velocities of one road of a checkpoint (see checkpoint.py).
+
+    Returns:
+        tuple: (positions, lanes, velocities) ndarrays, in the checkpoint's order.
+
+    Raises:
+        ValueError: If the checkpoint's road does not fit this road.
+    """
+    with np.load(path) as data:
+        prefix = f'{road}.'
+        if prefix + 'positions' not in data.files:
+            raise ValueError(f"{path} holds no cars of {road}.")
+        positions = data[prefix + 'positions'].astype(np.int64)
+        velocities = data[prefix + 'velocities'].astype(np.int64)
+        if prefix + 'lanes' in data.files:
+            car_lanes = data[prefix + 'lanes'].astype(np.int64)
+        else:
+            car_lanes = np.zeros(len(positions), dtype=np.int64)
+
+    if len(positions) != num_cars:
+        raise ValueError(f"{path} holds {len(positions)} cars on {road}, not {num_cars}.")
+    if num_cars and (positions.min() < 0 or positions.max() >= road_length
+                     or car_lanes.min() < 0 or car_lanes.max() >= lanes):
+        raise ValueError(f"The cars of {path} do not fit a road of {road_length} cells and "
+                         f"{lanes} lane(s).")
+    if len(np.unique(car_lanes * road_length + positions)) != num_cars:
+        raise ValueError(f"{path} places several cars of {road} in one cell.")
+    return positions, car_lanes, velocities
+
+
+def place_cars(mode, num_cars, road_length, lanes=1, rng=None, source=None, road='road1'):
+    """
+    Initial cells (and, for some modes, velocities) of the cars of one road.
+
+    Modes:
+        'random': distinct cells drawn uniformly at random.
+        'uniform': evenly spaced cars (deterministic).
+        'jam': one standing queue from cell 0, velocities 0 (deterministic).
+        'checkpoint': the cars of `road` in the checkpoint file `source`, with their saved
+            velocities. Only the placement is taken over; ACC flags, speed offsets and
+            controller state are set up afresh.
+
+    Parameters:
+        mode (str): One of PLACEMENTS.
+        num_cars (int): Number of cars.
+        road_length (int): Length of the road.
+        lanes (int, optional): Lanes of the road.
+        rng (np.random.Generator, optional): Random stream for 'random'.
+        source (str, optional): Checkpoint file for 'checkpoint'.
+        road (str, optional): Road of the checkpoint to take ('road1' or 'road2').
+
+    Returns:
+        tuple: (positions, lanes, velocities) ndarrays. velocities is None when the mode
+            leaves them to the caller.
+
+    Raises:
+        ValueError: On an unknown mode, more cars than cells, or an unusable checkpoint.
+    """
+    if num_cars > road_length * lanes:
+        raise ValueError("N must not exceed the number of cells (L * lanes).")
+    if mode == 'random':
+        return (*random_cells(num_cars, road_length, lanes, rng), None)
+    if mode == 'uniform':
+        return (*uniform_cells(num_cars, road_length, lanes), None)
+    if mode == 'jam':
+        return (*jam_cells(num_cars, road_length, lanes), np.zeros(num_cars, dtype=np.int64))
+    if mode == 'checkpoint':
+        if source is None:
+            raise ValueError("placement='checkpoint' needs a placement_source file.")
+        return checkpoint_cells(source, road, num_cars, road_length, lanes)
+    raise ValueError(f"Unknown placement: {mode}")
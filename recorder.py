@@ -0,0 +1,223 @@
+# recorder.py
+
+import json
+import os
+
+import numpy as np
+
+ROADS = ('road1', 'road2')
+
+# Per-car columns: snapshot array name -> on-disk dtype
+CAR_COLUMNS = {
+    'positions': np.int32,
+    'velocities': np.int8,
+    'lanes': np.int8,
+}
+# Per-road metric columns: metrics key -> on-disk dtype
+METRIC_COLUMNS = {
+    'average_speed': np.float32,
+    'stopped_vehicles': np.int32,
+}
+
+
+def _chunk_name(column, chunk):
+    return f'{column}.{chunk:06d}.npy'
+
+
+class Recorder:
+    """
+    Stream a simulation's per-step, per-car state and per-road metrics to disk.
+
+    Every column (e.g. road1 velocities) is stored as a series of .npy chunk files of
+    chunk_steps rows, preallocated and written through a memory map. Only the current
+    chunk of each column is mapped, so memory stays bounded however many steps are
+    recorded. Files are plain .npy arrays that Recording (or np.load with mmap_mode='r')
+    reads back without copying.
+
+    Layout of the directory:
+        meta.json                       parameters, chunk size, car counts, steps recorded
+        step.<chunk>.npy                step number of every row
+        <road>.<column>.<chunk>.npy     (chunk_steps, cars) per-car columns
+        <road>.<metric>.<chunk>.npy     (chunk_steps,) per-road metrics
+        <road>.totals.npz               per-car total_distance, stops, time_in_traffic
+    """
+
+    def __init__(self, directory, simulation, chunk_steps=1024):
+        """
+        Initialize a Recorder instance.
+
+        Parameters:
+            directory (str): Output directory, created if missing.
+            simulation (Simulation): Simulation to record; its parameters go to meta.json.
+            chunk_steps (int, optional): Rows (steps) per chunk file.
+
+        Raises:
+            ValueError: For open roads, whose car count changes from step to step.
+        """
+        if simulation.boundary != 'ring':
+            raise ValueError("Only ring roads (a fixed number of cars) can be recorded.")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_steps = chunk_steps
+        self.steps = 0
+        self.row = 0
+        self.chunk = -1
+        self.maps = {}
+
+        snapshot = simulation.snapshot
+        self.car_columns = [name for name in CAR_COLUMNS if name in snapshot.roads[0]]
+        self.num_cars = [len(road['positions']) for road in snapshot.roads]
+        self.meta = {
+            'version': 1,
+            'chunk_steps': chunk_steps,
+            'roads': list(ROADS),
+            'num_cars': self.num_cars,
+            'car_columns': {name: np.dtype(CAR_COLUMNS[name]).str for name in self.car_columns},
+            'metric_columns': {name: np.dtype(dtype).str for name, dtype in METRIC_COLUMNS.items()},
+            'parameters': {
+                name: getattr(simulation, name)
+                for name in ('L', 'N', 'vmax', 'p_fault', 'p_slow', 'prob_faster',
+                             'prob_slower', 'prob_normal', 'engine', 'acc_share',
+                             'acc_share_road2', 'lanes')
+            },
+            'adaptive_cruise_control': [road['adaptive_cruise_control'].tolist()
+                                        for road in snapshot.roads],
+            'steps': 0,
+            'first_step': None,
+        }
+        self.write_meta()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write_meta(self):
+        self.meta['steps'] = self.steps
+        path = self._path('meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(path + '.tmp', path)
+
+    def _open_chunk(self):
+        self._close_chunk()
+        self.chunk += 1
+        self.row = 0
+        shapes = {'step': ((self.chunk_steps,), np.int64)}
+        for road, num_cars in zip(ROADS, self.num_cars):
+            for name in self.car_columns:
+                shapes[f'{road}.{name}'] = ((self.chunk_steps, num_cars), CAR_COLUMNS[name])
+            for name, dtype in METRIC_COLUMNS.items():
+                shapes[f'{road}.{name}'] = ((self.chunk_steps,), dtype)
+        self.maps = {
+            column: np.lib.format.open_memmap(self._path(_chunk_name(column, self.chunk)),
+                                              mode='w+', dtype=dtype, shape=shape)
+            for column, (shape, dtype) in shapes.items()
+        }
+
+    def _close_chunk(self):
+        for array in self.maps.values():
+            array.flush()
+        # Dropping the last references unmaps the files
+        self.maps = {}
+
+    def record(self, simulation):
+        """
+        Append the simulation's current snapshot as one row.
+        """
+        snapshot = simulation.snapshot
+        if self.row == self.chunk_steps or not self.maps:
+            self._open_chunk()
+        row = self.row
+        maps = self.maps
+        maps['step'][row] = snapshot.step
+        for road, arrays, metrics in zip(ROADS, snapshot.roads, snapshot.metrics):
+            for name in self.car_columns:
+                maps[f'{road}.{name}'][row] = arrays[name]
+            for name in METRIC_COLUMNS:
+                maps[f'{road}.{name}'][row] = metrics[name]
+        if self.meta['first_step'] is None:
+            self.meta['first_step'] = snapshot.step
+        self.row += 1
+        self.steps += 1
+        if self.row == self.chunk_steps:
+            # Chunk boundary: make what is on disk readable up to here
+            self._close_chunk()
+            self.write_meta()
+
+    def close(self, simulation=None):
+        """
+        Flush the last chunk and write meta.json; with a simulation, also export the
+        per-car totals (distance, stopped steps, steps on the road).
+        """
+        self._close_chunk()
+        if simulation is not None:
+            for road, cars in zip(ROADS, (simulation.cars_road1, simulation.cars_road2)):
+                np.savez(self._path(f'{road}.totals.npz'), **simulation.road_totals(cars))
+        self.write_meta()
+
+
+class Recording:
+    """
+    Read-only access to a Recorder directory. Chunks are memory-mapped, not loaded.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.chunk_steps = self.meta['chunk_steps']
+        self.steps = self.meta['steps']
+
+    def __len__(self):
+        return self.steps
+
+    @property
+    def num_chunks(self):
+        return -(-self.steps // self.chunk_steps)
+
+    def chunk(self, column, index):
+        """
+        Return chunk `index` of a column ('step', 'road1.velocities', ...) as a read-only
+        memory map, trimmed to the rows actually recorded.
+        """
+        if not 0 <= index < self.num_chunks:
+            raise IndexError(f"Chunk {index} out of range.")
+        rows = min(self.chunk_steps, self.steps - index * self.chunk_steps)
+        array = np.load(os.path.join(self.directory, _chunk_name(column, index)), mmap_mode='r')
+        return array[:rows]
+
+    def column_layout(self, column):
+        """
+        Return (dtype, row shape) of a column from the metadata: () for the step and metric
+        columns, (cars,) for per-car columns.
+        """
+        if column == 'step':
+            return np.dtype(np.int64), ()
+        road, name = column.split('.', 1)
+        if name in self.meta['car_columns']:
+            cars = self.meta['num_cars'][self.meta['roads'].index(road)]
+            return np.dtype(self.meta['car_columns'][name]), (cars,)
+        return np.dtype(self.meta['metric_columns'][name]), ()
+
+    def chunks(self, column):
+        for index in range(self.num_chunks):
+            yield self.chunk(column, index)
+
+    def rows(self, column, start, stop):
+        """
+        Return rows start:stop of a column; zero-copy if they lie within one chunk.
+        """
+        start = max(start, 0)
+        stop = min(stop, self.steps)
+        if start >= stop:
+            dtype, shape = self.column_layout(column)
+            return np.empty((0, *shape), dtype=dtype)
+        first, last = start // self.chunk_steps, (stop - 1) // self.chunk_steps
+        offset = first * self.chunk_steps
+        if first == last:
+            return self.chunk(column, first)[start - offset:stop - offset]
+        return np.concatenate([self.chunk(column, index) for index in range(first, last + 1)]
+                              )[start - offset:stop - offset]
+
+    def totals(self, road):
+        with np.load(os.path.join(self.directory, f'{road}.totals.npz')) as totals:
+            return {name: totals[name] for name in totals.files}
@@ -0,0 +1,400 @@
+# replay.py
+
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from backpressure import ClientStream
+from instrumentation import Instruments
+from recorder import Recording
+from wire import encode_delta, encode_keyframe
+
+# Playback speeds a viewer may choose, as multiples of the replay step rate
+REPLAY_SPEEDS = (0.1, 100.0)
+
+
+class ReplayFrames:
+    """
+    Wire frames (see wire.py) of one recording, encoded once and shared by every viewer.
+
+    A recording holds the full state of every step, so any step is a keyframe away: the
+    row of a step is step - first_step, and the keyframe of a row is encoded straight from
+    the memory-mapped columns (and cached). Playback frames come in pre-encoded chunks of
+    chunk_frames rows, `stride` rows apart: a keyframe followed by deltas, each against
+    the row before it. Strides are powers of two, so fast playback shares its chunks too.
+
+    Frames are built from memory-mapped rows without copying; only a bounded number of
+    encoded chunks and keyframes is held in memory.
+    """
+
+    def __init__(self, recording, chunk_frames=64, cache_chunks=32, cache_keyframes=16,
+                 cache_maps=128):
+        """
+        Initialize a ReplayFrames instance.
+
+        Parameters:
+            recording (Recording): Recording to serve.
+            chunk_frames (int, optional): Frames per pre-encoded chunk.
+            cache_chunks (int, optional): Encoded chunks kept (least recently used go).
+            cache_keyframes (int, optional): Encoded seek keyframes kept.
+            cache_maps (int, optional): Column chunk files kept memory-mapped.
+
+        Raises:
+            ValueError: If the recording holds no steps.
+        """
+        if len(recording) == 0:
+            raise ValueError(f"Recording {recording.directory} holds no steps.")
+        meta = recording.meta
+        parameters = meta['parameters']
+        self.recording = recording
+        self.chunk_frames = chunk_frames
+        self.cache_chunks = cache_chunks
+        self.cache_keyframes = cache_keyframes
+        self.cache_maps = cache_maps
+        self.steps = len(recording)
+        self.first_step = meta['first_step']
+        self.roads = meta['roads']
+        self.car_columns = list(meta['car_columns'])
+        self.L = parameters['L']
+        self.lanes = parameters.get('lanes', 1)
+        # Ring roads keep their cars, so the density is that of the live metrics throughout
+        self.density = parameters['N'] / (self.L / 2.0)
+        self.adaptive_cruise_control = [
+            np.array(flags, dtype=bool) for flags in meta['adaptive_cruise_control']
+        ]
+        self.maps = OrderedDict()
+        self.chunks = OrderedDict()
+        self.keyframes = OrderedDict()
+
+    def row(self, step):
+        """
+        Row of the recorded step closest to `step`.
+        """
+        return min(max(int(step) - self.first_step, 0), self.steps - 1)
+
+    def step(self, row):
+        return self.first_step + row
+
+    @staticmethod
+    def _cached(cache, key, limit, build):
+        value = cache.get(key)
+        if value is None:
+            value = cache[key] = build()
+            if len(cache) > limit:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return value
+
+    def _column(self, column, row):
+        chunk_steps = self.recording.chunk_steps
+        index, offset = divmod(row, chunk_steps)
+        array = self._cached(self.maps, (column, index), self.cache_maps,
+                             lambda: self.recording.chunk(column, index))
+        return array[offset]
+
+    def frame(self, row):
+        """
+        Frame of a row in the Simulation.get_frame shape; the arrays are read-only views
+        of the memory-mapped recording.
+        """
+        roads = []
+        metrics = []
+        for road, acc in zip(self.roads, self.adaptive_cruise_control):
+            arrays = {name: self._column(f'{road}.{name}', row) for name in self.car_columns}
+            arrays['adaptive_cruise_control'] = acc
+            roads.append(arrays)
+            metrics.append({
+                'average_speed': float(self._column(f'{road}.average_speed', row)),
+                'stopped_vehicles': int(self._column(f'{road}.stopped_vehicles', row)),
+                'density': self.density,
+            })
+        return {'step': int(self._column('step', row)), 'roads': roads, 'metrics': metrics}
+
+    def keyframe(self, row):
+        """
+        Encoded keyframe of a row (e.g. where a viewer seeks to).
+        """
+        return self._cached(self.keyframes, row, self.cache_keyframes,
+                            lambda: encode_keyframe(self.frame(row)))
+
+    def _encode_chunk(self, stride, index):
+        first = index * self.chunk_frames * stride
+        rows = range(first, min(first + self.chunk_frames * stride, self.steps), stride)
+        encoded = []
+        base = None
+        for row in rows:
+            frame = self.frame(row)
+            if base is None:
+                encoded.append((encode_keyframe(frame), None))
+            else:
+                encoded.append((encode_delta(frame, base), base['step']))
+            base = frame
+        return encoded
+
+    def encoded(self, row, stride=1):
+        """
+        Pre-encoded frame of a row in playback at `stride` rows per frame.
+
+        Returns:
+            tuple: (data, base): the encoded frame and the step it is a delta against
+                (that of row - stride), or None for a keyframe.
+        """
+        if row % stride:
+            stride = 1
+        index, offset = divmod(row // stride, self.chunk_frames)
+        chunk = self._cached(self.chunks, (stride, index), self.cache_chunks,
+                             lambda: self._encode_chunk(stride, index))
+        return chunk[offset]
+
+
+class Viewer:
+    """
+    One client's playhead in a recording.
+    """
+
+    def __init__(self, name, frames, stream, speed):
+        self.name = name
+        self.frames = frames
+        self.stream = stream
+        self.speed = speed
+        self.paused = False
+        self.position = 0.0  # Playhead in rows; frames go out for whole rows
+        self.row = None  # Last row sent
+
+    def state(self):
+        return {'name': self.name, 'step': self.frames.step(int(self.position)),
+                'speed': self.speed, 'paused': self.paused}
+
+
+class ReplayManager:
+    """
+    Serve recorded runs (recorder.py directories under `directory`) to Socket.IO clients.
+
+    Each client plays its own copy at its own speed and position, but the encoded frames
+    come from one ReplayFrames per recording, so more viewers cost little more than their
+    emits. Frames go through a ClientStream per client, as for live sessions.
+    """
+
+    def __init__(self, socketio, directory, steps_per_second=6, frames_per_second=20,
+                 namespace='/', client_window=2, client_queue_depth=2, max_open=8):
+        """
+        Initialize a ReplayManager instance.
+
+        Parameters:
+            socketio (SocketIO): Server used for the playback task and emits.
+            directory (str): Directory searched for recordings.
+            steps_per_second (float, optional): Steps played per second at speed 1.
+            frames_per_second (float, optional): Most frames a viewer gets per second;
+                faster playback skips rows (see ReplayFrames).
+            namespace (str, optional): Socket.IO namespace of the clients.
+            client_window (int, optional): Frames a client may leave unacknowledged.
+            client_queue_depth (int, optional): Frames that may wait for a client.
+            max_open (int, optional): Recordings kept open (least recently used go).
+        """
+        self.socketio = socketio
+        self.directory = directory
+        self.steps_per_second = steps_per_second
+        self.frames_per_second = frames_per_second
+        self.namespace = namespace
+        self.client_window = client_window
+        self.client_queue_depth = client_queue_depth
+        self.max_open = max_open
+        self.open_recordings = OrderedDict()
+        self.viewers = {}  # sid -> Viewer
+        self.instruments = Instruments()
+        self.player = None
+
+    def recordings(self):
+        """
+        Names (paths relative to the directory) of the recordings that can be replayed.
+        """
+        names = []
+        for root, directories, files in os.walk(self.directory):
+            directories.sort()
+            if 'meta.json' in files:
+                names.append(os.path.relpath(root, self.directory).replace(os.sep, '/'))
+        return names
+
+    def open(self, name):
+        """
+        Return the ReplayFrames of a recording, opening it if needed.
+
+        Raises:
+            ValueError: If `name` is no recording under the directory.
+        """
+        frames = self.open_recordings.get(name)
+        if frames is not None:
+            self.open_recordings.move_to_end(name)
+            return frames
+        root = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(root, str(name)))
+        if (os.path.commonpath([root, path]) != root
+                or not os.path.isfile(os.path.join(path, 'meta.json'))):
+            raise ValueError(f"Unknown recording: {name}")
+        try:
+            frames = ReplayFrames(Recording(path))
+        except (OSError, KeyError) as e:
+            raise ValueError(f"Cannot read recording {name}: {e}") from None
+        self.open_recordings[name] = frames
+        if len(self.open_recordings) > self.max_open:
+            self.open_recordings.popitem(last=False)
+        return frames
+
+    @staticmethod
+    def _speed(value):
+        try:
+            speed = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid speed: {value!r}") from None
+        low, high = REPLAY_SPEEDS
+        if not low <= speed <= high:
+            raise ValueError(f"speed must be between {low} and {high}.")
+        return speed
+
+    def join(self, sid, name, speed=1.0, step=None):
+        """
+        Start playing a recording to a client, from `step` (the first one if None).
+
+        Returns:
+            Viewer: The client's playhead.
+
+        Raises:
+            ValueError: On an unknown recording or an invalid speed or step.
+        """
+        speed = self._speed(speed)
+        frames = self.open(name)
+        self.leave(sid)
+        viewer = Viewer(name, frames, ClientStream(self.client_window, self.client_queue_depth),
+                        speed)
+        self.viewers[sid] = viewer
+        self.socketio.emit('replay_joined', {**viewer.state(),
+                                             'road_length': frames.L,
+                                             'lanes': frames.lanes,
+                                             'first_step': frames.first_step,
+                                             'steps': frames.steps,
+                                             'steps_per_second': self.steps_per_second},
+                           to=sid, namespace=self.namespace)
+        self._seek(sid, viewer, frames.first_step if step is None else step)
+        if self.player is None:
+            self.player = self.socketio.start_background_task(self._play_loop)
+        logging.info(f"Replaying {name} ({len(self.viewers)} viewers).")
+        return viewer
+
+    def control(self, sid, data):
+        """
+        Change a client's playback: {'speed', 'step' (seek), 'paused'}, any subset.
+
+        Returns:
+            Viewer or None: The client's playhead, or None if it is not replaying.
+
+        Raises:
+            ValueError: On an invalid speed or step.
+        """
+        viewer = self.viewers.get(sid)
+        if viewer is None:
+            return None
+        data = data or {}
+        if 'speed' in data:
+            viewer.speed = self._speed(data['speed'])
+        if 'paused' in data:
+            viewer.paused = bool(data['paused'])
+        if data.get('step') is not None:
+            self._seek(sid, viewer, data['step'])
+        elif not viewer.paused and viewer.row == viewer.frames.steps - 1:
+            # Resuming at the end plays from the start again
+            self._seek(sid, viewer, viewer.frames.first_step)
+        self.socketio.emit('replay_state', viewer.state(), to=sid, namespace=self.namespace)
+        return viewer
+
+    def leave(self, sid):
+        self.viewers.pop(sid, None)
+
+    def request_keyframe(self, sid):
+        viewer = self.viewers.get(sid)
+        if viewer is not None:
+            viewer.stream.resync()
+
+    def instrument_sources(self):
+        """
+        Sources for instrumentation.render_prometheus (no step rate: replays do not step).
+        """
+        return [({'session': 'replay'}, self.instruments, None)] if self.player else []
+
+    def stride(self, speed):
+        """
+        Rows per frame at `speed`: the smallest power of two that keeps frames within
+        frames_per_second.
+        """
+        rows_per_frame = speed * self.steps_per_second / self.frames_per_second
+        return 1 if rows_per_frame <= 1 else 1 << math.ceil(math.log2(rows_per_frame))
+
+    def _seek(self, sid, viewer, step):
+        try:
+            row = viewer.frames.row(step)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid step: {step!r}") from None
+        viewer.position = float(row)
+        viewer.row = row
+        # Frames of the old position are stale
+        viewer.stream.clear()
+        viewer.stream.offer(viewer.frames.keyframe(row), frame=viewer.frames.frame(row))
+        self._flush(sid)
+
+    def _play_loop(self):
+        interval = 1.0 / self.frames_per_second
+        last = time.monotonic()
+        while True:
+            self.socketio.sleep(interval)
+            now = time.monotonic()
+            elapsed, last = now - last, now
+            for sid, viewer in list(self.viewers.items()):
+                if not viewer.paused:
+                    self._advance(sid, viewer, elapsed)
+
+    def _advance(self, sid, viewer, elapsed):
+        frames = viewer.frames
+        end = frames.steps - 1
+        viewer.position = min(viewer.position + viewer.speed * self.steps_per_second * elapsed,
+                              end)
+        stride = self.stride(viewer.speed)
+        row = end if viewer.position == end else int(viewer.position) // stride * stride
+        if row == viewer.row:
+            return
+        viewer.row = row
+        with self.instruments.time('encode_replay'):
+            data, base = frames.encoded(row, stride)
+        dropped = viewer.stream.offer(data, base, frames.frame(row))
+        if dropped:
+            self.instruments.count('frames_dropped', dropped)
+        self._flush(sid)
+        if row == end:
+            viewer.paused = True
+            self.socketio.emit('replay_state', viewer.state(), to=sid, namespace=self.namespace)
+
+    def _flush(self, sid):
+        # As SessionManager._flush: emit what the client's window has room for
+        viewer = self.viewers.get(sid)
+        if viewer is None:
+            return
+        ready = viewer.stream.ready()
+        for sequence, data in ready:
+            with self.instruments.time('emit'):
+                self.socketio.emit('simulation_frame', (data, sequence), to=sid,
+                                   namespace=self.namespace,
+                                   callback=lambda echoed=None, *args: self._acknowledged(
+                                       sid, viewer, echoed))
+        if ready:
+            self.instruments.count('frames_sent', len(ready))
+
+    def _acknowledged(self, sid, viewer, sequence):
+        if self.viewers.get(sid) is not viewer:
+            return
+        round_trip = viewer.stream.acknowledge(sequence)
+        if round_trip is not None:
+            self.instruments.observe_time('frame_ack', round_trip)
+        self._flush(sid)
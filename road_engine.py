@@ -0,0 +1,709 @@
+# road_engine.py
+
+import numpy as np
+
+import kernels
+from acc import ACCParameters, DEFAULT_ACC
+from Car import draw_speed_offsets
+
+
+def apply_rules(velocity, distance_to_next_car, velocity_of_next_car, adaptive_cruise_control,
+                speed_offset, slow_to_start, last_error, integral_error, rand,
+                max_speed, p_fault, p_slow, acc=DEFAULT_ACC):
+    """
+    Array version of Car.update_velocity.
+
+    Every argument except the scalar parameters is an array with one entry per car.
+    The inputs are not modified; the updated state is returned instead.
+
+    Parameters:
+        velocity (ndarray): Current velocities.
+        distance_to_next_car (ndarray): Free cells in front of each car.
+        velocity_of_next_car (ndarray): Velocity of each car's leader.
+        adaptive_cruise_control (ndarray): Boolean mask of ACC cars.
+        speed_offset (ndarray): Per-car speed offsets (0 for ACC cars).
+        slow_to_start (ndarray): Boolean slow-to-start flags.
+        last_error (ndarray): PID last error (ACC cars only).
+        integral_error (ndarray): PID integral error (ACC cars only).
+        rand (ndarray): One uniform [0, 1) draw per car. A car uses it either for
+            slow-to-start (when stopped) or for the random slowdown (when moving).
+        max_speed (int): Maximum speed of the road.
+        p_fault (float): Probability of a random slowdown (fault).
+        p_slow (float): Probability of slow-to-start behavior.
+        acc (ACCParameters, optional): Controller parameters of the ACC cars.
+
+    Returns:
+        tuple: (velocity, slow_to_start, last_error, integral_error)
+    """
+    v = velocity
+    d = distance_to_next_car
+    vn = velocity_of_next_car
+    stopped = v == 0
+
+    new_v = v.copy()
+    new_slow_to_start = slow_to_start.copy()
+    new_last_error = last_error.copy()
+    new_integral_error = integral_error.copy()
+
+    # Every branch gathers its own cars, updates them and scatters the result back, so a
+    # mixed fleet only pays for each rule set on the cars that follow it
+
+    # Slow-to-Start Logic (stopped cars skip every other rule)
+    cars = np.flatnonzero(stopped)
+    if len(cars):
+        can_start = d[cars] > 1
+        hesitate = can_start & ~slow_to_start[cars] & (rand[cars] < p_slow)
+        new_v[cars] = can_start & ~hesitate
+        new_slow_to_start[cars] = hesitate
+
+    # Adaptive Cruise Control (PID on combined distance/speed error)
+    cars = np.flatnonzero(~stopped & adaptive_cruise_control)
+    if len(cars):
+        v_acc = v[cars]
+        desired_gap = acc.standstill_distance + v_acc * acc.safe_time_headway
+        error_distance = desired_gap - d[cars]
+        error_speed = vn[cars] - v_acc
+        combined_error = error_distance + acc.w_speed * error_speed
+        acc_integral = integral_error[cars] + combined_error
+        derivative_error = combined_error - last_error[cars]
+        acceleration_change = (acc.kp * combined_error + acc.ki * acc_integral
+                               + acc.kd * derivative_error)
+
+        acc_v = np.where(acceleration_change > acc.threshold, np.maximum(v_acc - 1, 0),
+                         np.where((acceleration_change < -acc.threshold) & (v_acc < max_speed),
+                                  np.minimum(v_acc + 1, max_speed), v_acc))
+        # Reduce random slowdowns drastically for ACC
+        acc_v -= (acc_v > 0) & (rand[cars] < p_fault * acc.fault_factor)
+
+        new_v[cars] = acc_v
+        new_last_error[cars] = combined_error
+        new_integral_error[cars] = acc_integral
+
+    # Human drivers (rules 2-5)
+    cars = np.flatnonzero(~stopped & ~adaptive_cruise_control)
+    if len(cars):
+        v_human = v[cars]
+        d_human = d[cars]
+        vn_human = vn[cars]
+        human_v = v_human.copy()
+
+        # Rule 2: Deceleration near next car
+        rule2 = d_human <= v_human
+        np.copyto(human_v, np.where((v_human < vn_human) | (v_human <= 2), d_human - 1,
+                                    np.minimum(d_human - 1, v_human - 2)), where=rule2)
+
+        # Rule 3: Deceleration if within 2v but not too close
+        rule3 = ~rule2 & (v_human < d_human) & (d_human <= 2 * v_human)
+        closing_speed = v_human - vn_human
+        rule3_v = np.maximum(v_human - 2 * (closing_speed >= 4)
+                             - ((closing_speed >= 2) & (closing_speed <= 3)), 0)
+        np.copyto(human_v, rule3_v, where=rule3)
+
+        # Rule 4: Acceleration
+        human_v += (human_v < max_speed + speed_offset[cars]) & (d_human > human_v + 1)
+
+        # Rule 5: Randomization
+        human_v -= (human_v > 0) & (rand[cars] < p_fault)
+
+        new_v[cars] = human_v
+
+    return new_v, new_slow_to_start, new_last_error, new_integral_error
+
+
+class ArrayRoad:
+    """
+    Cars of one road with every attribute in a NumPy array, sorted by position: the
+    state shared by the array engines (VectorRoad, MultiLaneRoad, OpenRoad), which each
+    add their own update.
+    """
+
+    # Per-car arrays, all in the same order
+    STATE_ARRAYS = ('ids', 'positions', 'velocities', 'adaptive_cruise_control', 'speed_offset',
+                    'slow_to_start', 'last_error', 'integral_error', 'total_distance', 'stops',
+                    'time_in_traffic')
+
+    def __init__(self, road_length, max_speed, p_fault, p_slow, positions, velocities,
+                 adaptive_cruise_control=False, prob_faster=0.20, prob_slower=0.10,
+                 prob_normal=0.70, rng=None, acc=None):
+        """
+        Initialize an ArrayRoad instance.
+
+        Parameters:
+            road_length (int): Length of the road.
+            max_speed (int): Maximum speed of the cars.
+            p_fault (float): Probability of a random slowdown (fault).
+            p_slow (float): Probability of slow-to-start behavior.
+            positions (array-like): Initial (distinct) positions of the cars.
+            velocities (array-like): Initial velocities of the cars.
+            adaptive_cruise_control (bool or array-like, optional): ACC flag for all cars,
+                or one flag per car.
+            prob_faster (float, optional): Probability of a human driver being faster.
+            prob_slower (float, optional): Probability of a human driver being slower.
+            prob_normal (float, optional): Probability of a human driver driving normally.
+            rng (np.random.Generator, optional): Random stream of the road.
+            acc (ACCParameters or dict, optional): Controller parameters of the road's ACC
+                cars. Defaults to acc.DEFAULT_ACC.
+        """
+        if not np.isclose(prob_faster + prob_slower + prob_normal, 1.0):
+            raise ValueError("Probabilities must sum to 1.")
+
+        self.road_length = road_length
+        self.max_speed = max_speed
+        self.p_fault = p_fault
+        self.p_slow = p_slow
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.acc = ACCParameters.create(acc)
+
+        order = np.argsort(np.asarray(positions), kind='stable')
+        self.positions = np.asarray(positions, dtype=np.int32)[order]
+        self.velocities = np.asarray(velocities, dtype=np.int32)[order]
+        num_cars = len(self.positions)
+
+        # Stable vehicle ids; they break position ties the same way the stable sort in
+        # Simulation.update_road does (by list order)
+        self.ids = np.arange(num_cars)
+
+        self.adaptive_cruise_control = np.broadcast_to(
+            np.asarray(adaptive_cruise_control, dtype=bool), (num_cars,))[order].copy()
+
+        # Speed offsets for human drivers, drawn for all cars at once
+        self.speed_offset = draw_speed_offsets(self.rng, num_cars, prob_faster, prob_slower,
+                                               prob_normal)
+        self.speed_offset[self.adaptive_cruise_control] = 0
+
+        self.slow_to_start = np.zeros(num_cars, dtype=bool)
+        self.last_error = np.zeros(num_cars)
+        self.integral_error = np.zeros(num_cars)
+
+        self.total_distance = np.zeros(num_cars, dtype=np.int64)
+        self.stops = np.zeros(num_cars, dtype=np.int64)
+        self.time_in_traffic = np.zeros(num_cars, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class VectorRoad(ArrayRoad):
+    """
+    Single-lane ring road that keeps every car attribute in a NumPy array.
+
+    Cars are stored in cyclic (ring) order. Because cars never overtake each other on a
+    single lane, the order only has to be rebuilt if a collision breaks it; otherwise
+    each tick just locates the wrap-around origin (the car with the smallest position).
+    The update follows the same sequential semantics as Simulation.update_road: every
+    car sees its leader's velocity from before the tick, except the car with the largest
+    position, whose leader (the first car in position order) has already been updated.
+    """
+
+    def __init__(self, road_length, max_speed, p_fault, p_slow, positions, velocities,
+                 adaptive_cruise_control=False, prob_faster=0.20, prob_slower=0.10,
+                 prob_normal=0.70, rng=None, use_kernel=None, acc=None):
+        """
+        Initialize a VectorRoad instance.
+
+        Parameters:
+            road_length ... rng: See ArrayRoad.
+            use_kernel (bool, optional): Update with the compiled kernels.update_ring instead
+                of the NumPy rules; both give identical results. Defaults to whether Numba
+                is installed.
+            acc (ACCParameters or dict, optional): Controller parameters of the road's ACC
+                cars. Defaults to acc.DEFAULT_ACC.
+        """
+        super().__init__(road_length, max_speed, p_fault, p_slow, positions, velocities,
+                         adaptive_cruise_control, prob_faster, prob_slower, prob_normal, rng,
+                         acc=acc)
+        if use_kernel is None:
+            use_kernel = kernels.AVAILABLE
+        self.kernel = kernels.update_ring if use_kernel else None
+
+    def _permute(self, order):
+        for name in self.STATE_ARRAYS:
+            setattr(self, name, getattr(self, name)[order])
+
+    def ring_origin(self):
+        """
+        Return the index of the car with the smallest position, restoring ring order first
+        if a collision has broken it.
+        """
+        next_positions = np.roll(self.positions, -1)
+        descents = np.flatnonzero((next_positions < self.positions) | (
+            (next_positions == self.positions) & (np.roll(self.ids, -1) < self.ids)))
+        if len(descents) > 1:
+            # The ring is still almost sorted from the origin on, which the stable sort
+            # (timsort) handles in close to linear time
+            num_cars = len(self.positions)
+            key = self.positions.astype(np.int64) * num_cars + self.ids
+            start = int(np.argmin(key))
+            order = np.argsort(np.roll(key, -start), kind='stable')
+            self._permute((order + start) % num_cars)
+            return 0
+        if len(descents) == 0:
+            return 0
+        return (descents[0] + 1) % len(self.positions)
+
+    def update(self, rand=None):
+        """
+        Advance every car on the road by one tick (velocity update, then move).
+
+        Parameters:
+            rand (ndarray, optional): One uniform [0, 1) draw per car for this tick, indexed
+                by position order like Simulation.update_road uses it. Drawn from self.rng
+                if None.
+        """
+        num_cars = len(self.positions)
+        if num_cars == 0:
+            return
+
+        origin = self.ring_origin()
+        if rand is None:
+            rand = self.rng.random(num_cars)
+
+        if self.kernel is not None:
+            self.kernel(self.positions, self.velocities, self.adaptive_cruise_control,
+                        self.speed_offset, self.slow_to_start, self.last_error,
+                        self.integral_error, self.total_distance, self.stops,
+                        self.time_in_traffic, rand, origin, self.road_length, self.max_speed,
+                        self.p_fault, self.p_slow, *self.acc)
+            return
+
+        positions = self.positions
+        velocities = self.velocities
+
+        next_positions = np.roll(positions, -1)
+        next_velocities = np.roll(velocities, -1)
+        distances = next_positions - positions - 1
+        np.add(distances, self.road_length, out=distances, where=distances < 0)
+        # Entry i of the draw belongs to the i-th car in position order
+        rand = np.roll(rand, origin)
+
+        state = (self.adaptive_cruise_control, self.speed_offset, self.slow_to_start,
+                 self.last_error, self.integral_error)
+        new_state = apply_rules(velocities, distances, next_velocities, *state,
+                                rand, self.max_speed, self.p_fault, self.p_slow, self.acc)
+
+        if num_cars > 1:
+            # The car with the largest position sees its leader's updated velocity
+            last = [(origin - 1) % num_cars]
+            fixed = apply_rules(velocities[last], distances[last], new_state[0][[origin]],
+                                *(array[last] for array in state), rand[last],
+                                self.max_speed, self.p_fault, self.p_slow, self.acc)
+            for array, value in zip(new_state, fixed):
+                array[last] = value
+
+        self.velocities, self.slow_to_start, self.last_error, self.integral_error = new_state
+
+        # Move
+        self.positions = positions + self.velocities
+        np.subtract(self.positions, self.road_length, out=self.positions,
+                    where=self.positions >= self.road_length)
+        np.add(self.positions, self.road_length, out=self.positions, where=self.positions < 0)
+        self.total_distance += self.velocities
+        self.stops += self.velocities == 0
+        self.time_in_traffic += 1
+
+
+class MultiLaneRoad(ArrayRoad):
+    """
+    Ring road with several lanes and MOBIL-style lane changes.
+
+    Every car has a cell number lane * road_length + position, and self.order keeps the
+    cars sorted by it: lane by lane, each in position order. Cars move and wrap around
+    within their lane and few change lanes, so last tick's order is nearly sorted and a
+    stable (run-merging) sort restores it in about O(cars). Binary search in the sorted
+    cell numbers then gives each lane-change candidate's leader and follower in the
+    adjacent lane, so a tick costs O(cars) whatever the number of lanes and the length
+    of the road.
+
+    A tick is a lane-change phase followed by the single-lane rules (apply_rules) in every
+    lane. Unlike VectorRoad, all cars update in parallel on their leaders' old velocities,
+    and velocities are clamped to [0, gap] so two cars never share a cell. Lane changes
+    go left (to the lower lane index) on even ticks and right on odd ones, so no two cars
+    ever target the same cell.
+    """
+
+    # Cars keep their slots, so 'ids' stays the identity; self.order is derived state
+    STATE_ARRAYS = ArrayRoad.STATE_ARRAYS + ('lanes', 'lane_changes')
+
+    def __init__(self, road_length, max_speed, p_fault, p_slow, positions, velocities, lanes,
+                 num_lanes, adaptive_cruise_control=False, prob_faster=0.20, prob_slower=0.10,
+                 prob_normal=0.70, rng=None, politeness=0.2, lane_change_threshold=0.5,
+                 acc=None):
+        """
+        Initialize a MultiLaneRoad instance.
+
+        Parameters:
+            road_length (int): Length of the road.
+            max_speed (int): Maximum speed of the cars.
+            p_fault (float): Probability of a random slowdown (fault).
+            p_slow (float): Probability of slow-to-start behavior.
+            positions (array-like): Initial positions of the cars.
+            velocities (array-like): Initial velocities of the cars.
+            lanes (array-like): Initial lane (0 to num_lanes - 1) of every car.
+            num_lanes (int): Number of lanes.
+            adaptive_cruise_control (bool or array-like, optional): ACC flag for all cars,
+                or one flag per car.
+            prob_faster (float, optional): Probability of a human driver being faster.
+            prob_slower (float, optional): Probability of a human driver being slower.
+            prob_normal (float, optional): Probability of a human driver driving normally.
+            rng (np.random.Generator, optional): Random stream of the road.
+            politeness (float, optional): MOBIL politeness factor; weight of the speed the
+                new follower loses against the speed the changing car gains.
+            lane_change_threshold (float, optional): Net speed gain (cells per step) a lane
+                change must exceed.
+            acc (ACCParameters or dict, optional): Controller parameters of the road's ACC
+                cars.
+        """
+        positions = np.asarray(positions)
+        num_cars = len(positions)
+        lanes = np.asarray(lanes, dtype=np.int32)
+        if lanes.shape != (num_cars,) or (num_cars and (lanes.min() < 0 or lanes.max() >= num_lanes)):
+            raise ValueError(f"Every car needs a lane between 0 and {num_lanes - 1}.")
+
+        # Sort here so the lanes follow the order ArrayRoad puts the other arrays in
+        order = np.argsort(positions, kind='stable')
+        adaptive_cruise_control = np.broadcast_to(
+            np.asarray(adaptive_cruise_control, dtype=bool), (num_cars,))[order]
+        super().__init__(road_length, max_speed, p_fault, p_slow, positions[order],
+                         np.asarray(velocities)[order], adaptive_cruise_control,
+                         prob_faster, prob_slower, prob_normal, rng, acc=acc)
+
+        self.num_lanes = num_lanes
+        self.lanes = lanes[order]
+        self.politeness = politeness
+        self.lane_change_threshold = lane_change_threshold
+        self.ticks = 0
+        self.lane_changes = np.zeros(num_cars, dtype=np.int64)
+
+        self.order = np.arange(num_cars)
+        cells = self.lane_order()[1]
+        if np.any(cells[1:] == cells[:-1]):
+            raise ValueError("Cars must occupy distinct cells.")
+
+    def lane_order(self):
+        """
+        Sort the cars by lane, then position, starting from the previous order.
+
+        Returns:
+            tuple: (order, cells, starts, counts) - car indices by lane and position, their
+                cell numbers (lane * road_length + position, increasing), and the offset and
+                number of cars of every lane within `order`.
+        """
+        cells = self.lanes.astype(np.int64) * self.road_length + self.positions
+        order = self.order[np.argsort(cells[self.order], kind='stable')]
+        self.order = order
+        counts = np.bincount(self.lanes, minlength=self.num_lanes)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return order, cells[order], starts, counts
+
+    @staticmethod
+    def _leaders(order, starts, counts, lanes_sorted):
+        # Index (into order) of every car's leader in its own lane, wrapping per lane
+        leader = np.arange(1, len(order) + 1)
+        ends = (starts + counts)[lanes_sorted]
+        np.copyto(leader, starts[lanes_sorted], where=leader == ends)
+        return leader
+
+    def change_lanes(self, order, cells, starts, counts):
+        """
+        Move every car whose MOBIL incentive and safety criteria hold into the adjacent
+        lane on this tick's side.
+
+        Incentive: the speed the car can reach in the target lane (min(v + 1, own maximum
+        speed, gap ahead)) exceeds what it can reach in its own lane by more than
+        lane_change_threshold plus politeness times the speed its new follower loses.
+        Safety: the target cell is free and the new follower does not have to brake
+        (gap behind >= its velocity).
+
+        Parameters:
+            order, cells, starts, counts: The lane order (see lane_order).
+
+        Returns:
+            int: Number of cars that changed lanes.
+        """
+        L = self.road_length
+        positions = self.positions
+        velocities = self.velocities
+        max_speeds = self.max_speed + self.speed_offset
+
+        # Gap ahead in the own lane
+        leader = order[self._leaders(order, starts, counts, self.lanes[order])]
+        own_leader = np.empty_like(leader)
+        own_leader[order] = leader
+        own_gap = (positions[own_leader] - positions - 1) % L
+
+        direction = -1 if self.ticks % 2 == 0 else 1
+        target = self.lanes + direction
+        candidates = np.flatnonzero((target >= 0) & (target < self.num_lanes))
+        target = target[candidates]
+        x = positions[candidates]
+        # First car at or after the target cell in lane order
+        cell = target.astype(np.int64) * L + x
+        index = np.searchsorted(cells, cell)
+        free = cells[np.minimum(index, len(cells) - 1)] != cell
+        candidates, target, x, index = candidates[free], target[free], x[free], index[free]
+        if len(candidates) == 0:
+            return 0
+
+        # Cars in the target lane behind x (its rank in that lane)
+        rank = index - starts[target]
+        count = counts[target]
+        empty = count == 0
+        lane_count = np.maximum(count, 1)
+        new_leader = order[np.where(empty, 0, starts[target] + rank % lane_count)]
+        new_follower = order[np.where(empty, 0, starts[target] + (rank - 1) % lane_count)]
+        gap_ahead = np.where(empty, L - 1, (positions[new_leader] - x - 1) % L)
+        gap_behind = np.where(empty, L - 1, (x - positions[new_follower] - 1) % L)
+
+        v = velocities[candidates]
+        v_max = max_speeds[candidates]
+        gain = (np.minimum(np.minimum(v + 1, v_max), gap_ahead)
+                - np.minimum(np.minimum(v + 1, v_max), own_gap[candidates]))
+
+        v_follower = np.where(empty, 0, velocities[new_follower])
+        follower_max = max_speeds[new_follower]
+        follower_before = np.minimum(np.minimum(v_follower + 1, follower_max),
+                                     gap_behind + 1 + gap_ahead)
+        follower_after = np.minimum(np.minimum(v_follower + 1, follower_max), gap_behind)
+        loss = np.where(empty, 0, follower_before - follower_after)
+
+        safe = empty | (gap_behind >= v_follower)
+        change = safe & (gain - self.politeness * loss > self.lane_change_threshold)
+
+        movers = candidates[change]
+        self.lanes[movers] = target[change]
+        self.lane_changes[movers] += 1
+        return len(movers)
+
+    def update(self, rand=None):
+        """
+        Advance every car on the road by one tick (lane changes, velocity update, move).
+
+        Parameters:
+            rand (ndarray, optional): One uniform [0, 1) draw per car for the velocity
+                update, indexed by lane and then position order. Drawn from self.rng if None.
+        """
+        num_cars = len(self.positions)
+        if num_cars == 0:
+            return
+
+        order, cells, starts, counts = self.lane_order()
+        if self.num_lanes > 1 and self.change_lanes(order, cells, starts, counts):
+            order, cells, starts, counts = self.lane_order()
+        self.ticks += 1
+
+        lanes = self.lanes[order]
+        positions = self.positions[order]
+        velocities = self.velocities[order]
+        leader = self._leaders(order, starts, counts, lanes)
+        distances = (positions[leader] - positions - 1) % self.road_length
+        if rand is None:
+            rand = self.rng.random(num_cars)
+
+        state = (self.adaptive_cruise_control[order], self.speed_offset[order],
+                 self.slow_to_start[order], self.last_error[order], self.integral_error[order])
+        new_v, new_slow_to_start, new_last_error, new_integral_error = apply_rules(
+            velocities, distances, velocities[leader], *state, rand,
+            self.max_speed, self.p_fault, self.p_slow, self.acc)
+        # Parallel update: staying behind the leader's old cell can never collide
+        new_v = np.clip(new_v, 0, distances).astype(np.int32)
+
+        self.velocities[order] = new_v
+        self.slow_to_start[order] = new_slow_to_start
+        self.last_error[order] = new_last_error
+        self.integral_error[order] = new_integral_error
+
+        self.positions = (self.positions + self.velocities) % self.road_length
+        self.total_distance += self.velocities
+        self.stops += self.velocities == 0
+        self.time_in_traffic += 1
+
+
+class OpenRoad(ArrayRoad):
+    """
+    Single-lane road with an entrance and an exit instead of a ring.
+
+    Vehicles arrive at the entrance from an inflow process (see inflow.py) and wait in a
+    queue outside the road until cell 0 is free; one enters per step. Vehicles that drive
+    past the last cell leave. The first car sees free road ahead.
+
+    Cars never pass each other, so the fleet is first-in first-out: stored in position
+    order, cars enter at the low end and leave at the high end. The state arrays are
+    views of a window [lo, hi) into preallocated buffers. Entering moves lo down and
+    leaving moves hi down. When lo reaches 0, the window is moved back up in place, or
+    the buffers double once it fills more than half of them. Arrivals and exits thus cost
+    O(1) amortized and no array is reallocated per vehicle.
+
+    Like MultiLaneRoad, all cars update in parallel on their leaders' old velocities, with
+    velocities clamped to [0, gap] so the order (and the FIFO storage) holds. Vehicle ids
+    increase in order of entry, so they decrease in position order.
+    """
+
+    # Counters kept besides the car arrays
+    COUNTERS = ('ticks', 'next_id', 'waiting', 'entered', 'exited', 'exit_time')
+    MIN_CAPACITY = 64
+
+    def __init__(self, road_length, max_speed, p_fault, p_slow, positions, velocities,
+                 adaptive_cruise_control=False, prob_faster=0.20, prob_slower=0.10,
+                 prob_normal=0.70, rng=None, acc=None, inflow=None, acc_share=0.0,
+                 capacity=None):
+        """
+        Initialize an OpenRoad instance.
+
+        Parameters:
+            road_length (int): Length of the road (cells 0 to road_length - 1).
+            max_speed (int): Maximum speed of the cars.
+            p_fault (float): Probability of a random slowdown (fault).
+            p_slow (float): Probability of slow-to-start behavior.
+            positions (array-like): Initial (distinct) positions of the cars on the road.
+            velocities (array-like): Initial velocities of the cars.
+            adaptive_cruise_control (bool or array-like, optional): ACC flag for all
+                initial cars, or one flag per car.
+            prob_faster (float, optional): Probability of a human driver being faster.
+            prob_slower (float, optional): Probability of a human driver being slower.
+            prob_normal (float, optional): Probability of a human driver driving normally.
+            rng (np.random.Generator, optional): Random stream of the road.
+            acc (ACCParameters or dict, optional): Controller parameters of the ACC cars.
+            inflow (Inflow, optional): Arrivals at the entrance; none if None.
+            acc_share (float, optional): Probability that an arriving car has ACC.
+            capacity (int, optional): Cars the buffers hold before they first grow.
+        """
+        super().__init__(road_length, max_speed, p_fault, p_slow, positions, velocities,
+                         adaptive_cruise_control, prob_faster, prob_slower, prob_normal, rng,
+                         acc=acc)
+        self.prob_faster = prob_faster
+        self.prob_slower = prob_slower
+        self.prob_normal = prob_normal
+        self.inflow = inflow
+        self.acc_share = acc_share
+        # A leader this far ahead triggers no braking rule, whatever the speed offset
+        self.free_gap = 2 * (max_speed + 2) + 1
+
+        self.ticks = 0
+        self.next_id = len(self.positions)
+        self.waiting = 0  # Arrived vehicles queued at the entrance
+        self.entered = 0
+        self.exited = 0
+        self.exit_time = 0  # Steps on the road of all exited cars
+
+        # The initial cars count as having entered front car first
+        self.ids = self.ids[::-1].copy()
+        self.store({name: getattr(self, name) for name in self.STATE_ARRAYS}, capacity)
+
+    def store(self, arrays, capacity=None):
+        """
+        Replace the cars by `arrays` (STATE_ARRAYS name -> array, in position order),
+        copied into fresh buffers at the top of the window.
+        """
+        num_cars = len(arrays['positions'])
+        capacity = max(capacity or 0, 2 * num_cars, self.MIN_CAPACITY)
+        self.buffers = {name: np.zeros(capacity, dtype=arrays[name].dtype)
+                        for name in self.STATE_ARRAYS}
+        self.lo = capacity - num_cars
+        self.hi = capacity
+        for name, buffer in self.buffers.items():
+            buffer[self.lo:] = arrays[name]
+        self._set_views()
+
+    def _set_views(self):
+        for name, buffer in self.buffers.items():
+            setattr(self, name, buffer[self.lo:self.hi])
+
+    def _reserve(self):
+        # Free the slot below the window
+        if self.lo > 0:
+            return
+        num_cars = self.hi - self.lo
+        capacity = len(self.buffers['positions'])
+        if 2 * (num_cars + 1) > capacity:
+            self.store({name: getattr(self, name) for name in self.STATE_ARRAYS}, 2 * capacity)
+            return
+        # Move up into the free half; the ranges do not overlap
+        for buffer in self.buffers.values():
+            buffer[capacity - num_cars:] = buffer[:num_cars]
+        self.lo, self.hi = capacity - num_cars, capacity
+        self._set_views()
+
+    def counters(self):
+        """
+        Return the counters (see COUNTERS) as a dict.
+        """
+        return {name: getattr(self, name) for name in self.COUNTERS}
+
+    def update(self, rand=None):
+        """
+        Advance the road by one tick: velocity update and move, exits, then arrivals and
+        at most one car entering.
+
+        Parameters:
+            rand (ndarray, optional): One uniform [0, 1) draw per car on the road for the
+                velocity update, in position order. Drawn from self.rng if None.
+        """
+        num_cars = len(self.positions)
+        if num_cars:
+            if rand is None:
+                rand = self.rng.random(num_cars)
+            self._drive(rand)
+        if self.inflow is not None:
+            self.waiting += self.inflow.arrivals(self.ticks, self.rng)
+        if self.waiting:
+            self._enter()
+        self.ticks += 1
+
+    def _drive(self, rand):
+        positions = self.positions
+        velocities = self.velocities
+
+        distances = np.empty_like(positions)
+        distances[:-1] = positions[1:] - positions[:-1] - 1
+        distances[-1] = self.free_gap
+        next_velocities = np.empty_like(velocities)
+        next_velocities[:-1] = velocities[1:]
+        next_velocities[-1] = self.max_speed
+
+        new_v, new_slow_to_start, new_last_error, new_integral_error = apply_rules(
+            velocities, distances, next_velocities, self.adaptive_cruise_control,
+            self.speed_offset, self.slow_to_start, self.last_error, self.integral_error,
+            rand, self.max_speed, self.p_fault, self.p_slow, self.acc)
+        # The views share the buffers, so everything is written in place
+        np.clip(new_v, 0, distances, out=velocities)
+        self.slow_to_start[:] = new_slow_to_start
+        self.last_error[:] = new_last_error
+        self.integral_error[:] = new_integral_error
+
+        positions += velocities
+        self.total_distance += velocities
+        self.stops += velocities == 0
+        self.time_in_traffic += 1
+
+        # The cars past the last cell are the top of the window
+        exits = len(positions) - int(np.searchsorted(positions, self.road_length))
+        if exits:
+            self.exited += exits
+            self.exit_time += int(self.time_in_traffic[-exits:].sum())
+            self.hi -= exits
+            self._set_views()
+
+    def _enter(self):
+        if len(self.positions):
+            gap = int(self.positions[0]) - 1
+            if gap < 0:
+                return  # Cell 0 is still taken
+        else:
+            gap = self.free_gap
+        self._reserve()
+        self.lo -= 1
+        slot = self.lo
+        for buffer in self.buffers.values():
+            buffer[slot] = 0
+        adaptive_cruise_control = self.acc_share >= 1.0 or (
+            self.acc_share > 0.0 and self.rng.random() < self.acc_share)
+        self.buffers['ids'][slot] = self.next_id
+        self.buffers['velocities'][slot] = min(self.max_speed, gap)
+        self.buffers['adaptive_cruise_control'][slot] = adaptive_cruise_control
+        if not adaptive_cruise_control:
+            self.buffers['speed_offset'][slot] = draw_speed_offsets(
+                self.rng, 1, self.prob_faster, self.prob_slower, self.prob_normal)[0]
+        self.next_id += 1
+        self.waiting -= 1
+        self.entered += 1
+        self._set_views()
@@ -0,0 +1,96 @@
+# scheduler.py
+
+import time
+
+
+class FixedTimestep:
+    """
+    Fixed-timestep clock for stepping a simulation and publishing frames.
+
+    Elapsed wall time is accumulated as time debt and paid off in whole steps, so the
+    average step rate stays at steps_per_second however long each step takes; a slow
+    step is followed by several quick ones. Frames are due at their own, independent
+    rate. Debt beyond max_steps_per_frame is dropped, so an overloaded simulation falls
+    behind real time instead of spiraling.
+    """
+
+    def __init__(self, steps_per_second, frames_per_second=None, max_steps_per_frame=100,
+                 clock=time.monotonic):
+        """
+        Initialize a FixedTimestep instance.
+
+        Parameters:
+            steps_per_second (float): Target simulation step rate.
+            frames_per_second (float, optional): Frame rate; None if nothing is published.
+            max_steps_per_frame (int, optional): Most steps run to catch up in one go.
+            clock (callable, optional): Monotonic time source in seconds.
+        """
+        self.clock = clock
+        self.max_steps_per_frame = max_steps_per_frame
+        self.set_steps_per_second(steps_per_second)
+        self.set_frames_per_second(frames_per_second)
+        self.dropped_steps = 0
+        self.reset()
+
+    def set_steps_per_second(self, steps_per_second):
+        if steps_per_second <= 0:
+            raise ValueError("steps_per_second must be positive.")
+        self.steps_per_second = steps_per_second
+        self.step_interval = 1.0 / steps_per_second
+
+    def set_frames_per_second(self, frames_per_second):
+        if frames_per_second is not None and frames_per_second <= 0:
+            raise ValueError("frames_per_second must be positive.")
+        self.frames_per_second = frames_per_second
+        self.frame_interval = 1.0 / frames_per_second if frames_per_second else None
+
+    def reset(self):
+        """
+        Start counting from now, forgetting any accumulated debt.
+        """
+        now = self.clock()
+        self.last_time = now
+        self.debt = 0.0
+        self.next_frame = now
+
+    def steps_due(self):
+        """
+        Return the number of steps to run now and pay them off.
+        """
+        now = self.clock()
+        self.debt += now - self.last_time
+        self.last_time = now
+
+        steps = int(self.debt / self.step_interval)
+        if steps > self.max_steps_per_frame:
+            self.dropped_steps += steps - self.max_steps_per_frame
+            steps = self.max_steps_per_frame
+            self.debt = self.debt % self.step_interval
+        else:
+            self.debt -= steps * self.step_interval
+        return steps
+
+    def frame_due(self):
+        """
+        Return whether a frame is due now, and if so schedule the next one.
+        """
+        if self.frame_interval is None:
+            return False
+        now = self.clock()
+        if now < self.next_frame:
+            return False
+        self.next_frame += self.frame_interval
+        if self.next_frame <= now:
+            # More than a frame behind: skip the missed frames instead of bursting them
+            self.next_frame = now + self.frame_interval
+        return True
+
+    def sleep_time(self):
+        """
+        Return the seconds until the next step or frame is due.
+        """
+        now = self.clock()
+        wait = self.step_interval - (self.debt + now - self.last_time)
+        if self.frame_interval is not None:
+            wait = min(wait, self.next_frame - now)
+        return max(wait, 0.0)
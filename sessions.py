@@ -0,0 +1,584 @@
+# sessions.py
+
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from analytics import analytics_bytes
+from backpressure import ClientStream
+from checkpoint import load_checkpoint, save_checkpoint
+from simulation import Simulation
+from stepper import RemoteSimulation
+from viewport import Viewport
+from wire import FrameEncoder, encode_viewport
+
+DEFAULT_SESSION = 'default'
+
+# Simulation parameters a client may set: name -> (type, minimum, maximum)
+SESSION_PARAMETERS = {
+    'L': (int, 10, 100000),
+    'N': (int, 1, 100000),
+    'vmax': (int, 1, 10),
+    'p_fault': (float, 0.0, 1.0),
+    'p_slow': (float, 0.0, 1.0),
+    'acc_share': (float, 0.0, 1.0),
+    'acc_share_road2': (float, 0.0, 1.0),
+    'lanes': (int, 1, 8),
+    'inflow': (float, 0.0, 1.0),  # Poisson arrivals per step on open roads
+    'steps_per_second': (float, 0.1, 10000.0),  # Faster than real time is fine
+    'frames_per_second': (float, 1.0, 30.0),
+    'seed': (int, 0, 2**63 - 1),
+}
+SESSION_ENGINES = ('car', 'vector')
+# Placements a client may choose ('checkpoint' would read files on the server)
+SESSION_PLACEMENTS = ('random', 'uniform', 'jam')
+SESSION_BOUNDARIES = ('ring', 'open')
+# Most car updates per second (cars per road x steps per second) a client-created session
+# may ask for, per engine; the per-object car engine is far slower per car
+SESSION_MAX_CAR_STEPS = {'car': 20000, 'vector': 2000000}
+# Most memory the analytics of a client-created session (both roads) may take
+SESSION_MAX_ANALYTICS_BYTES = 4 << 20
+
+# Wall time a fast-forward holds the simulation lock before yielding to other green threads
+FAST_FORWARD_SLICE = 0.05
+
+
+def session_parameters(params, analytics_window=0):
+    """
+    Validate client-supplied parameters and convert them to Simulation keyword arguments.
+
+    Parameters:
+        params (dict): Client-supplied Simulation parameters.
+        analytics_window (int, optional): Analytics window the session will run with.
+
+    Raises:
+        ValueError: On unknown names, values of the wrong type or out of range, more cars
+            than cells, more car updates per second than SESSION_MAX_CAR_STEPS allows, or
+            analytics larger than SESSION_MAX_ANALYTICS_BYTES.
+    """
+    params = dict(params or {})
+    kwargs = {}
+    engine = params.pop('engine', None)
+    if engine is not None:
+        if engine not in SESSION_ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        kwargs['engine'] = engine
+    placement = params.pop('placement', None)
+    if placement is not None:
+        if placement not in SESSION_PLACEMENTS:
+            raise ValueError(f"Unknown placement: {placement}")
+        kwargs['placement'] = placement
+    boundary = params.pop('boundary', None)
+    if boundary is not None:
+        if boundary not in SESSION_BOUNDARIES:
+            raise ValueError(f"Unknown boundary: {boundary}")
+        kwargs['boundary'] = boundary
+
+    for name, value in params.items():
+        if name not in SESSION_PARAMETERS:
+            raise ValueError(f"Unknown parameter: {name}")
+        kind, low, high = SESSION_PARAMETERS[name]
+        try:
+            value = kind(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {name}: {value!r}") from None
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}.")
+        kwargs[name] = value
+
+    if kwargs.get('N', 24) > kwargs.get('L', 100) * kwargs.get('lanes', 1):
+        raise ValueError("N must not exceed L * lanes.")
+    if kwargs.get('lanes', 1) > 1:
+        kwargs['engine'] = 'vector'
+    if kwargs.get('boundary') == 'open':
+        if kwargs.get('lanes', 1) > 1:
+            raise ValueError("Open roads have one lane.")
+        kwargs['engine'] = 'vector'
+    elif 'inflow' in kwargs:
+        raise ValueError("inflow needs boundary='open'.")
+
+    engine = kwargs.get('engine', 'car')
+    # An open road can fill up to one car per cell
+    cars = kwargs.get('L', 100) if kwargs.get('boundary') == 'open' else kwargs.get('N', 24)
+    car_steps = cars * kwargs.get('steps_per_second', 2)
+    if car_steps > SESSION_MAX_CAR_STEPS[engine]:
+        raise ValueError(f"{cars} cars at {kwargs.get('steps_per_second', 2)} steps per second "
+                         f"exceed the {SESSION_MAX_CAR_STEPS[engine]} car updates per second "
+                         f"allowed with engine '{engine}'.")
+    memory = 2 * analytics_bytes(kwargs.get('L', 100), analytics_window)
+    if memory > SESSION_MAX_ANALYTICS_BYTES:
+        raise ValueError(f"Analytics over {analytics_window} steps would take {memory} bytes, "
+                         f"more than the {SESSION_MAX_ANALYTICS_BYTES} allowed per session.")
+    return kwargs
+
+
+class Session:
+    """
+    One Simulation with its own Socket.IO room, frame encoder and stepping green thread,
+    and a ClientStream per client.
+    """
+
+    def __init__(self, session_id, simulation, pinned=False):
+        self.id = session_id
+        self.room = f'session:{session_id}'
+        self.simulation = simulation
+        self.encoder = FrameEncoder(keyframe_interval=50)
+        self.pinned = pinned  # Never evicted
+        self.clients = set()
+        self.streams = {}  # sid -> ClientStream: frames on their way to the client
+        self.viewports = {}  # sid -> Viewport, for clients that only view part of the road
+        self.last_active = time.monotonic()
+        self.running = False
+        self.fast_forwarding = False  # Real-time stepping pauses meanwhile
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def idle_for(self, now=None):
+        if self.clients:
+            return 0.0
+        return (now if now is not None else time.monotonic()) - self.last_active
+
+
+class SessionManager:
+    """
+    Create Simulation sessions on demand and keep at most max_sessions of them.
+
+    Sessions without clients are evicted after idle_ttl seconds. When the cap is reached,
+    the least recently used unpinned session is evicted to make room, preferring sessions
+    nobody is watching.
+    """
+
+    def __init__(self, socketio, max_sessions=100, idle_ttl=600.0, frames_per_second=20,
+                 namespace='/', checkpoint_dir=None, checkpoint_interval=60.0,
+                 client_window=2, client_queue_depth=2, analytics_window=200):
+        """
+        Initialize a SessionManager instance.
+
+        Parameters:
+            socketio (SocketIO): Server used for background tasks, rooms and emits.
+            max_sessions (int, optional): Cap on concurrent sessions (pinned ones included).
+            idle_ttl (float, optional): Seconds a session without clients is kept.
+            frames_per_second (float, optional): Default frame rate of a session, independent
+                of its step rate.
+            namespace (str, optional): Socket.IO namespace of the clients.
+            checkpoint_dir (str, optional): Directory where pinned sessions are checkpointed
+                every checkpoint_interval seconds and restored from when created again
+                (e.g. after a restart). No checkpoints if None.
+            checkpoint_interval (float, optional): Seconds between checkpoints.
+            client_window (int, optional): Frames a client may leave unacknowledged.
+            client_queue_depth (int, optional): Frames that may wait for a client; beyond
+                that only the newest is kept (see backpressure.ClientStream).
+            analytics_window (int, optional): Steps of analytics history (/analytics) the
+                sessions keep; 0 turns their analytics off.
+        """
+        self.socketio = socketio
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.frames_per_second = frames_per_second
+        self.namespace = namespace
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.client_window = client_window
+        self.client_queue_depth = client_queue_depth
+        self.analytics_window = analytics_window
+        self.sessions = OrderedDict()  # Least recently used first
+        self.client_sessions = {}  # sid -> session id
+        self.reaper = None
+        self.checkpointer = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            session.touch()
+        return session
+
+    def create(self, params=None, session_id=None, pinned=False):
+        """
+        Create and start a session.
+
+        Parameters:
+            params (dict, optional): Client-supplied Simulation parameters.
+            session_id (str, optional): Id of the session (random if None).
+            pinned (bool, optional): Exempt the session from eviction.
+
+        Returns:
+            Session: The running session.
+
+        Raises:
+            ValueError: If the parameters are invalid.
+            RuntimeError: If the cap is reached and every session is pinned.
+        """
+        kwargs = session_parameters(params, self.analytics_window)
+        kwargs['analytics_window'] = self.analytics_window
+        frames_per_second = kwargs.pop('frames_per_second', self.frames_per_second)
+        session_id = session_id or uuid.uuid4().hex[:12]
+        if session_id in self.sessions:
+            raise ValueError(f"Session {session_id} already exists.")
+
+        self.evict_idle()
+        while len(self.sessions) >= self.max_sessions:
+            self.evict(self._eviction_candidate())
+
+        simulation = self._restore(session_id, kwargs) if pinned else None
+        session = Session(session_id, simulation or Simulation(**kwargs), pinned=pinned)
+        session.simulation.scheduler.set_frames_per_second(frames_per_second)
+        self.sessions[session_id] = session
+        session.running = True
+        session.simulation.running = True
+        self.socketio.start_background_task(self._step_loop, session)
+
+        if self.reaper is None:
+            self.reaper = self.socketio.start_background_task(self._reap_loop)
+        if pinned and self.checkpoint_dir and self.checkpointer is None:
+            self.checkpointer = self.socketio.start_background_task(self._checkpoint_loop)
+        logging.info(f"Session {session_id} created ({len(self.sessions)} running).")
+        return session
+
+    def attach(self, session_id, name):
+        """
+        Serve a simulation that runs in a separate process (stepper.py) as a pinned
+        session. This process only relays its snapshots to the session's clients, so
+        stepping never holds up websocket delivery and several web workers can serve it.
+
+        Parameters:
+            session_id (str): Id of the session.
+            name (str): Name the simulation process publishes under.
+
+        Returns:
+            Session: The relaying session.
+
+        Raises:
+            RuntimeError: If no simulation process publishes under `name`, or the cap is
+                reached and every session is pinned.
+        """
+        try:
+            simulation = RemoteSimulation(name, sleep=self.socketio.sleep)
+        except (FileNotFoundError, TimeoutError) as e:
+            raise RuntimeError(f"Simulation process {name} is not running.") from e
+        self.evict_idle()
+        while len(self.sessions) >= self.max_sessions:
+            self.evict(self._eviction_candidate())
+
+        session = Session(session_id, simulation, pinned=True)
+        simulation.scheduler.set_frames_per_second(self.frames_per_second)
+        self.sessions[session_id] = session
+        session.running = True
+        self.socketio.start_background_task(self._relay_loop, session)
+        if self.reaper is None:
+            self.reaper = self.socketio.start_background_task(self._reap_loop)
+        logging.info(f"Session {session_id} attached to simulation process {name}.")
+        return session
+
+    def checkpoint_path(self, session_id):
+        return os.path.join(self.checkpoint_dir, f'{session_id}.npz')
+
+    def _restore(self, session_id, kwargs):
+        if not self.checkpoint_dir or not os.path.exists(self.checkpoint_path(session_id)):
+            return None
+        try:
+            # The checkpoint decides the dynamics; only the pace comes from the request
+            overrides = {name: kwargs[name] for name in ('steps_per_second',) if name in kwargs}
+            simulation = load_checkpoint(self.checkpoint_path(session_id), **overrides)
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Could not restore session {session_id}: {e}")
+            return None
+        logging.info(f"Session {session_id} restored at step {simulation.step}.")
+        return simulation
+
+    def checkpoint(self, session):
+        simulation = session.simulation
+        with simulation.lock:
+            save_checkpoint(simulation, self.checkpoint_path(session.id))
+
+    def fast_forward(self, session_id, steps):
+        """
+        Run a session's simulation `steps` steps ahead as fast as possible, then resume
+        real-time stepping from there.
+
+        The steps run in a background task, in slices of about FAST_FORWARD_SLICE seconds so
+        other sessions keep stepping and clients keep receiving frames. Emits
+        'fast_forward_done' to the session's room when finished.
+
+        Returns:
+            bool: False if the session does not exist, is already fast-forwarding or runs
+                in a separate process.
+        """
+        session = self.get(session_id)
+        if (session is None or session.fast_forwarding
+                or isinstance(session.simulation, RemoteSimulation)):
+            return False
+        session.fast_forwarding = True
+        self.socketio.start_background_task(self._fast_forward, session, steps)
+        return True
+
+    def _fast_forward(self, session, steps):
+        simulation = session.simulation
+        batch = 1
+        try:
+            while steps > 0 and session.running:
+                count = min(batch, steps)
+                start = time.perf_counter()
+                with simulation.lock:
+                    simulation.fast_forward(count)
+                elapsed = time.perf_counter() - start
+                steps -= count
+                # Size the next slice from the speed of this one
+                batch = max(1, min(batch * 4, int(count * FAST_FORWARD_SLICE / max(elapsed, 1e-6))))
+                self.socketio.sleep(0)
+        finally:
+            # No catching up on the real-time steps missed meanwhile
+            simulation.scheduler.reset()
+            session.encoder.request_keyframe()
+            session.fast_forwarding = False
+        self.socketio.emit('fast_forward_done',
+                           {'session_id': session.id, 'step': simulation.step},
+                           to=session.room, namespace=self.namespace)
+        logging.info(f"Session {session.id} fast-forwarded to step {simulation.step}.")
+
+    def get_or_create(self, session_id, params=None, pinned=False):
+        session = self.get(session_id)
+        if session is None:
+            session = self.create(params, session_id=session_id, pinned=pinned)
+        return session
+
+    def _eviction_candidate(self):
+        candidates = [session for session in self.sessions.values() if not session.pinned]
+        if not candidates:
+            raise RuntimeError("Session limit reached.")
+        unwatched = [session for session in candidates if not session.clients]
+        return (unwatched or candidates)[0].id
+
+    def evict(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        session.running = False
+        if isinstance(session.simulation, RemoteSimulation):
+            session.simulation.close()
+        self.socketio.emit('session_closed', {'session_id': session_id}, to=session.room,
+                           namespace=self.namespace)
+        for sid in session.clients:
+            self.client_sessions.pop(sid, None)
+            self.socketio.server.leave_room(sid, session.room, namespace=self.namespace)
+        session.streams.clear()
+        logging.info(f"Session {session_id} evicted ({len(self.sessions)} running).")
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for session in list(self.sessions.values()):
+            if not session.pinned and session.idle_for(now) > self.idle_ttl:
+                self.evict(session.id)
+
+    def join(self, session_id, sid):
+        """
+        Move a client into a session's room and send it a keyframe.
+
+        Returns:
+            Session or None: The joined session, or None if it does not exist.
+        """
+        session = self.get(session_id)
+        if session is None:
+            return None
+        self.leave(sid)
+        session.clients.add(sid)
+        self.client_sessions[sid] = session_id
+        self.socketio.server.enter_room(sid, session.room, namespace=self.namespace)
+        session.streams[sid] = ClientStream(self.client_window, self.client_queue_depth)
+        simulation = session.simulation
+        self.socketio.emit('session_joined', {'session_id': session_id,
+                                              'road_length': simulation.L,
+                                              'lanes': simulation.lanes,
+                                              'boundary': simulation.boundary}, to=sid,
+                           namespace=self.namespace)
+        self._send_keyframe(session, sid)
+        return session
+
+    def leave(self, sid):
+        session = self.sessions.get(self.client_sessions.pop(sid, None))
+        if session is None:
+            return
+        session.clients.discard(sid)
+        session.viewports.pop(sid, None)
+        session.streams.pop(sid, None)
+        session.touch()
+        self.socketio.server.leave_room(sid, session.room, namespace=self.namespace)
+
+    def set_viewport(self, sid, data):
+        """
+        Switch a client to viewport frames of the cells it is looking at (see viewport.py),
+        or back to the full broadcast frames if data is None.
+
+        Parameters:
+            sid (str): The client.
+            data (dict or None): {'start', 'end', 'zoom'}: the cell range [start, end) and
+                the zoom level in pixels per cell.
+
+        Returns:
+            Session or None: The client's session, or None if it is in none.
+
+        Raises:
+            ValueError: If the viewport is invalid.
+        """
+        session = self.session_of(sid)
+        if session is None:
+            return None
+        simulation = session.simulation
+        stream = session.streams[sid]
+        if data is None:
+            if session.viewports.pop(sid, None) is not None:
+                stream.clear()
+                self._send_keyframe(session, sid)
+            return session
+
+        viewport = Viewport.create(data, simulation.L)
+        session.viewports[sid] = viewport
+        # Answer right away instead of at the next frame, so panning and zooming feel direct
+        # (unless the client is still busy with earlier frames)
+        stream.clear()
+        stream.offer(encode_viewport(simulation.snapshot, viewport, simulation.L))
+        self._flush(session, sid)
+        return session
+
+    def request_keyframe(self, sid):
+        """
+        Resynchronize a client that missed the base of a delta: its next full frame is a
+        keyframe. The session's other clients keep getting deltas.
+        """
+        session = self.session_of(sid)
+        if session is not None and sid in session.streams:
+            session.streams[sid].resync()
+
+    def session_of(self, sid):
+        return self.sessions.get(self.client_sessions.get(sid))
+
+    def instrument_sources(self):
+        """
+        (labels, Instruments, target steps per second) of every session, for
+        instrumentation.render_prometheus.
+        """
+        sources = []
+        for session in self.sessions.values():
+            simulation = session.simulation
+            if isinstance(simulation, RemoteSimulation):
+                instruments = simulation.exported_instruments()
+            else:
+                instruments = simulation.instruments
+            sources.append(({'session': session.id}, instruments, simulation.steps_per_second))
+        return sources
+
+    def _step_loop(self, session):
+        simulation = session.simulation
+        scheduler = simulation.scheduler
+        scheduler.reset()
+        last_frame_step = None
+        while session.running and simulation.running:
+            # Catch up on every step due, then publish at most one frame; yield after each
+            # step so a slow session does not hold up the others and the clients' sockets
+            for _ in range(0 if session.fast_forwarding else scheduler.steps_due()):
+                with simulation.lock:
+                    simulation.run_step()
+                self.socketio.sleep(0)
+                if not session.running or session.fast_forwarding:
+                    break
+            if scheduler.frame_due() and session.clients and simulation.step != last_frame_step:
+                snapshot = simulation.snapshot
+                last_frame_step = snapshot.step
+                self._broadcast(session, snapshot)
+            self.socketio.sleep(scheduler.sleep_time())
+        session.running = False
+        logging.info(f"Session {session.id} stopped at step {simulation.step}.")
+
+    def _relay_loop(self, session):
+        # The simulation process steps; pick up its newest snapshot once per frame
+        simulation = session.simulation
+        last_frame_step = None
+        while session.running:
+            if session.clients:
+                snapshot = simulation.snapshot
+                if snapshot.step != last_frame_step:
+                    last_frame_step = snapshot.step
+                    self._broadcast(session, snapshot)
+            self.socketio.sleep(simulation.scheduler.frame_interval)
+        logging.info(f"Session {session.id} stopped relaying.")
+
+    def _broadcast(self, session, snapshot):
+        # Every client gets the frame through its own stream, so a slow one only delays
+        # (and drops) its own frames
+        simulation = session.simulation
+        instruments = simulation.instruments
+        frame = snapshot.frame
+        data = base = None
+        if len(session.viewports) < len(session.clients):
+            with instruments.time('encode_frame'):
+                data = session.encoder.encode(frame)
+            instruments.observe_size('frame', len(data))
+            base = session.encoder.last_base
+        for sid, stream in list(session.streams.items()):
+            viewport = session.viewports.get(sid)
+            if viewport is None:
+                dropped = stream.offer(data, base, frame)
+            else:
+                # Culled, so sized by the client's view, not the road
+                with instruments.time('encode_viewport'):
+                    viewport_data = encode_viewport(snapshot, viewport, simulation.L)
+                instruments.observe_size('viewport_frame', len(viewport_data))
+                dropped = stream.offer(viewport_data)
+            if dropped:
+                instruments.count('frames_dropped', dropped)
+            self._flush(session, sid)
+
+    def _send_keyframe(self, session, sid):
+        # The full frame the session's deltas currently build on, for a client starting on it
+        keyframe = session.encoder.keyframe()
+        if keyframe is not None:
+            session.streams[sid].offer(keyframe, frame=session.encoder.last_frame)
+            self._flush(session, sid)
+
+    def _flush(self, session, sid):
+        # Emit whatever the client's window has room for; acknowledgements make room
+        stream = session.streams.get(sid)
+        if stream is None:
+            return
+        instruments = session.simulation.instruments
+        ready = stream.ready()
+        for sequence, data in ready:
+            # The client echoes the sequence number in its acknowledgement
+            with instruments.time('emit'):
+                self.socketio.emit('simulation_frame', (data, sequence), to=sid,
+                                   namespace=self.namespace,
+                                   callback=lambda echoed=None, *args: self._acknowledged(
+                                       session, sid, echoed))
+        if ready:
+            instruments.count('frames_sent', len(ready))
+
+    def _acknowledged(self, session, sid, sequence):
+        stream = session.streams.get(sid)
+        if stream is None:
+            return
+        round_trip = stream.acknowledge(sequence)
+        if round_trip is not None:
+            session.simulation.instruments.observe_time('frame_ack', round_trip)
+        self._flush(session, sid)
+
+    def _reap_loop(self):
+        while True:
+            self.socketio.sleep(max(self.idle_ttl / 4, 1.0))
+            self.evict_idle()
+
+    def _checkpoint_loop(self):
+        while True:
+            self.socketio.sleep(self.checkpoint_interval)
+            for session in list(self.sessions.values()):
+                # A simulation process checkpoints itself (stepper.py --checkpoint)
+                if session.pinned and not isinstance(session.simulation, RemoteSimulation):
+                    try:
+                        self.checkpoint(session)
+                    except OSError as e:
+                        logging.warning(f"Could not checkpoint session {session.id}: {e}")
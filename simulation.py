@@ -2,11 +2,31 @@ import numpy as np
 import threading
 import time
 import logging
-from Car import Car
+from Car import CarRing, RoadParameters, draw_speed_offsets, SEED
+from road_engine import ArrayRoad, VectorRoad, MultiLaneRoad, OpenRoad
+from scheduler import FixedTimestep
+from snapshot import Snapshot
+from instrumentation import Instruments
+from analytics import RoadAnalytics
+from acc import ACCParameters
+from placement import PLACEMENTS, place_cars
+from inflow import Inflow
 
 # Configure logging for simulation module
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+
+def acc_flags(num_cars, acc_share, rng):
+    # Exactly round(acc_share * N) ACC cars, like cruise_control_percentage_road1 in
+    # simulationOld; pure roads do not consume any draws
+    num_acc = int(round(acc_share * num_cars))
+    if num_acc in (0, num_cars):
+        return np.full(num_cars, num_acc > 0)
+    flags = np.zeros(num_cars, dtype=bool)
+    flags[rng.choice(num_cars, num_acc, replace=False)] = True
+    return flags
+
+
 class Simulation:
     def __init__(
         self,
@@ -20,7 +40,39 @@ class Simulation:
         prob_slower=0.10,
         prob_normal=0.40,
         steps_per_second=2,  # New parameter
+        engine='car',  # 'car' (one Car object per vehicle) or 'vector' (NumPy arrays)
+        seed=SEED,  # int, np.random.SeedSequence or None (fresh entropy)
+        acc_share=1.0,  # Share of ACC cars (penetration rate) on road 1
+        acc_share_road2=0.0,  # Share of ACC cars on road 2
+        lanes=1,  # Lanes per road; more than one needs engine='vector'
+        sensors=None,  # Loop detector cells (four evenly spaced ones if None)
+        analytics_window=0,  # Steps of space-time, detector and jam history kept (0: off)
+        acc=None,  # ACC controller parameters (dict or ACCParameters) of road 1
+        acc_road2=None,  # ... of road 2 (same as road 1 if None)
+        placement='random',  # Initial placement: 'random', 'uniform', 'jam' or 'checkpoint'
+        placement_source=None,  # Checkpoint file to take the cars from for 'checkpoint'
+        boundary='ring',  # 'ring' or 'open' (entrance and exit; N is the initial car count)
+        inflow=None,  # Arrivals per step at an open road's entrance (see Inflow.create)
     ):
+        if engine not in ('car', 'vector'):
+            raise ValueError(f"Unknown engine: {engine}")
+        if not (0.0 <= acc_share <= 1.0 and 0.0 <= acc_share_road2 <= 1.0):
+            raise ValueError("acc_share and acc_share_road2 must be between 0 and 1.")
+        if lanes < 1:
+            raise ValueError("lanes must be at least 1.")
+        if lanes > 1 and engine != 'vector':
+            raise ValueError("Multi-lane roads need engine='vector'.")
+        if N > L * lanes:
+            raise ValueError("N must not exceed the number of cells (L * lanes).")
+        if placement not in PLACEMENTS:
+            raise ValueError(f"Unknown placement: {placement}")
+        if boundary not in ('ring', 'open'):
+            raise ValueError(f"Unknown boundary: {boundary}")
+        if boundary == 'open' and (engine != 'vector' or lanes > 1):
+            raise ValueError("Open roads need engine='vector' and one lane.")
+        if analytics_window < 0:
+            raise ValueError("analytics_window must not be negative.")
+
         # Initialize simulation parameters
         self.L = L
         self.N = N
@@ -33,12 +85,36 @@ class Simulation:
         self.prob_normal = prob_normal
         self.steps_per_second = steps_per_second
         self.sleep_interval = 1.0 / self.steps_per_second
+        # Paces run() (and session frames); steps do not drift with their own cost
+        self.scheduler = FixedTimestep(steps_per_second)
+        self.engine = engine
+        self.acc_share = acc_share
+        self.acc_share_road2 = acc_share_road2
+        self.lanes = lanes
+        self.sensors = sensors
+        self.analytics_window = analytics_window
+        self.acc = ACCParameters.create(acc)
+        self.acc_road2 = ACCParameters.create(acc_road2) if acc_road2 is not None else self.acc
+        self.placement = placement
+        self.placement_source = placement_source
+        self.boundary = boundary
+        # Shared by both roads; arrivals are drawn from each road's own stream
+        self.inflow = Inflow.create(inflow)
 
         self.rho = N / (L / 2.0)
 
+        # One independent random stream per road; pass a spawned SeedSequence to split
+        # streams between processes
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng_road1, self.rng_road2 = [np.random.default_rng(s) for s in seed.spawn(2)]
+
         # Initialize cars on two roads
-        self.cars_road1 = self.initialize_cars(adaptive_cruise_control=True)
-        self.cars_road2 = self.initialize_cars(adaptive_cruise_control=False)
+        self.cars_road1 = self.initialize_cars(acc_share=self.acc_share, rng=self.rng_road1,
+                                               acc=self.acc, road='road1')
+        self.cars_road2 = self.initialize_cars(acc_share=self.acc_share_road2, rng=self.rng_road2,
+                                               acc=self.acc_road2, road='road2')
 
         self.step = 0
         self.running = False
@@ -48,6 +124,15 @@ class Simulation:
             'road1': {},
             'road2': {}
         }
+        self.compute_metrics()
+        self.publish_snapshot()
+
+        # Space-time raster, loop detectors, fundamental diagram and jam waves per road,
+        # updated incrementally from every snapshot; only served simulations keep them
+        self.reset_analytics()
+
+        # Step timings and rates, exported by the /metrics endpoint
+        self.instruments = Instruments()
 
         # Lock for thread safety
         self.lock = threading.Lock()
@@ -56,82 +141,161 @@ class Simulation:
         with self.lock:
             self.steps_per_second = steps_per_second
             self.sleep_interval = 1.0 / self.steps_per_second
+            self.scheduler.set_steps_per_second(steps_per_second)
             #logging.info(f"Steps per second set to {self.steps_per_second}, sleep interval updated to {self.sleep_interval} seconds.")
 
-    def initialize_cars(self, adaptive_cruise_control):
-        occupied_positions = set()
-        cars = []
-        for _ in range(self.N):
-            position = np.random.randint(0, self.L)
-            while position in occupied_positions:
-                position = np.random.randint(0, self.L)
-            occupied_positions.add(position)
-            car = Car(
+    def acc_flags(self, acc_share, rng):
+        return acc_flags(self.N, acc_share, rng)
+
+    def initialize_cars(self, acc_share, rng, acc=None, road='road1'):
+        adaptive_cruise_control = self.acc_flags(acc_share, rng)
+        positions, lanes, velocities = place_cars(self.placement, self.N, self.L, self.lanes,
+                                                  rng, self.placement_source, road)
+        if velocities is None:
+            velocities = rng.integers(1, self.vmax + 1, size=self.N)
+        if self.engine == 'car':
+            # Car objects are created in ring order (as VectorRoad stores them), each with
+            # the velocity and ACC flag drawn for its position; the cells are distinct, so
+            # any sort gives the same order
+            order = np.argsort(positions)
+            positions = positions[order]
+            velocities = velocities[order]
+            adaptive_cruise_control = adaptive_cruise_control[order]
+        if self.boundary == 'open':
+            return OpenRoad(
+                road_length=self.L,
+                max_speed=self.vmax,
+                p_fault=self.p_fault,
+                p_slow=self.p_slow,
+                positions=positions,
+                velocities=velocities,
+                adaptive_cruise_control=adaptive_cruise_control,
+                prob_faster=self.prob_faster,
+                prob_slower=self.prob_slower,
+                prob_normal=self.prob_normal,
+                rng=rng,
+                acc=acc,
+                inflow=self.inflow,
+                acc_share=acc_share
+            )
+        if self.lanes > 1:
+            return MultiLaneRoad(
+                road_length=self.L,
+                max_speed=self.vmax,
+                p_fault=self.p_fault,
+                p_slow=self.p_slow,
+                positions=positions,
+                velocities=velocities,
+                lanes=lanes,
+                num_lanes=self.lanes,
+                adaptive_cruise_control=adaptive_cruise_control,
+                prob_faster=self.prob_faster,
+                prob_slower=self.prob_slower,
+                prob_normal=self.prob_normal,
+                rng=rng,
+                acc=acc
+            )
+        if self.engine == 'vector':
+            return VectorRoad(
                 road_length=self.L,
-                cell_width=1,  # For web visualization, cell_width is abstracted
                 max_speed=self.vmax,
                 p_fault=self.p_fault,
                 p_slow=self.p_slow,
+                positions=positions,
+                velocities=velocities,
+                adaptive_cruise_control=adaptive_cruise_control,
                 prob_faster=self.prob_faster,
                 prob_slower=self.prob_slower,
                 prob_normal=self.prob_normal,
-                position=position,
-                velocity=np.random.randint(1, self.vmax + 1),
-                adaptive_cruise_control=adaptive_cruise_control
+                rng=rng,
+                acc=acc
             )
-            cars.append(car)
-        road_type = "Road 1 (ACC)" if adaptive_cruise_control else "Road 2 (Human)"
-        #logging.debug(f"Initialized {len(cars)} cars on {road_type}.")
+
+        speed_offsets = draw_speed_offsets(rng, self.N, self.prob_faster, self.prob_slower,
+                                           self.prob_normal)
+        road_parameters = RoadParameters(
+            road_length=self.L,
+            cell_width=1,  # For web visualization, cell_width is abstracted
+            max_speed=self.vmax,
+            p_fault=self.p_fault,
+            p_slow=self.p_slow,
+            rng=rng,
+            acc=acc
+        )
+        cars = CarRing.from_arrays(road_parameters, positions, velocities, adaptive_cruise_control,
+                                   speed_offsets)
+        #logging.debug(f"Initialized {len(cars)} cars ({acc_share:.0%} ACC).")
         return cars
 
     def run_step(self):
         try:
             #logging.debug(f"Starting run_step for step {self.step + 1}.")
-            # Update Road 1
-            self.update_road(self.cars_road1)
+            instruments = self.instruments
+            with instruments.time('run_step'):
+                # Update Road 1
+                with instruments.time('update_road'):
+                    self.update_road(self.cars_road1, self.rng_road1)
 
-            # Update Road 2
-            self.update_road(self.cars_road2)
+                # Update Road 2
+                with instruments.time('update_road'):
+                    self.update_road(self.cars_road2, self.rng_road2)
 
-            # Compute metrics
-            self.compute_metrics()
+                # Compute metrics
+                with instruments.time('compute_metrics'):
+                    self.compute_metrics()
 
-            self.step += 1
+                self.step += 1
+                with instruments.time('publish_snapshot'):
+                    self.publish_snapshot()
+                if self.analytics:
+                    with instruments.time('update_analytics'):
+                        self.update_analytics()
+            instruments.steps.tick()
             #logging.debug(f"Completed run_step for step {self.step}.")
         except Exception as e:
             logging.error(f"Exception in run_step: {e}")
             self.running = False  # Stop simulation on error
 
-    def update_road(self, cars):
+    def update_road(self, cars, rng):
         try:
-            cars_sorted = sorted(cars, key=lambda c: c.position)
-            num_cars = len(cars_sorted)
-            for i, car in enumerate(cars_sorted):
-                if i < num_cars - 1:
-                    next_car = cars_sorted[i + 1]
-                    distance = next_car.position - car.position - 1
-                    if distance < 0:
-                        distance += self.L
-                else:
-                    next_car = cars_sorted[0]
-                    distance = (next_car.position + self.L) - car.position - 1
+            # One draw per car for the whole tick, indexed by position order
+            rand = rng.random(len(cars))
+
+            if isinstance(cars, ArrayRoad):
+                cars.update(rand)
+                return
+
+            # Cars by position, kept up to date by CarRing instead of sorted every tick
+            order = cars.order
+            last = len(order) - 1
+            for i, car in enumerate(order):
+                next_car = order[i + 1] if i < last else order[0]
+                distance = next_car.position - car.position - 1
+                if distance < 0:
+                    distance += self.L
                 velocity_of_next_car = next_car.velocity
-                car.update_velocity(distance, velocity_of_next_car)
+                car.update_velocity(distance, velocity_of_next_car, rand[i])
                 #logging.debug(f"Car at position {car.position} updated with distance {distance} and next car velocity {velocity_of_next_car}.")
 
-            for car in cars_sorted:
-                car.move()
-                #logging.debug(f"Car moved to new position {car.position} with velocity {car.velocity}.")
+            cars.move_all()
         except Exception as e:
             logging.error(f"Exception in update_road: {e}")
             self.running = False  # Stop simulation on error
 
+    @staticmethod
+    def road_velocities(cars):
+        if isinstance(cars, ArrayRoad):
+            return cars.velocities
+        return np.array([c.velocity for c in cars])
+
     def compute_metrics(self):
         try:
-            average_speed_road1 = np.mean([c.velocity for c in self.cars_road1]) if self.cars_road1 else 0
-            stopped_vehicles_road1 = sum(c.velocity == 0 for c in self.cars_road1)
-            average_speed_road2 = np.mean([c.velocity for c in self.cars_road2]) if self.cars_road2 else 0
-            stopped_vehicles_road2 = sum(c.velocity == 0 for c in self.cars_road2)
+            velocities_road1 = self.road_velocities(self.cars_road1)
+            velocities_road2 = self.road_velocities(self.cars_road2)
+            average_speed_road1 = float(np.mean(velocities_road1)) if len(velocities_road1) else 0
+            stopped_vehicles_road1 = int(np.count_nonzero(velocities_road1 == 0))
+            average_speed_road2 = float(np.mean(velocities_road2)) if len(velocities_road2) else 0
+            stopped_vehicles_road2 = int(np.count_nonzero(velocities_road2 == 0))
 
             self.metrics['road1'] = {
                 'average_speed': average_speed_road1,
@@ -143,6 +307,11 @@ class Simulation:
                 'stopped_vehicles': stopped_vehicles_road2,
                 'density': self.rho
             }
+            for road, cars in (('road1', self.cars_road1), ('road2', self.cars_road2)):
+                if isinstance(cars, OpenRoad):
+                    # The car count varies; same scale as self.rho
+                    self.metrics[road]['density'] = len(cars) / (self.L / 2.0)
+                    self.metrics[road].update(cars.counters())
 
             #logging.debug(f"Metrics at step {self.step}: Road1 - Avg Speed: {average_speed_road1}, Stopped: {stopped_vehicles_road1}; Road2 - Avg Speed: {average_speed_road2}, Stopped: {stopped_vehicles_road2}")
         except Exception as e:
@@ -159,11 +328,12 @@ class Simulation:
 
     def run(self):
         logging.info("Simulation thread is running.")
+        self.scheduler.reset()
         while self.running:
-            with self.lock:
-                self.run_step()
-            #logging.debug(f"Sleeping for {self.sleep_interval} seconds.")
-            time.sleep(self.sleep_interval)
+            for _ in range(self.scheduler.steps_due()):
+                with self.lock:
+                    self.run_step()
+            time.sleep(self.scheduler.sleep_time())
         logging.info("Simulation thread has stopped.")
 
     def stop(self):
@@ -172,27 +342,124 @@ class Simulation:
         self.thread.join()
         logging.info("Simulation stopped.")
 
+    @staticmethod
+    def road_arrays(cars):
+        # Arrays in vehicle order (not position order), so a car keeps its index from frame
+        # to frame and deltas between frames stay small
+        if isinstance(cars, OpenRoad):
+            # Cars come and go: position order, with the vehicle ids to match frames by
+            names = ['positions', 'velocities', 'adaptive_cruise_control', 'ids']
+            return {name: getattr(cars, name).copy() for name in names}
+        if isinstance(cars, ArrayRoad):
+            arrays = {}
+            names = ['positions', 'velocities', 'adaptive_cruise_control']
+            if isinstance(cars, MultiLaneRoad):
+                names.append('lanes')
+            for name in names:
+                values = getattr(cars, name)
+                arrays[name] = np.empty_like(values)
+                arrays[name][cars.ids] = values
+            return arrays
+        return {
+            'positions': np.array([car.position for car in cars], dtype=np.int64),
+            'velocities': np.array([car.velocity for car in cars], dtype=np.int64),
+            'adaptive_cruise_control': np.array([car.adaptive_cruise_control for car in cars],
+                                                dtype=bool)
+        }
+
+    @staticmethod
+    def road_totals(cars):
+        """
+        Per-car accumulated statistics in vehicle order: 'total_distance' (cells driven),
+        'stops' (steps spent stopped) and 'time_in_traffic' (steps on the road).
+        """
+        names = ['total_distance', 'stops', 'time_in_traffic']
+        if isinstance(cars, OpenRoad):
+            # Cars currently on the road, in position order
+            return {name: getattr(cars, name).copy() for name in names}
+        if isinstance(cars, ArrayRoad):
+            totals = {}
+            for name in names:
+                values = getattr(cars, name)
+                totals[name] = np.empty_like(values)
+                totals[name][cars.ids] = values
+            return totals
+        return {name: np.array([getattr(car, name) for car in cars], dtype=np.int64)
+                for name in names}
+
+    def publish_snapshot(self):
+        # Built from copies and swapped in with one assignment; readers never take the lock
+        self.snapshot = Snapshot(
+            self.step,
+            [self.road_arrays(self.cars_road1), self.road_arrays(self.cars_road2)],
+            [self.metrics['road1'], self.metrics['road2']]
+        )
+
+    def parameters(self):
+        """
+        Return the constructor arguments of this simulation (except the seed).
+        """
+        parameters = {
+            name: getattr(self, name)
+            for name in ('L', 'N', 'vmax', 'p_fault', 'p_slow', 'steps', 'prob_faster',
+                         'prob_slower', 'prob_normal', 'steps_per_second', 'engine', 'acc_share',
+                         'acc_share_road2', 'lanes', 'sensors', 'analytics_window', 'placement',
+                         'placement_source', 'boundary')
+        }
+        parameters['inflow'] = self.inflow.spec() if self.inflow is not None else None
+        parameters['acc'] = self.acc._asdict()
+        parameters['acc_road2'] = self.acc_road2._asdict()
+        return parameters
+
+    def fast_forward(self, steps):
+        """
+        Run steps as fast as possible, e.g. to get past the warm-up transient.
+
+        The roads evolve exactly as with run_step, but metrics and the snapshot are only
+        computed after the last step and the analytics start over from there. Call with
+        the lock held while the simulation is running.
+
+        Parameters:
+            steps (int): Number of steps to run.
+        """
+        with self.instruments.time('fast_forward'):
+            for _ in range(steps):
+                self.update_road(self.cars_road1, self.rng_road1)
+                self.update_road(self.cars_road2, self.rng_road2)
+            self.step += steps
+            self.compute_metrics()
+            self.publish_snapshot()
+            self.reset_analytics()
+
+    def reset_analytics(self):
+        # No analytics (and no space-time rasters) with analytics_window=0
+        self.analytics = {
+            road: RoadAnalytics(self.L, self.lanes, self.sensors, self.analytics_window,
+                                ring=self.boundary == 'ring')
+            for road in ('road1', 'road2')
+        } if self.analytics_window else {}
+        self.update_analytics()
+
+    def update_analytics(self):
+        for analytics, road in zip(self.analytics.values(), self.snapshot.roads):
+            analytics.update(road)
+
+    def get_analytics(self):
+        """
+        Aggregates of both roads as a JSON-ready dict ('roads' is empty when analytics are
+        off); call with the lock held while the simulation is stepping.
+        """
+        return {
+            'step': self.step,
+            'roads': {road: analytics.export() for road, analytics in self.analytics.items()}
+        }
+
     def get_state(self):
-        with self.lock:
-            state = {
-                'step': self.step,
-                'road1': [
-                    {
-                        'position': car.position,
-                        'velocity': car.velocity,
-                        'adaptive_cruise_control': car.adaptive_cruise_control
-                    }
-                    for car in self.cars_road1
-                ],
-                'road2': [
-                    {
-                        'position': car.position,
-                        'velocity': car.velocity,
-                        'adaptive_cruise_control': car.adaptive_cruise_control
-                    }
-                    for car in self.cars_road2
-                ],
-                'metrics': self.metrics
-            }
-        #logging.debug(f"State retrieved at step {self.step}")
-        return state
+        # Shared by every reader of the same step; do not modify
+        return self.snapshot.state()
+
+    def get_frame(self):
+        """
+        Array form of get_state, as consumed by wire.FrameEncoder.
+        """
+        return self.snapshot.frame
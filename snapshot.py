@@ -0,0 +1,96 @@
+# snapshot.py
+
+import json
+
+import numpy as np
+
+
+class Snapshot:
+    """
+    Immutable view of a simulation at the end of one step.
+
+    The simulation builds a new Snapshot after every step and swaps it in with a single
+    attribute assignment, so readers never need the step lock: whatever snapshot they
+    picked up stays consistent. Serialized forms are computed once per snapshot and
+    shared by every reader.
+    """
+
+    __slots__ = ('step', 'roads', 'metrics', 'frame', '_state', '_json', '_sorted')
+
+    def __init__(self, step, roads, metrics):
+        """
+        Initialize a Snapshot instance.
+
+        Parameters:
+            step (int): Step the snapshot was taken at.
+            roads (list): Per road, a dict of 'positions', 'velocities' and
+                'adaptive_cruise_control' (plus 'lanes' on multi-lane roads) arrays in
+                vehicle order; open roads list their cars in position order with their
+                'ids'. The arrays are made read-only; they must not be shared with
+                the running simulation.
+            metrics (list): Per road, a dict of 'average_speed', 'stopped_vehicles' and
+                'density'.
+        """
+        for road in roads:
+            for array in road.values():
+                array.flags.writeable = False
+        self.step = step
+        self.roads = roads
+        self.metrics = metrics
+        # Input of wire.FrameEncoder
+        self.frame = {'step': step, 'roads': roads, 'metrics': metrics}
+        self._state = None
+        self._json = None
+        self._sorted = [None] * len(roads)
+
+    def state(self):
+        """
+        Return the state in the Simulation.get_state (JSON-ready dict) shape.
+        """
+        if self._state is None:
+            state = {'step': self.step, 'metrics': {}}
+            for index, (road, metrics) in enumerate(zip(self.roads, self.metrics), start=1):
+                cars = [
+                    {
+                        'position': position,
+                        'velocity': velocity,
+                        'adaptive_cruise_control': adaptive_cruise_control
+                    }
+                    for position, velocity, adaptive_cruise_control in zip(
+                        road['positions'].tolist(),
+                        road['velocities'].tolist(),
+                        road['adaptive_cruise_control'].tolist()
+                    )
+                ]
+                if 'lanes' in road:
+                    for car, lane in zip(cars, road['lanes'].tolist()):
+                        car['lane'] = lane
+                state[f'road{index}'] = cars
+                state['metrics'][f'road{index}'] = metrics
+            self._state = state
+        return self._state
+
+    def sorted_road(self, index):
+        """
+        Return (order, positions, velocity_sums) of road `index` sorted by position: the
+        vehicle indices in position order, their positions, and the running sum of their
+        velocities with a leading 0 (velocity_sums[j] - velocity_sums[i] is the velocity
+        total of sorted cars i to j - 1). For np.searchsorted range queries.
+        """
+        if self._sorted[index] is None:
+            road = self.roads[index]
+            # Vehicle order is a rotation of position order until cars pass each other, so
+            # the stable sort (merging runs) is close to linear
+            order = np.argsort(road['positions'], kind='stable')
+            velocity_sums = np.zeros(len(order) + 1, dtype=np.int64)
+            np.cumsum(road['velocities'][order], out=velocity_sums[1:])
+            self._sorted[index] = (order, road['positions'][order], velocity_sums)
+        return self._sorted[index]
+
+    def json(self):
+        """
+        Return state() encoded as a JSON string.
+        """
+        if self._json is None:
+            self._json = json.dumps(self.state())
+        return self._json
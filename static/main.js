@@ -1,9 +1,7 @@
 document.addEventListener('DOMContentLoaded', () => {
     const socket = io();
 
-    const L = 100; // Updated road length from 80 to 100
-    const cellWidth = 20; // Adjusted cell width based on desired canvas size
-    const canvasWidth = L * cellWidth; // 100 * 20 = 2000px
+    const canvasWidth = 2000; // Fixed on screen; the cells in view are scaled to fit
     const canvasHeight = 600; // Maintain desired height
 
     const canvas = document.getElementById('simulation-canvas');
@@ -11,6 +9,16 @@ document.addEventListener('DOMContentLoaded', () => {
     canvas.height = canvasHeight;
     const ctx = canvas.getContext('2d');
 
+    // Road of the joined session (sent with session_joined) and the cells in view,
+    // [viewStart, viewEnd). The server only sends what is in view (see viewport.py).
+    let roadLength = 100;
+    let roadLanes = 1;
+    let viewStart = 0;
+    let viewEnd = roadLength;
+    let cellWidth = canvas.width / (viewEnd - viewStart);
+    const MIN_VIEW_CELLS = 10;
+    const VIEWPORT_INTERVAL = 100; // ms between viewport updates while panning or zooming
+
     const roadHeight = 120; // Increased for better accommodation of larger cars
     const road1Y = canvas.height / 3; // 200px
     const road2Y = (2 * canvas.height) / 3; // 400px
@@ -33,9 +41,12 @@ document.addEventListener('DOMContentLoaded', () => {
         ctx.strokeStyle = 'rgba(0, 0, 0, 0.6)'; // Darker black with higher opacity
         ctx.lineWidth = 1.5; // Thicker lines for better visibility
 
-        // Draw vertical lines aligned with cell boundaries
-        for (let i = 0; i <= L; i++) {
-            const x = i * cellWidth;
+        // Cell boundaries are only drawn where cells are wide enough to tell apart
+        if (cellWidth < 4) {
+            return;
+        }
+        for (let i = viewStart; i <= viewEnd; i++) {
+            const x = (i - viewStart) * cellWidth;
             ctx.beginPath();
             ctx.moveTo(x, 0); // Start from top of the canvas
             ctx.lineTo(x, canvas.height); // Extend to bottom of the canvas
@@ -53,14 +64,17 @@ document.addEventListener('DOMContentLoaded', () => {
      * @param {boolean} highlight - Whether to highlight a car.
      */
     function drawCars(cars, roadY, color, highlight = false) {
-        const carSize = cellWidth; // Make car size equal to cell width
+        const carSize = Math.max(cellWidth, 1); // Make car size equal to cell width
 
         // Define arrow dimensions relative to car size
         const arrowLength = 8; // Smaller arrow length
         const arrowWidth = 6;  // Smaller arrow width
 
         cars.forEach((car, index) => {
-            const x = car.position * cellWidth; // Align to cell start
+            const x = (car.position - viewStart) * cellWidth; // Align to cell start
+            if (x + carSize < 0 || x > canvas.width) {
+                return;
+            }
             const y = roadY;
 
             // Determine color based on velocity
@@ -87,7 +101,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 ctx.strokeRect(x, y - carSize / 2, carSize, carSize);
             }
 
-            // Draw direction arrow scaled appropriately
+            // Draw direction arrow scaled appropriately (when it fits in the car)
+            if (carSize < 2 * arrowLength) {
+                return;
+            }
             ctx.fillStyle = '#000000'; // Black color for arrow
             ctx.beginPath();
             if (car.velocity > 0) {
@@ -114,6 +131,40 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    /**
+     * Color of a speed, as for the cars: red (stopped) through yellow to green (vmax 3).
+     */
+    function speedColor(velocity) {
+        if (velocity < 2) {
+            return `rgb(255, ${Math.floor(255 * (Math.max(velocity, 0) / 2))}, 0)`;
+        }
+        return `rgb(${Math.max(Math.floor(255 * (1 - (velocity - 2))), 0)}, 255, 0)`;
+    }
+
+    /**
+     * Draw a zoomed-out road as density bars colored by mean speed.
+     * @param {Object} histogram - {counts, meanSpeeds} per bucket (see wire.py).
+     * @param {number} roadY - Y-coordinate of the road.
+     */
+    function drawHistogram(histogram, roadY) {
+        const buckets = histogram.counts.length;
+        const span = viewEnd - viewStart;
+        for (let k = 0; k < buckets; k++) {
+            const count = histogram.counts[k];
+            if (count === 0) {
+                continue;
+            }
+            // Same bucket boundaries as the server
+            const first = Math.floor(k * span / buckets);
+            const last = Math.floor((k + 1) * span / buckets);
+            const density = count / ((last - first) * roadLanes);
+            const height = roadHeight * Math.min(density, 1);
+            ctx.fillStyle = speedColor(histogram.meanSpeeds[k]);
+            ctx.fillRect(first * cellWidth, roadY + roadHeight / 2 - height,
+                         Math.max((last - first) * cellWidth, 1), height);
+        }
+    }
+
     /**
      * Function to update simulation metrics on the webpage.
      * @param {Object} state - Current simulation state.
@@ -126,6 +177,41 @@ document.addEventListener('DOMContentLoaded', () => {
         document.getElementById('road2-info').innerText = road2Info;
     }
 
+    /**
+     * Render a simulation state: roads, grid, cars and metrics.
+     * @param {Object} state - Simulation state ({step, road1, road2, metrics}).
+     */
+    function renderState(state) {
+        // Clear the canvas
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+
+        // Draw roads
+        drawRoads();
+
+        // Draw grid lines
+        drawGrid();
+
+        // Zoomed-out viewport frames carry a histogram instead of the cars of a road
+        const histograms = state.histograms || [];
+
+        // Draw cars for Road 1 (ACC cars - Blue); the first car is only known in full frames
+        if (histograms[0]) {
+            drawHistogram(histograms[0], road1Y);
+        } else {
+            drawCars(state.road1, road1Y, 'blue', !state.viewport);
+        }
+
+        // Draw cars for Road 2 (Human drivers - Red)
+        if (histograms[1]) {
+            drawHistogram(histograms[1], road2Y);
+        } else {
+            drawCars(state.road2, road2Y, 'red', !state.viewport);
+        }
+
+        // Update metrics
+        updateMetrics(state);
+    }
+
     /**
      * Handle incoming simulation state and render graphics.
      */
@@ -136,31 +222,440 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         console.log(`Received state for step ${state.step}`);
+        renderState(state);
+    });
 
-        // Clear the canvas
-        ctx.clearRect(0, 0, canvas.width, canvas.height);
+    // Binary frame layout, see wire.py
+    const FRAME_KEYFRAME = 0x01;
+    const FRAME_WIDE_POSITIONS = 0x02;
+    const FRAME_WIDE_INDICES = 0x04;
+    const FRAME_VIEWPORT = 0x08;
+    const VIEWPORT_HISTOGRAM = 1;
 
-        // Draw roads
-        drawRoads();
+    // Step and per-road arrays (in vehicle order) of the last applied frame
+    let frameStep = null;
+    let frameRoads = [];
 
-        // Draw grid lines
-        drawGrid();
+    /**
+     * Copy count elements of the given typed-array type out of the buffer.
+     * Copying (slice) also sidesteps typed-array alignment requirements.
+     */
+    function readArray(buffer, offset, ArrayType, count) {
+        const end = offset + count * ArrayType.BYTES_PER_ELEMENT;
+        return [new ArrayType(buffer.slice(offset, end)), end];
+    }
 
-        // Draw cars for Road 1 (ACC cars - Blue) and highlight the first car
-        drawCars(state.road1, road1Y, 'blue', true);
+    /**
+     * Decode a binary frame and apply it to the last frame.
+     * @param {ArrayBuffer} buffer - Frame received from the server.
+     * @returns {Object|null} State in the simulation_state shape, or null if the frame is
+     *     a delta against a frame this client does not hold.
+     */
+    function decodeFrame(buffer) {
+        const view = new DataView(buffer);
+        const flags = view.getUint8(1);
+        const numRoads = view.getUint16(2, true);
+        const step = view.getUint32(4, true);
+        const baseStep = view.getUint32(8, true);
+        const keyframe = (flags & FRAME_KEYFRAME) !== 0;
 
-        // Draw cars for Road 2 (Human drivers - Red) and highlight the first car
-        drawCars(state.road2, road2Y, 'red', true);
+        if (flags & FRAME_VIEWPORT) {
+            return decodeViewportFrame(buffer, view, flags, numRoads, step);
+        }
+        if (!keyframe && baseStep !== frameStep) {
+            return null;
+        }
 
-        // Update metrics
-        updateMetrics(state);
+        const PositionArray = (flags & FRAME_WIDE_POSITIONS) ? Uint32Array : Uint16Array;
+        const IndexArray = (flags & FRAME_WIDE_INDICES) ? Uint32Array : Uint16Array;
+        const metrics = [];
+        const roads = [];
+        let offset = 12;
+
+        for (let r = 0; r < numRoads; r++) {
+            metrics.push({
+                average_speed: view.getFloat32(offset, true),
+                density: view.getFloat32(offset + 4, true),
+                stopped_vehicles: view.getUint32(offset + 8, true)
+            });
+            const count = view.getUint32(offset + 12, true);
+            offset += 16;
+
+            let indices, positions, velocities, packed;
+            if (keyframe) {
+                [positions, offset] = readArray(buffer, offset, PositionArray, count);
+                [velocities, offset] = readArray(buffer, offset, Int8Array, count);
+                [packed, offset] = readArray(buffer, offset, Uint8Array, Math.ceil(count / 8));
+                const acc = new Uint8Array(count);
+                for (let i = 0; i < count; i++) {
+                    acc[i] = (packed[i >> 3] >> (i & 7)) & 1;
+                }
+                roads.push({ positions, velocities, acc });
+            } else {
+                [indices, offset] = readArray(buffer, offset, IndexArray, count);
+                [positions, offset] = readArray(buffer, offset, PositionArray, count);
+                [velocities, offset] = readArray(buffer, offset, Int8Array, count);
+                const road = frameRoads[r];
+                for (let k = 0; k < count; k++) {
+                    road.positions[indices[k]] = positions[k];
+                    road.velocities[indices[k]] = velocities[k];
+                }
+                roads.push(road);
+            }
+        }
+
+        frameStep = step;
+        frameRoads = roads;
+
+        const toCars = (road) => Array.from(road.positions, (position, i) => ({
+            position,
+            velocity: road.velocities[i],
+            adaptive_cruise_control: road.acc[i] === 1
+        }));
+        return {
+            step,
+            road1: toCars(roads[0]),
+            road2: toCars(roads[1]),
+            metrics: { road1: metrics[0], road2: metrics[1] }
+        };
+    }
+
+    /**
+     * Decode a viewport frame: the cars in view, or per-bucket histograms when zoomed out.
+     * Self-contained; it neither needs nor updates the delta state of full frames.
+     */
+    function decodeViewportFrame(buffer, view, flags, numRoads, step) {
+        const PositionArray = (flags & FRAME_WIDE_POSITIONS) ? Uint32Array : Uint16Array;
+        const start = view.getUint32(16, true);
+        const end = view.getUint32(20, true);
+        const metrics = [];
+        const roads = [];
+        const histograms = [];
+        let offset = 24;
+
+        for (let r = 0; r < numRoads; r++) {
+            metrics.push({
+                average_speed: view.getFloat32(offset, true),
+                density: view.getFloat32(offset + 4, true),
+                stopped_vehicles: view.getUint32(offset + 8, true)
+            });
+            const count = view.getUint32(offset + 12, true);
+            const kind = view.getUint8(offset + 16);
+            offset += 17;
+
+            if (kind === VIEWPORT_HISTOGRAM) {
+                let counts, meanSpeeds;
+                [counts, offset] = readArray(buffer, offset, Uint32Array, count);
+                [meanSpeeds, offset] = readArray(buffer, offset, Float32Array, count);
+                histograms.push({ counts, meanSpeeds });
+                roads.push([]);
+            } else {
+                let offsets, velocities, packed;
+                [offsets, offset] = readArray(buffer, offset, PositionArray, count);
+                [velocities, offset] = readArray(buffer, offset, Int8Array, count);
+                [packed, offset] = readArray(buffer, offset, Uint8Array, Math.ceil(count / 8));
+                roads.push(Array.from(offsets, (cell, i) => ({
+                    position: start + cell,
+                    velocity: velocities[i],
+                    adaptive_cruise_control: ((packed[i >> 3] >> (i & 7)) & 1) === 1
+                })));
+                histograms.push(null);
+            }
+        }
+
+        // Frames of an older view may still be on their way; draw nothing out of place
+        if (start !== viewStart || end !== viewEnd) {
+            return undefined;
+        }
+        return {
+            step,
+            viewport: { start, end },
+            road1: roads[0],
+            road2: roads[1],
+            histograms,
+            metrics: { road1: metrics[0], road2: metrics[1] }
+        };
+    }
+
+    /**
+     * Handle incoming binary frames (keyframes and deltas).
+     */
+    socket.on('simulation_frame', (buffer, sequence, ack) => {
+        const state = decodeFrame(buffer);
+        if (state === null) {
+            // Missed the frame this delta is based on; wait for a keyframe
+            socket.emit('request_keyframe');
+        } else if (state !== undefined) {
+            lastState = state;
+            renderState(state);
+            if (replay !== null) {
+                replay.step = state.step;
+                showReplay();
+            }
+        }
+        // Acknowledge once drawn, echoing the frame's sequence number: the server sends
+        // this client frames no faster than that
+        if (ack) {
+            ack(sequence);
+        }
+    });
+
+    // Last viewport sent and whether a change is waiting for the next update slot
+    let viewportTimer = null;
+    // Last drawn state, redrawn when the view changes during a (paused) replay
+    let lastState = null;
+    // Playback of a recording ({name, step, speed, paused, first_step, steps}), or null
+    // while watching a live session
+    let replay = null;
+
+    /**
+     * Set the cells in view, clamped to the road, and tell the server (throttled).
+     */
+    function setView(start, end) {
+        const span = Math.min(Math.max(Math.round(end - start), Math.min(MIN_VIEW_CELLS, roadLength)),
+                              roadLength);
+        viewStart = Math.min(Math.max(Math.round(start), 0), roadLength - span);
+        viewEnd = viewStart + span;
+        cellWidth = canvas.width / span;
+        if (replay !== null) {
+            // Replays send whole frames, culled here
+            if (lastState !== null && !lastState.viewport) {
+                renderState(lastState);
+            }
+            return;
+        }
+        if (viewportTimer === null) {
+            viewportTimer = setTimeout(() => {
+                viewportTimer = null;
+                socket.emit('set_viewport', { start: viewStart, end: viewEnd, zoom: cellWidth });
+            }, VIEWPORT_INTERVAL);
+        }
+    }
+
+    // Wheel zooms around the pointer, dragging pans
+    canvas.addEventListener('wheel', (event) => {
+        event.preventDefault();
+        const rect = canvas.getBoundingClientRect();
+        const cell = viewStart + (event.clientX - rect.left) * (canvas.width / rect.width) / cellWidth;
+        const factor = event.deltaY > 0 ? 1.25 : 0.8;
+        setView(cell - (cell - viewStart) * factor, cell + (viewEnd - cell) * factor);
+    }, { passive: false });
+
+    let dragX = null;
+    canvas.addEventListener('mousedown', (event) => {
+        dragX = event.clientX;
+    });
+    window.addEventListener('mouseup', () => {
+        dragX = null;
+    });
+    window.addEventListener('mousemove', (event) => {
+        if (dragX === null) {
+            return;
+        }
+        const rect = canvas.getBoundingClientRect();
+        const cells = (dragX - event.clientX) * (canvas.width / rect.width) / cellWidth;
+        if (Math.abs(cells) >= 1) {
+            dragX = event.clientX;
+            setView(viewStart + cells, viewEnd + cells);
+        }
     });
 
+    // Session whose analytics are fetched; set when the server confirms a join
+    let currentSession = 'default';
+    let pendingFastForward = null;
+    const ANALYTICS_INTERVAL = 1000; // ms between /analytics fetches
+
+    /**
+     * Decode a base64 string into bytes.
+     */
+    function decodeBase64(data) {
+        const binary = atob(data);
+        const bytes = new Uint8Array(binary.length);
+        for (let i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return bytes;
+    }
+
+    /**
+     * Draw a space-time raster: one pixel per cell (x) and step (y, oldest on top).
+     * Cells hold velocity + 1 (0 = empty), colored like the cars.
+     * @param {HTMLCanvasElement} target - Canvas to draw on.
+     * @param {Object} raster - {rows, width, data} as sent by the server.
+     */
+    function drawRaster(target, raster) {
+        if (!target || raster.rows === 0) {
+            return;
+        }
+        target.width = raster.width;
+        target.height = raster.rows;
+        const cells = decodeBase64(raster.data);
+        const image = target.getContext('2d').createImageData(raster.width, raster.rows);
+        for (let i = 0; i < cells.length; i++) {
+            let r = 255, g = 255, b = 255;
+            if (cells[i] > 0) {
+                const velocity = cells[i] - 1;
+                r = velocity < 2 ? 255 : Math.floor(255 * (1 - (velocity - 2)));
+                g = velocity < 2 ? Math.floor(255 * (velocity / 2)) : 255;
+                b = 0;
+            }
+            image.data[4 * i] = Math.max(r, 0);
+            image.data[4 * i + 1] = g;
+            image.data[4 * i + 2] = b;
+            image.data[4 * i + 3] = 255;
+        }
+        target.getContext('2d').putImageData(image, 0, 0);
+    }
+
+    /**
+     * Fetch the session's aggregates and draw them.
+     */
+    function updateAnalytics() {
+        if (currentSession === null) {
+            return;
+        }
+        fetch(`/analytics?session=${encodeURIComponent(currentSession)}`)
+            .then((response) => (response.ok ? response.json() : null))
+            .then((analytics) => {
+                if (!analytics) {
+                    return;
+                }
+                const lines = [];
+                for (const road of ['road1', 'road2']) {
+                    const data = analytics.roads[road];
+                    drawRaster(document.getElementById(`spacetime-${road}`), data.raster);
+                    const flows = data.detectors.flow.map((flow) => flow.toFixed(2)).join(' / ');
+                    lines.push(`${road}: detector flow ${flows} cars/step | ` +
+                               `${data.jams.starts.length} jams | ` +
+                               `jam wave ${data.jams.wave_speed.toFixed(2)} cells/step`);
+                }
+                document.getElementById('analytics-info').innerText = lines.join('\n');
+            })
+            .catch((err) => console.error('Analytics fetch failed:', err));
+    }
+
+    setInterval(updateAnalytics, ANALYTICS_INTERVAL);
+
     /**
      * Handle connection events.
      */
     socket.on('connect', () => {
         console.log('Connected to server.');
+
+        // ?session=<id> joins an existing session; simulation parameters in the query
+        // (e.g. ?L=200&N=80&acc_share=0.5) start a new one
+        const query = new URLSearchParams(window.location.search);
+        // ?fast_forward=<steps> runs the created or joined session ahead (skips the warm-up);
+        // the shared default simulation is left alone
+        pendingFastForward = query.get('fast_forward');
+        query.delete('fast_forward');
+        // ?replay=<name>[&speed=<x>][&step=<n>] plays a recording (see /replays) instead
+        if (query.has('replay')) {
+            socket.emit('join_replay', {
+                name: query.get('replay'),
+                speed: Number(query.get('speed') || 1),
+                step: query.has('step') ? Number(query.get('step')) : null
+            });
+        } else if (query.has('session')) {
+            socket.emit('join_session', { session_id: query.get('session') });
+        } else if ([...query.keys()].length > 0) {
+            socket.emit('create_session', Object.fromEntries(query));
+        }
+    });
+
+    /**
+     * Handle session events.
+     */
+    socket.on('session_joined', (data) => {
+        console.log(`Joined session ${data.session_id}`);
+        currentSession = data.session_id;
+        replay = null;
+        // Frames of the previous session are no delta base for this one
+        frameStep = null;
+        frameRoads = [];
+        // Start with the whole road in view; the server culls from there
+        roadLength = data.road_length || roadLength;
+        roadLanes = data.lanes || 1;
+        setView(0, roadLength);
+        if (pendingFastForward !== null && data.session_id !== 'default') {
+            socket.emit('fast_forward', { steps: Number(pendingFastForward) });
+            pendingFastForward = null;
+        }
+        if (data.session_id !== 'default') {
+            const url = new URL(window.location);
+            url.search = `?session=${data.session_id}`;
+            window.history.replaceState(null, '', url);
+        }
+    });
+
+    /**
+     * Handle replay events.
+     */
+    socket.on('replay_joined', (data) => {
+        console.log(`Replaying ${data.name}`);
+        // No live session: no analytics, no viewports
+        currentSession = null;
+        replay = data;
+        frameStep = null;
+        frameRoads = [];
+        lastState = null;
+        roadLength = data.road_length || roadLength;
+        roadLanes = data.lanes || 1;
+        setView(0, roadLength);
+        showReplay();
+    });
+
+    socket.on('replay_state', (data) => {
+        if (replay !== null) {
+            Object.assign(replay, data);
+            showReplay();
+        }
+    });
+
+    /**
+     * Show the playback position and speed under the road.
+     */
+    function showReplay() {
+        const last = replay.first_step + replay.steps - 1;
+        document.getElementById('analytics-info').innerText =
+            `Replay ${replay.name}: step ${replay.step} of ${replay.first_step}-${last} at ` +
+            `${replay.speed}x${replay.paused ? ' (paused)' : ''} | ` +
+            'space: pause, arrows: seek, +/-: speed';
+    }
+
+    // Space pauses, arrows seek by 5% of the recording, +/- double or halve the speed
+    window.addEventListener('keydown', (event) => {
+        if (replay === null) {
+            return;
+        }
+        let control = null;
+        if (event.key === ' ') {
+            control = { paused: !replay.paused };
+        } else if (event.key === 'ArrowLeft' || event.key === 'ArrowRight') {
+            const jump = Math.max(Math.round(replay.steps / 20), 1);
+            control = { step: replay.step + (event.key === 'ArrowLeft' ? -jump : jump) };
+        } else if (event.key === '+' || event.key === '-') {
+            const speed = event.key === '+' ? replay.speed * 2 : replay.speed / 2;
+            control = { speed: Math.min(Math.max(speed, 0.1), 100) };
+        }
+        if (control !== null) {
+            event.preventDefault();
+            socket.emit('replay_control', control);
+        }
+    });
+
+    socket.on('session_closed', (data) => {
+        console.log(`Session ${data.session_id} closed, back to the default simulation.`);
+        window.history.replaceState(null, '', window.location.pathname);
+        socket.emit('join_session', { session_id: 'default' });
+    });
+
+    socket.on('fast_forward_done', (data) => {
+        console.log(`Session ${data.session_id} fast-forwarded to step ${data.step}.`);
+    });
+
+    socket.on('session_error', (data) => {
+        console.error('Session error:', data.message);
     });
 
     socket.on('disconnect', () => {
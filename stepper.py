@@ -0,0 +1,300 @@
+# stepper.py
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from analytics import analytics_bytes
+from channel import SharedChannel, SnapshotChannel, snapshot_capacity
+from checkpoint import load_checkpoint, save_checkpoint
+from instrumentation import Instruments
+from scheduler import FixedTimestep
+from simulation import Simulation
+
+# Seconds between status updates (parameters, step timings) of the simulation process
+STATUS_INTERVAL = 1.0
+# Longest sleep of the stepping loop, so analytics requests are answered promptly
+MAX_SLEEP = 0.05
+
+
+def channel_names(name):
+    """
+    Shared memory names of the frame and status channels of simulation process `name`.
+    """
+    return f'{name}-frames', f'{name}-status'
+
+
+def status_capacity(simulation):
+    """
+    Bytes the status channel of `simulation` gets: the encoded status with room for the
+    instruments to fill their histograms, plus the analytics of both roads at four times
+    their memory (base64 rasters and JSON numbers take more space than the arrays).
+    A status that still does not fit goes out without analytics (see serve).
+    """
+    payload = {
+        'parameters': simulation.parameters(),
+        'step': simulation.step,
+        'instruments': simulation.instruments.to_dict(),
+    }
+    analytics = 2 * analytics_bytes(simulation.L, simulation.analytics_window,
+                                    len(simulation.sensors or range(4)))
+    return len(json.dumps(payload).encode()) + 4 * analytics + (4 << 20)
+
+
+def serve(simulation, name, frames_per_second=20, checkpoint=None, checkpoint_interval=60.0):
+    """
+    Step a simulation in real time in this process and publish it to web workers.
+
+    Snapshots go to a SnapshotChannel at frames_per_second; parameters and step timings
+    go to a status channel every STATUS_INTERVAL seconds, with the analytics whenever a
+    reader asks for them. Readers attach with RemoteSimulation. Runs until SIGTERM, Ctrl-C
+    or an error stops the simulation.
+
+    Parameters:
+        simulation (Simulation): Simulation to step; not running.
+        name (str): Name the web workers attach to (see channel_names).
+        frames_per_second (float, optional): Snapshots published per second.
+        checkpoint (str, optional): File the simulation is checkpointed to every
+            checkpoint_interval seconds and on shutdown.
+        checkpoint_interval (float, optional): Seconds between checkpoints.
+    """
+    frames_name, status_name = channel_names(name)
+    frames = SnapshotChannel.create(frames_name, snapshot_capacity(simulation))
+    status = SharedChannel.create(status_name, status_capacity(simulation))
+    parameters = simulation.parameters()
+
+    def publish_status(analytics=False):
+        payload = {
+            'parameters': parameters,
+            'step': simulation.step,
+            'instruments': simulation.instruments.to_dict(),
+            'analytics': simulation.get_analytics() if analytics else None,
+            # Requests the analytics answer, so readers can tell it from an earlier answer
+            'analytics_request': status.last_requests if analytics else None,
+        }
+        data = json.dumps(payload).encode()
+        if len(data) > status.slot_size and analytics:
+            logging.warning(f"Analytics of {len(data)} bytes do not fit the status channel "
+                            f"({status.slot_size} bytes); publishing the status without them.")
+            payload['analytics'] = None
+            payload['analytics_error'] = "The analytics are too large to publish."
+            data = json.dumps(payload).encode()
+        try:
+            status.publish([data])
+        except ValueError as e:
+            # Keep stepping; readers keep the previous status
+            logging.error(f"Status not published: {e}")
+
+    # Unwind through the finally below, so the channels are removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    scheduler = simulation.scheduler
+    scheduler.set_frames_per_second(frames_per_second)
+    frames.publish_snapshot(simulation.snapshot)
+    publish_status()
+    logging.info(f"Simulation process {name} publishing from step {simulation.step}.")
+
+    simulation.running = True
+    scheduler.reset()
+    now = time.monotonic()
+    next_status = now + STATUS_INTERVAL
+    next_checkpoint = now + checkpoint_interval
+    last_frame_step = simulation.step
+    try:
+        while simulation.running:
+            for _ in range(scheduler.steps_due()):
+                simulation.run_step()
+            if scheduler.frame_due() and simulation.step != last_frame_step:
+                last_frame_step = simulation.step
+                with simulation.instruments.time('publish_frame'):
+                    frames.publish_snapshot(simulation.snapshot)
+            now = time.monotonic()
+            analytics = status.requested()
+            if analytics or now >= next_status:
+                publish_status(analytics)
+                next_status = now + STATUS_INTERVAL
+            if checkpoint and now >= next_checkpoint:
+                save_checkpoint(simulation, checkpoint)
+                next_checkpoint = now + checkpoint_interval
+            time.sleep(min(scheduler.sleep_time(), MAX_SLEEP))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # A second signal must not cut the shutdown short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        frames.close()
+        status.close()
+        if checkpoint:
+            save_checkpoint(simulation, checkpoint)
+        logging.info(f"Simulation process {name} stopped at step {simulation.step}.")
+
+
+class RemoteSimulation:
+    """
+    Read-only stand-in for a Simulation that serve() steps in another process.
+
+    Offers what SessionManager and app.py read from a simulation: the latest snapshot and
+    step, the road shape (L, N, lanes, boundary), the step rate, a frame scheduler, local
+    instruments (this process' encode and emit timings and frame counters) and the
+    analytics, fetched on request. When the simulation process restarts, it reattaches to
+    the new channels.
+    """
+
+    def __init__(self, name, sleep=time.sleep, timeout=5.0):
+        """
+        Initialize a RemoteSimulation instance.
+
+        Parameters:
+            name (str): Name the simulation process publishes under.
+            sleep (callable, optional): Sleep function (socketio.sleep in a server).
+            timeout (float, optional): Seconds to wait for the process' first status.
+
+        Raises:
+            FileNotFoundError: If no simulation process publishes under `name`.
+            TimeoutError: If the process publishes no status in time.
+        """
+        self.name = name
+        self.sleep = sleep
+        self.frames = None
+        self.status = None
+        self.status_version = None
+        self.process_status = None
+        self.attach()
+
+        deadline = time.monotonic() + timeout
+        while self._read_status() is None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Simulation process {name} publishes no status.")
+            self.sleep(0.02)
+        parameters = self.process_status['parameters']
+        self.L = parameters['L']
+        self.N = parameters['N']
+        self.lanes = parameters['lanes']
+        self.boundary = parameters['boundary']
+        self.steps_per_second = parameters['steps_per_second']
+        # Paces the relayed frames only; the process steps on its own clock
+        self.scheduler = FixedTimestep(self.steps_per_second)
+        self.instruments = Instruments()
+        self.lock = threading.Lock()
+        self.running = True
+
+    def attach(self):
+        frames_name, status_name = channel_names(self.name)
+        frames = SnapshotChannel.attach(frames_name)
+        status = SharedChannel.attach(status_name)
+        self.close()
+        self.frames, self.status = frames, status
+        self.status_version = None
+
+    def _reattach(self):
+        # A restarted simulation process publishes into new segments; one that died while
+        # publishing leaves its last value stuck mid-write
+        if self.frames.closed or self.frames.stalled or self.status.stalled:
+            try:
+                self.attach()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        for channel in (self.frames, self.status):
+            if channel is not None:
+                channel.close()
+
+    @property
+    def snapshot(self):
+        self._reattach()
+        return self.frames.latest()
+
+    @property
+    def step(self):
+        return self.snapshot.step
+
+    def _read_status(self):
+        value = self.status.read(self.status_version)
+        if value is not None:
+            self.status_version, data = value
+            self.process_status = json.loads(data)
+        return self.process_status
+
+    def get_analytics(self, timeout=2.0):
+        """
+        Ask the simulation process for its analytics and wait for them.
+
+        Raises:
+            RuntimeError: If the process does not answer within `timeout` seconds, or its
+                analytics do not fit the status channel.
+        """
+        self._reattach()
+        request = self.status.request()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = self._read_status()
+            if (status is not None and status['analytics_request'] is not None
+                    and status['analytics_request'] >= request):
+                if status['analytics'] is None:
+                    raise RuntimeError(status['analytics_error'])
+                return status['analytics']
+            self.sleep(0.02)
+        raise RuntimeError(f"Simulation process {self.name} did not send its analytics.")
+
+    def exported_instruments(self):
+        """
+        Instruments for /metrics: the simulation process' step timings and rate (as of
+        its last status) together with this process' own timings.
+        """
+        status = self._read_status()
+        combined = Instruments()
+        if status is not None:
+            remote = Instruments.from_dict(status['instruments'])
+            combined.timers.update(remote.timers)
+            combined.sizes.update(remote.sizes)
+            combined.steps = remote.steps
+        combined.timers.update(self.instruments.timers)
+        combined.sizes.update(self.instruments.sizes)
+        combined.counters.update(self.instruments.counters)
+        return combined
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Step the shared (default) simulation in its own process and publish "
+                    "it through shared memory to the web workers on this host, which then "
+                    "only fan out frames. Start the workers with SIMULATION_PROCESS=<name>.")
+    parser.add_argument('--name', default='traffic',
+                        help="Name the web workers attach to")
+    parser.add_argument('--params', default='{}',
+                        help="Simulation parameters as JSON, e.g. '{\"L\": 1000, \"engine\": "
+                             "\"vector\"}'")
+    parser.add_argument('--steps-per-second', type=float, default=6)
+    parser.add_argument('--frames-per-second', type=float, default=20)
+    parser.add_argument('--checkpoint', default=None, metavar='FILE',
+                        help="Checkpoint file, restored from on start if it exists")
+    parser.add_argument('--checkpoint-interval', type=float, default=60.0)
+    parser.add_argument('--analytics-window', type=int, default=200,
+                        help="Steps of analytics history served on /analytics (0: off)")
+    args = parser.parse_args(argv)
+
+    # Simulation configures DEBUG logging and Car logs every speed offset
+    logging.getLogger().setLevel(logging.INFO)
+    try:
+        params = json.loads(args.params)
+        params.setdefault('steps_per_second', args.steps_per_second)
+        params.setdefault('analytics_window', args.analytics_window)
+        if args.checkpoint and os.path.exists(args.checkpoint):
+            simulation = load_checkpoint(args.checkpoint,
+                                         steps_per_second=params['steps_per_second'])
+        else:
+            simulation = Simulation(**params)
+    except (TypeError, ValueError) as e:
+        parser.error(str(e))
+    serve(simulation, args.name, args.frames_per_second, args.checkpoint,
+          args.checkpoint_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# tests/test_analytics.py
+
+import numpy as np
+import pytest
+
+from analytics import MAX_COLUMNS, SpaceTimeRaster, analytics_bytes
+from sessions import SESSION_MAX_ANALYTICS_BYTES, session_parameters
+
+
+def test_raster_bins_long_roads_by_slowest_car():
+    raster = SpaceTimeRaster(10 * MAX_COLUMNS, window=5)
+    raster.update(np.array([0, 5, 25]), np.array([3, 1, 0]))
+    row = raster.rows()[-1]
+    assert row.shape == (MAX_COLUMNS,)
+    assert row[:3].tolist() == [2, 0, 1]
+
+
+def test_short_roads_keep_one_column_per_cell():
+    raster = SpaceTimeRaster(100, window=5)
+    raster.update(np.array([3, 99]), np.array([2, 7]))
+    assert raster.rows().shape == (1, 100)
+    assert raster.rows()[0, [3, 99]].tolist() == [3, 8]
+
+
+def test_session_analytics_memory_is_checked():
+    assert 2 * analytics_bytes(100000, 200) <= SESSION_MAX_ANALYTICS_BYTES
+    session_parameters({'L': 100000, 'N': 100, 'engine': 'vector'}, analytics_window=200)
+    with pytest.raises(ValueError):
+        session_parameters({'L': 100000, 'N': 100, 'engine': 'vector'}, analytics_window=10000)
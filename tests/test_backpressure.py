@@ -0,0 +1,39 @@
+# tests/test_backpressure.py
+
+from backpressure import ClientStream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_late_ack_after_timeout_does_not_ack_newer_frame():
+    clock = FakeClock()
+    stream = ClientStream(window=1, ack_timeout=5.0, clock=clock)
+    stream.offer(b'first')
+    [(old, _)] = stream.ready()
+
+    clock.now = 6.0  # The first frame times out; the second takes its place
+    stream.offer(b'second')
+    [(new, data)] = stream.ready()
+    assert data == b'second'
+
+    clock.now = 7.0
+    assert stream.acknowledge(old) is None
+    stream.offer(b'third')
+    assert stream.ready() == []  # The window stays closed until the second frame is acked
+    assert stream.acknowledge(new) == 1.0
+    assert [data for _, data in stream.ready()] == [b'third']
+
+
+def test_unknown_acks_are_ignored():
+    stream = ClientStream(window=2)
+    stream.offer(b'frame')
+    [(sequence, _)] = stream.ready()
+    assert stream.acknowledge(sequence + 1) is None
+    assert stream.acknowledge('bogus') is None
+    assert stream.acknowledge(sequence) is not None
@@ -0,0 +1,21 @@
+# tests/test_batch.py
+
+import pytest
+
+import batch
+
+
+def test_run_headless_rejects_open_roads():
+    with pytest.raises(ValueError, match='ring roads'):
+        batch.run_headless(steps=5, boundary='open', inflow={'rate': 0.3}, N=0)
+
+
+def test_grid_rejects_boundary():
+    with pytest.raises(ValueError, match='Unknown grid parameters'):
+        batch.expand_grid({'boundary': ['open']})
+
+
+def test_run_headless_ring_summary():
+    summary = batch.run_headless(steps=20, seed=1)
+    assert summary['steps'] == 20
+    assert summary['density'] == pytest.approx(0.24)
@@ -0,0 +1,55 @@
+# tests/test_checkpoint.py
+
+import numpy as np
+import pytest
+
+from checkpoint import load_checkpoint, save_checkpoint
+from simulation import Simulation
+
+
+def test_car_fields_restored_for_every_car(tmp_path):
+    simulation = Simulation(L=100, N=24, engine='car', acc_share=0.5, seed=3)
+    car = next(car for car in simulation.cars_road1 if not car.adaptive_cruise_control)
+    car.last_error, car.integral_error = 0.5, -1.25
+    path = str(tmp_path / 'car.npz')
+    save_checkpoint(simulation, path)
+    restored = load_checkpoint(path).cars_road1[list(simulation.cars_road1).index(car)]
+    assert (restored.last_error, restored.integral_error) == (0.5, -1.25)
+
+
+VARIANTS = {
+    'car': dict(engine='car', acc_share=0.5),
+    'vector': dict(engine='vector', acc_share=0.5),
+    'lanes': dict(engine='vector', lanes=3, N=120, acc_share=0.3),
+    'open': dict(engine='vector', boundary='open', L=200, N=20, acc_share=0.5, inflow=0.3),
+}
+
+
+def trajectory(simulation, steps):
+    states = []
+    for _ in range(steps):
+        simulation.run_step()
+        states.append((simulation.step, [{name: array.copy() for name, array in road.items()}
+                                         for road in simulation.snapshot.roads],
+                       simulation.metrics))
+    return states
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_restored_simulation_resumes_bit_identically(tmp_path, seed, variant):
+    simulation = Simulation(seed=seed, **VARIANTS[variant])
+    trajectory(simulation, 57)
+    path = str(tmp_path / 'checkpoint.npz')
+    save_checkpoint(simulation, path)
+    restored = load_checkpoint(path)
+
+    expected, actual = trajectory(simulation, 150), trajectory(restored, 150)
+    for (step, roads, metrics), (restored_step, restored_roads, restored_metrics) in zip(
+            expected, actual):
+        assert restored_step == step
+        assert restored_metrics == metrics
+        for road, restored_road in zip(roads, restored_roads):
+            assert road.keys() == restored_road.keys()
+            for name in road:
+                np.testing.assert_array_equal(restored_road[name], road[name], err_msg=name)
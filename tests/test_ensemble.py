@@ -0,0 +1,40 @@
+# tests/test_ensemble.py
+
+import math
+import re
+
+import pytest
+
+import ensemble
+
+
+def interval_width(output, metric='speed'):
+    low, high = re.search(rf'{metric}: \S+  \[(\S+), (\S+)\]', output).groups()
+    return float(high) - float(low)
+
+
+def test_higher_level_gives_wider_interval(capsys):
+    widths = []
+    for level in ('0.5', '0.99'):
+        assert ensemble.main(['--replicas', '20', '--steps', '100', '--seed', '1',
+                              '--level', level]) == 0
+        widths.append(interval_width(capsys.readouterr().out))
+    assert 0 < widths[0] < widths[1]
+
+
+def test_summary_interval_grows_with_level():
+    summaries = [ensemble.Ensemble(20, seed=1).run(100, level=level) for level in (0.5, 0.99)]
+    narrow, wide = (summary['flow'] for summary in summaries)
+    assert narrow['mean'] == wide['mean']
+    assert wide['ci_low'] < narrow['ci_low'] < narrow['ci_high'] < wide['ci_high']
+
+
+def test_single_replica_has_no_interval():
+    interval = ensemble.confidence_interval([3.0])
+    assert interval['mean'] == 3.0
+    assert all(math.isnan(interval[key]) for key in ('std', 'ci_low', 'ci_high'))
+
+
+def test_cli_needs_two_replicas():
+    with pytest.raises(SystemExit):
+        ensemble.main(['--replicas', '1'])
@@ -0,0 +1,34 @@
+# tests/test_equivalence.py
+
+import numpy as np
+import pytest
+
+from simulation import Simulation
+
+CONFIGS = [dict(N=24, acc_share=1.0), dict(N=70, acc_share=0.5), dict(N=90, acc_share=0.0),
+           dict(N=50, L=50, acc_share=0.3, acc_share_road2=0.7),
+           dict(N=40, acc_share=0.5, placement='jam')]
+
+
+def assert_same_state(a, b):
+    assert a.step == b.step
+    for road_a, road_b in zip(a.snapshot.roads, b.snapshot.roads):
+        for name in ('positions', 'velocities', 'adaptive_cruise_control'):
+            np.testing.assert_array_equal(road_a[name], road_b[name], err_msg=name)
+    assert a.metrics == b.metrics
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('config', CONFIGS, ids=lambda config: ','.join(map(str, config.values())))
+def test_car_and_vector_engines_are_bit_identical(seed, config):
+    car = Simulation(engine='car', seed=seed, **config)
+    vector = Simulation(engine='vector', seed=seed, **config)
+    for _ in range(200):
+        car.run_step()
+        vector.run_step()
+        assert_same_state(car, vector)
+    for totals_car, totals_vector in zip(
+            (car.road_totals(car.cars_road1), car.road_totals(car.cars_road2)),
+            (vector.road_totals(vector.cars_road1), vector.road_totals(vector.cars_road2))):
+        for name, values in totals_car.items():
+            np.testing.assert_array_equal(values, totals_vector[name], err_msg=name)
@@ -0,0 +1,16 @@
+# tests/test_kernels.py
+
+import pytest
+
+import kernels
+
+# Default controller, then gains that exercise every term
+ACC_PARAMETERS = (None, {'kp': 0.8, 'ki': 0.05, 'kd': 0.4, 'threshold': 0.3, 'fault_factor': 0.5})
+
+
+@pytest.mark.parametrize('acc', ACC_PARAMETERS, ids=('default_acc', 'tuned_acc'))
+def test_update_ring_matches_numpy_rules(acc):
+    results = kernels.verify(acc=acc)
+    assert len(results) == 27
+    mismatches = [case for case in results if case[-1] is not None]
+    assert not mismatches, f"(seed, L, N, acc_share, first differing step): {mismatches}"
@@ -0,0 +1,29 @@
+# tests/test_recorder.py
+
+import numpy as np
+
+from recorder import Recorder, Recording
+from simulation import Simulation
+
+
+def test_empty_row_ranges(tmp_path):
+    simulation = Simulation(L=50, N=10, seed=1)
+    Recorder(str(tmp_path / 'empty'), simulation).close(simulation)
+    recording = Recording(str(tmp_path / 'empty'))
+    assert len(recording) == 0
+    velocities = recording.rows('road1.velocities', 0, 10)
+    assert velocities.shape == (0, 10)
+    assert recording.rows('step', 0, 10).shape == (0,)
+
+    recorder = Recorder(str(tmp_path / 'run'), simulation)
+    for _ in range(3):
+        simulation.run_step()
+        recorder.record(simulation)
+    recorder.close(simulation)
+    recording = Recording(str(tmp_path / 'run'))
+    empty = recording.rows('road1.velocities', 2, 2)
+    assert empty.shape == (0, 10)
+    assert empty.dtype == recording.rows('road1.velocities', 0, 3).dtype
+    assert recording.rows('step', 0, 3).tolist() == [1, 2, 3]
+    assert recording.rows('road2.average_speed', 5, 9).dtype == np.dtype(
+        recording.meta['metric_columns']['average_speed'])
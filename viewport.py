@@ -0,0 +1,91 @@
+# viewport.py
+
+import math
+
+import numpy as np
+
+# Zoom (pixels per cell) from which a viewport gets individual cars instead of histograms
+DETAIL_ZOOM = 2.0
+# More cars than this in range are sent as a histogram whatever the zoom
+MAX_DETAIL_CARS = 20000
+# Screen width of one histogram bucket, and the most buckets per road
+BUCKET_PIXELS = 4
+MAX_BUCKETS = 2048
+
+
+class Viewport:
+    """
+    The cells [start, end) a client is looking at and its zoom level (pixels per cell).
+
+    Cars in range are found by binary search (np.searchsorted) in the snapshot's sorted
+    positions, so a viewport frame costs O(log N + cars or buckets in range), not O(N).
+    """
+
+    __slots__ = ('start', 'end', 'zoom')
+
+    def __init__(self, start, end, zoom):
+        self.start = start
+        self.end = end
+        self.zoom = zoom
+
+    @classmethod
+    def create(cls, data, road_length):
+        """
+        Build a viewport from a client's {'start', 'end', 'zoom'}, clipped to the road.
+
+        Raises:
+            ValueError: On missing or non-numeric values, an empty range or a zoom that is
+                not a positive number.
+        """
+        try:
+            start = int(data['start'])
+            end = int(data['end'])
+            zoom = float(data['zoom'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("A viewport needs numeric start, end and zoom.") from None
+        start = max(start, 0)
+        end = min(end, road_length)
+        if start >= end:
+            raise ValueError("The viewport holds no cells of the road.")
+        if not (math.isfinite(zoom) and zoom > 0):
+            raise ValueError("zoom must be a positive number of pixels per cell.")
+        return cls(start, end, zoom)
+
+    def buckets(self):
+        """
+        Number of histogram buckets: one per BUCKET_PIXELS on screen, at most one per cell.
+        """
+        pixels = (self.end - self.start) * self.zoom
+        return max(1, min(math.ceil(pixels / BUCKET_PIXELS), MAX_BUCKETS, self.end - self.start))
+
+    def edges(self, buckets):
+        """
+        Bucket boundaries (buckets + 1 cells); bucket k holds [edges[k], edges[k + 1]).
+        """
+        span = self.end - self.start
+        return self.start + np.arange(buckets + 1, dtype=np.int64) * span // buckets
+
+    def select(self, snapshot, index):
+        """
+        Cull road `index` of a snapshot to the viewport.
+
+        Returns:
+            dict: Either {'positions', 'velocities', 'adaptive_cruise_control'} of the cars
+                in range, in position order, or, at low zoom or with too many cars in
+                range, {'counts', 'mean_speeds'} per bucket (see edges()).
+        """
+        order, positions, velocity_sums = snapshot.sorted_road(index)
+        low, high = np.searchsorted(positions, [self.start, self.end])
+        if self.zoom >= DETAIL_ZOOM and high - low <= MAX_DETAIL_CARS:
+            road = snapshot.roads[index]
+            cars = order[low:high]
+            return {
+                'positions': positions[low:high],
+                'velocities': road['velocities'][cars],
+                'adaptive_cruise_control': road['adaptive_cruise_control'][cars],
+            }
+        bounds = np.searchsorted(positions, self.edges(self.buckets()))
+        counts = np.diff(bounds)
+        speeds = np.diff(velocity_sums[bounds])
+        mean_speeds = np.divide(speeds, counts, out=np.zeros(len(counts)), where=counts > 0)
+        return {'counts': counts, 'mean_speeds': mean_speeds}
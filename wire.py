@@ -0,0 +1,212 @@
+# wire.py
+
+import struct
+
+import numpy as np
+
+# Binary simulation frame (little endian), sent as one Socket.IO binary message:
+#
+#   header   version u8 | flags u8 | num_roads u16 | step u32 | base_step u32
+#   per road average_speed f32 | density f32 | stopped_vehicles u32 | count u32
+#            keyframe: positions[count] | velocities i8[count] | acc bits u8[ceil(count / 8)]
+#            delta:    indices[count] | positions[count] | velocities i8[count]
+#
+# Positions and indices are u16, or u32 when the WIDE_* flag is set. A delta lists only
+# the cars whose position or velocity changed since the frame at base_step; clients that
+# do not hold that frame drop it and wait for (or request) the next keyframe. Deltas carry
+# no ACC flags, so when cars have entered or left a road (its 'ids' changed) the frame is
+# a keyframe.
+#
+# A viewport frame (VIEWPORT flag, one client's cell range, see viewport.py) is
+# self-contained (base_step = step) and adds after the header
+#            road_length u32 | start u32 | end u32
+# and per road, after the road header, a kind u8 and then
+#            cars (0):      offsets[count] | velocities i8[count] | acc bits u8[ceil(count / 8)]
+#            histogram (1): counts u32[count] | mean_speeds f32[count]
+# Offsets are positions minus start, in position order; WIDE_POSITIONS is set when the
+# range spans more than 65536 cells. Histogram bucket k covers the cells
+# [start + k * (end - start) // count, start + (k + 1) * (end - start) // count).
+VERSION = 1
+KEYFRAME = 0x01
+WIDE_POSITIONS = 0x02
+WIDE_INDICES = 0x04
+VIEWPORT = 0x08
+
+VIEWPORT_CARS = 0
+VIEWPORT_HISTOGRAM = 1
+
+HEADER = struct.Struct('<BBHII')
+ROAD_HEADER = struct.Struct('<ffII')
+VIEWPORT_HEADER = struct.Struct('<III')
+VIEWPORT_ROAD = struct.Struct('<B')
+
+
+class FrameEncoder:
+    """
+    Encode simulation frames as keyframes plus deltas against the previous frame.
+
+    One encoder serves one broadcast stream: every frame it returns is a delta against
+    the frame it returned before. Clients that miss frames get deltas rebuilt against
+    what they hold (see backpressure.ClientStream).
+    """
+
+    def __init__(self, keyframe_interval=50):
+        """
+        Initialize a FrameEncoder instance.
+
+        Parameters:
+            keyframe_interval (int, optional): A keyframe is sent at least every this many
+                frames, so clients that missed a frame resynchronize on their own.
+        """
+        self.keyframe_interval = keyframe_interval
+        self.last_frame = None
+        self.frames_since_keyframe = 0
+        self.force_next_keyframe = False
+        self.last_keyframe = None  # Encoded keyframe of last_frame, built on demand
+        self.last_base = None  # Step the last encoded frame is a delta against (None: keyframe)
+
+    def request_keyframe(self):
+        self.force_next_keyframe = True
+
+    def encode(self, frame):
+        """
+        Encode a frame from Simulation.get_frame, as a delta when possible.
+
+        Returns:
+            bytes: The encoded frame.
+        """
+        last = self.last_frame
+        keyframe = (
+            self.force_next_keyframe
+            or self.frames_since_keyframe + 1 >= self.keyframe_interval
+            or needs_keyframe(frame, last)
+        )
+
+        if keyframe:
+            data = encode_keyframe(frame)
+            self.frames_since_keyframe = 0
+            self.force_next_keyframe = False
+            self.last_keyframe = data
+            self.last_base = None
+        else:
+            data = encode_delta(frame, last)
+            self.frames_since_keyframe += 1
+            self.last_keyframe = None
+            self.last_base = last['step']
+        self.last_frame = frame
+        return data
+
+    def keyframe(self):
+        """
+        Return the last encoded frame as a keyframe (e.g. for a client that just joined),
+        so the stream's next delta applies on top of it. None if nothing was encoded yet.
+        """
+        if self.last_frame is None:
+            return None
+        # Encoded once per frame, however many clients join during it
+        if self.last_keyframe is None:
+            self.last_keyframe = encode_keyframe(self.last_frame)
+        return self.last_keyframe
+
+
+def needs_keyframe(frame, base):
+    """
+    Whether `frame` cannot be sent as a delta against `base` (None: no base): the roads
+    differ in number or car count, or cars entered or left a road (its 'ids' changed).
+    """
+    return (
+        base is None
+        or len(frame['roads']) != len(base['roads'])
+        or any(len(road['positions']) != len(base_road['positions'])
+               or ('ids' in road and not np.array_equal(road['ids'], base_road.get('ids')))
+               for road, base_road in zip(frame['roads'], base['roads']))
+    )
+
+
+def _flags(frame, counts):
+    flags = 0
+    if any(len(road['positions']) and int(road['positions'].max()) > 0xFFFF
+           for road in frame['roads']):
+        flags |= WIDE_POSITIONS
+    if max(counts, default=0) > 0xFFFF:
+        flags |= WIDE_INDICES
+    return flags
+
+
+def _road_header(frame, index, count):
+    metrics = frame['metrics'][index]
+    return ROAD_HEADER.pack(metrics['average_speed'], metrics['density'],
+                            metrics['stopped_vehicles'], count)
+
+
+def encode_keyframe(frame):
+    roads = frame['roads']
+    flags = KEYFRAME | _flags(frame, [len(road['positions']) for road in roads])
+    position_type = '<u4' if flags & WIDE_POSITIONS else '<u2'
+
+    parts = [HEADER.pack(VERSION, flags, len(roads), frame['step'], frame['step'])]
+    for index, road in enumerate(roads):
+        parts.append(_road_header(frame, index, len(road['positions'])))
+        parts.append(road['positions'].astype(position_type).tobytes())
+        parts.append(road['velocities'].astype(np.int8).tobytes())
+        parts.append(np.packbits(road['adaptive_cruise_control'], bitorder='little').tobytes())
+    return b''.join(parts)
+
+
+def encode_delta(frame, base):
+    roads = frame['roads']
+    changed = [
+        np.flatnonzero((road['positions'] != base_road['positions'])
+                       | (road['velocities'] != base_road['velocities']))
+        for road, base_road in zip(roads, base['roads'])
+    ]
+    # Indices are bounded by the car count, not by the number of changes
+    flags = _flags(frame, [len(road['positions']) for road in roads])
+    position_type = '<u4' if flags & WIDE_POSITIONS else '<u2'
+    index_type = '<u4' if flags & WIDE_INDICES else '<u2'
+
+    parts = [HEADER.pack(VERSION, flags, len(roads), frame['step'], base['step'])]
+    for index, (road, indices) in enumerate(zip(roads, changed)):
+        parts.append(_road_header(frame, index, len(indices)))
+        parts.append(indices.astype(index_type).tobytes())
+        parts.append(road['positions'][indices].astype(position_type).tobytes())
+        parts.append(road['velocities'][indices].astype(np.int8).tobytes())
+    return b''.join(parts)
+
+
+def encode_viewport(snapshot, viewport, road_length):
+    """
+    Encode the part of a snapshot inside a client's viewport (see viewport.Viewport).
+
+    Parameters:
+        snapshot (Snapshot): Snapshot to encode.
+        viewport (Viewport): The client's cell range and zoom.
+        road_length (int): Length of the roads, so the client can scale and pan.
+
+    Returns:
+        bytes: The encoded frame.
+    """
+    frame = snapshot.frame
+    flags = VIEWPORT
+    if viewport.end - viewport.start > 0x10000:
+        flags |= WIDE_POSITIONS
+    position_type = '<u4' if flags & WIDE_POSITIONS else '<u2'
+
+    num_roads = len(snapshot.roads)
+    parts = [HEADER.pack(VERSION, flags, num_roads, frame['step'], frame['step']),
+             VIEWPORT_HEADER.pack(road_length, viewport.start, viewport.end)]
+    for index in range(num_roads):
+        selection = viewport.select(snapshot, index)
+        if 'counts' in selection:
+            parts.append(_road_header(frame, index, len(selection['counts'])))
+            parts.append(VIEWPORT_ROAD.pack(VIEWPORT_HISTOGRAM))
+            parts.append(selection['counts'].astype('<u4').tobytes())
+            parts.append(selection['mean_speeds'].astype('<f4').tobytes())
+        else:
+            parts.append(_road_header(frame, index, len(selection['positions'])))
+            parts.append(VIEWPORT_ROAD.pack(VIEWPORT_CARS))
+            parts.append((selection['positions'] - viewport.start).astype(position_type).tobytes())
+            parts.append(selection['velocities'].astype(np.int8).tobytes())
+            parts.append(np.packbits(selection['adaptive_cruise_control'],
+                                     bitorder='little').tobytes())
+    return b''.join(parts)